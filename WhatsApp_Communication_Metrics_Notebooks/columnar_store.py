@@ -0,0 +1,237 @@
+"""Memory-mapped columnar backend for dataloader.py.
+The messages are stored as one NumPy .npy file per column (integer-coded donation, conversation and sender,
+sender role, epoch-second timestamp, word count), sorted by donor, plus an offsets array indexed by donor code.
+Fetching a donor is a zero-copy slice of the mapped files, and kernels on the same machine share the OS page cache
+instead of each holding its own copy of 'messages'.
+Selected in dataloader.py with the WHATSAPP_DATA_BACKEND=columnar environment variable.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+#every build is a new version directory, so a store that other kernels have mapped is never deleted in place
+from versioned_dir import current_version, discard_version, new_version, publish_version
+
+#row columns (file name -> dtype) and code tables of the store
+COLUMNS = {
+    "donation": np.int32,      #code into donations.npy
+    "conversation": np.int32,  #code into conversations.npy (sorted, so code order is conversation_id order), -1 = missing
+    "sender": np.int32,        #code into senders.npy, -1 = missing
+    "sent": np.bool_,          #sender is the donor
+    "ts": np.int64,            #seconds since epoch, NaT for unparseable datetimes (same bits as datetime64 NaT)
+    "word_count": np.float64,
+}
+TABLES = ["donors", "donations", "conversations", "senders"]
+NAT = np.iinfo(np.int64).min
+
+def _source_key(messages_csv, donations):
+    #the store is rebuilt when the messages file or the WhatsApp donations change
+    stat = Path(messages_csv).stat()
+    pairs = donations[["donation_id", "donor_id"]].astype(str).sort_values(["donation_id", "donor_id"])
+    return {
+        "messages_csv": str(messages_csv),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "donations": hashlib.sha1(pairs.to_csv(index=False).encode()).hexdigest(),
+    }
+
+def _codes(values, table):
+    #integer codes of values, unseen values are appended to table (dict value -> code), missing values get -1
+    values = pd.Series(values, dtype=object)
+    missing = values.isna().to_numpy()
+    for value in pd.unique(values[~missing]):
+        table.setdefault(value, len(table))
+    codes = values.map(table).to_numpy(dtype=float, na_value=-1)
+    codes[missing] = -1
+    return codes.astype(np.int32)
+
+def _timestamps(datetimes):
+    dt = pd.to_datetime(datetimes, errors="coerce")
+    if getattr(dt.dt, "tz", None) is not None:
+        dt = dt.dt.tz_localize(None)
+    return dt.to_numpy(dtype="datetime64[s]").astype(np.int64)
+
+def build_store(path, messages_csv, donations, chunksize=1_000_000):
+    """
+    Builds the store at path from the messages CSV in two streamed passes (count rows per donor, then write every chunk
+    at its donor offsets), so the full table is never in memory. Rows keep their file order within a donor.
+    The store is written to a new version directory of path that replaces the current one when complete (see versioned_dir.py).
+    Returns the version directory.
+    """
+    tmp = new_version(path)
+    try:
+        _write_store(tmp, messages_csv, donations, chunksize)
+    except BaseException:
+        discard_version(tmp)
+        raise
+    return publish_version(path, tmp)
+
+def _write_store(tmp, messages_csv, donations, chunksize):
+    #writes all files of the store into the directory tmp
+    donation_to_donor = donations.drop_duplicates("donation_id").set_index("donation_id")["donor_id"]
+    donors = np.array(sorted(donations["donor_id"].unique()))
+    donor_index = pd.Index(donors)
+
+    def chunks():
+        for chunk in pd.read_csv(messages_csv, chunksize=chunksize):
+            donor = chunk["donation_id"].map(donation_to_donor)
+            keep = donor.notna().to_numpy()
+            yield chunk[keep], donor_index.get_indexer(donor[keep])
+
+    counts = np.zeros(len(donors), dtype=np.int64)
+    for _, donor in chunks():
+        counts += np.bincount(donor, minlength=len(donors))
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    arrays = {name: np.lib.format.open_memmap(tmp / f"{name}.npy", mode="w+", dtype=dtype, shape=(int(offsets[-1]),))
+              for name, dtype in COLUMNS.items()}
+    tables = {"donations": {}, "conversations": {}, "senders": {}}
+    filled = offsets[:-1].copy()
+    for chunk, donor in chunks():
+        #position of every row: its donor's next free slot, in file order
+        order = np.argsort(donor, kind="stable")
+        sorted_donor = donor[order]
+        first = np.searchsorted(sorted_donor, sorted_donor)
+        positions = np.empty(len(donor), dtype=np.int64)
+        positions[order] = filled[sorted_donor] + np.arange(len(donor)) - first
+        filled += np.bincount(donor, minlength=len(donors))
+
+        sender = chunk["sender_id"].to_numpy(dtype=object)
+        arrays["donation"][positions] = _codes(chunk["donation_id"], tables["donations"])
+        arrays["conversation"][positions] = _codes(chunk["conversation_id"], tables["conversations"])
+        arrays["sender"][positions] = _codes(sender, tables["senders"])
+        arrays["sent"][positions] = sender == donors[donor]
+        arrays["ts"][positions] = _timestamps(chunk["datetime"])
+        arrays["word_count"][positions] = chunk["word_count"].to_numpy(dtype=float)
+
+    #conversation codes are remapped to sorted order so aggregations by code come out sorted by conversation_id
+    conversations = np.array(list(tables["conversations"]))
+    rank = np.empty(len(conversations), dtype=np.int32)
+    rank[np.argsort(conversations, kind="stable")] = np.arange(len(conversations), dtype=np.int32)
+    conversation = arrays["conversation"]
+    for start in range(0, len(conversation), chunksize):
+        block = conversation[start:start + chunksize]
+        block[block >= 0] = rank[block[block >= 0]]
+    for array in arrays.values():
+        array.flush()
+    del arrays, conversation
+
+    np.save(tmp / "donors.npy", donors)
+    np.save(tmp / "donor_offsets.npy", offsets)
+    np.save(tmp / "donations.npy", np.array(list(tables["donations"])))
+    np.save(tmp / "conversations.npy", np.sort(conversations))
+    np.save(tmp / "senders.npy", np.array(list(tables["senders"])))
+    (tmp / "meta.json").write_text(json.dumps(_source_key(messages_csv, donations)))
+
+def open_store(path, messages_csv, donations):
+    """Opens the store at path read-only (memory-mapped), builds it first when it is missing or its source changed"""
+    version = current_version(path)
+    if version is None or json.loads((version / "meta.json").read_text()) != _source_key(messages_csv, donations):
+        version = build_store(path, messages_csv, donations)
+    store = {name: np.load(version / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+    store.update({name: np.load(version / f"{name}.npy") for name in TABLES})
+    store["donor_offsets"] = np.load(version / "donor_offsets.npy")
+    store["donor_code"] = {donor: code for code, donor in enumerate(store["donors"])}
+    return store
+
+def donor_slice(store, donor_id):
+    """Row columns of one donor as zero-copy slices of the mapped files (empty slices for unknown donors)"""
+    code = store["donor_code"].get(donor_id)
+    start, end = (0, 0) if code is None else store["donor_offsets"][code:code + 2]
+    return {name: store[name][start:end] for name in COLUMNS}
+
+def _labels(table, codes):
+    #code -> value, missing codes -> None
+    labels = table[np.maximum(codes, 0)].astype(object)
+    labels[codes < 0] = None
+    return labels
+
+def _word_counts(words):
+    #integer word counts unless some are missing, like pandas reading the CSV
+    return words.astype(np.int64) if not np.isnan(words).any() else words
+
+def donor_messages(store, donor_id, sent_only=False):
+    """Message rows of one donor with the same columns as the pandas backend (without the raw datetime strings)"""
+    rows = donor_slice(store, donor_id)
+    if sent_only:
+        rows = {name: values[rows["sent"]] for name, values in rows.items()}
+    return _frame(store, rows)
+
+def message_count(store, donor_id):
+    """Number of messages of one donor, from the donor offsets"""
+    code = store["donor_code"].get(donor_id)
+    return 0 if code is None else int(store["donor_offsets"][code + 1] - store["donor_offsets"][code])
+
+def donor_message_sample(store, donor_id, n, sent_only=False):
+    """
+    Stratified sample of about n dated messages of one donor: the dated messages in time order are split into n strata
+    of equal size and the last message of each is taken. Only the sampled rows are decoded into the frame, with
+    sample_weight = messages per sampled message.
+    """
+    rows = donor_slice(store, donor_id)
+    mask = rows["ts"] != NAT
+    if sent_only:
+        mask &= rows["sent"]
+    index = np.flatnonzero(mask)
+    index = index[np.argsort(rows["ts"][index], kind="stable")]
+    size = min(n, len(index))
+    index = index[(np.arange(1, size + 1) * len(index) + size - 1) // max(size, 1) - 1]
+    sample = _frame(store, {name: values[index] for name, values in rows.items()})
+    sample["sample_weight"] = mask.sum() / max(size, 1)
+    return sample
+
+def _frame(store, rows):
+    #decodes row columns into a frame with the columns of the pandas backend
+    dt = pd.Series(rows["ts"].view("datetime64[s]").astype("datetime64[ns]"))
+    return pd.DataFrame({
+        "donation_id": _labels(store["donations"], rows["donation"]),
+        "conversation_id": _labels(store["conversations"], rows["conversation"]),
+        "sender_id": _labels(store["senders"], rows["sender"]),
+        "word_count": _word_counts(rows["word_count"]),
+        "dt": dt,
+        "date_only": dt.dt.date,
+        "hour": dt.dt.hour,
+    })
+
+def conversation_counts(store, donor_id):
+    """Messages and words sent by the donor per conversation"""
+    rows = donor_slice(store, donor_id)
+    mask = rows["sent"] & (rows["conversation"] >= 0)
+    chats, inverse = np.unique(rows["conversation"][mask], return_inverse=True)
+    words = np.nan_to_num(rows["word_count"][mask])
+    return pd.DataFrame({
+        "conversation_id": store["conversations"][chats].astype(object),
+        "messages": np.bincount(inverse, minlength=len(chats)),
+        "words": _word_counts(np.bincount(inverse, weights=words, minlength=len(chats))),
+    })
+
+def words_by_role(store, donor_id):
+    """Words sent by the donor and by contacts per conversation (input of the interaction balance)"""
+    rows = donor_slice(store, donor_id)
+    mask = rows["conversation"] >= 0
+    chats, inverse = np.unique(rows["conversation"][mask], return_inverse=True)
+    words = np.nan_to_num(rows["word_count"][mask])
+    sent = rows["sent"][mask]
+    return pd.DataFrame({
+        "conversation_id": store["conversations"][chats].astype(object),
+        "words_sent_by_donor": np.bincount(inverse, weights=words * sent, minlength=len(chats)).astype(np.int64),
+        "words_sent_by_contacts": np.bincount(inverse, weights=words * ~sent, minlength=len(chats)).astype(np.int64),
+    })
+
+def days_per_chat(store, donor_id):
+    """Distinct days with donor messages per conversation, one row per (conversation_id, day)"""
+    rows = donor_slice(store, donor_id)
+    mask = rows["sent"] & (rows["conversation"] >= 0) & (rows["ts"] != NAT)
+    days = rows["ts"][mask] // 86400
+    if len(days) == 0:
+        return pd.DataFrame({"conversation_id": pd.Series(dtype=object), "day": pd.Series(dtype=object)})
+    first_day = days.min()
+    span = days.max() - first_day + 1
+    keys = np.unique(rows["conversation"][mask].astype(np.int64) * span + (days - first_day))
+    return pd.DataFrame({
+        "conversation_id": store["conversations"][keys // span].astype(object),
+        "day": pd.Series((keys % span + first_day).astype("datetime64[D]").astype("datetime64[ns]")).dt.date,
+    })
@@ -1,15 +1,13 @@
 #This notebook loads the donation and message CSV files, filters them for WhatsApp donations, normalizes the datetime fields and prepares messages and donations DataFrames for analysis of notebooks.
 
+#Only numpy and pandas are imported here, dashboards import matplotlib and ipywidgets lazily when they are shown
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import ipywidgets as widgets
-from IPython.display import display, HTML
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.dates as mdates
 from pathlib import Path
-import seaborn as sns
+
+#No pandas options are changed here, they would apply to every cell of the notebooks importing this module.
+#The dashboards and plot functions never modify the frames returned below, so they don't need defensive .copy() calls
 
 OUTPUT_DIR = Path("outputs")
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -17,14 +15,121 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 DONATION_CSV = r"C:/Users/Dev/Documents/GitHub/Developing-Interactive-Jupyter-Notebooks-Project/12570525/donation_table.csv"
 MESSAGES_CSV = r"C:/Users/Dev/Documents/GitHub/Developing-Interactive-Jupyter-Notebooks-Project/12570525/messages_filtered_table.csv"
 
+#Data backend: "pandas" (default) loads all messages into the 'messages' DataFrame,
+#"duckdb" keeps them in an embedded DuckDB database or Parquet files and only loads per-donor results (see duckdb_backend.py),
+#"columnar" keeps them in memory-mapped .npy column files sorted by donor (see columnar_store.py),
+#"shared" attaches read-only to the columnar store held in shared memory by a data host process (see shared_store.py)
+DATA_BACKEND = os.environ.get("WHATSAPP_DATA_BACKEND", "pandas").lower()
+DUCKDB_PATH = Path(os.environ.get("WHATSAPP_DUCKDB_PATH", OUTPUT_DIR / "messages.duckdb"))
+COLUMNAR_PATH = Path(os.environ.get("WHATSAPP_COLUMNAR_PATH", OUTPUT_DIR / "columnar"))
+#optional Parquet file or glob used by the duckdb backend instead of MESSAGES_CSV
+MESSAGES_PARQUET = os.environ.get("WHATSAPP_MESSAGES_PARQUET")
+
 #Loading data
 donations = pd.read_csv(DONATION_CSV)
 donations = donations[donations["source"] == "WhatsApp"]
 
-messages = pd.read_csv(MESSAGES_CSV)
-messages = messages[messages["donation_id"].isin(donations["donation_id"])]
+db = None
+store = None
+if DATA_BACKEND == "duckdb":
+    import duckdb_backend
+    db = duckdb_backend.connect(DUCKDB_PATH, MESSAGES_PARQUET or MESSAGES_CSV, donations)
+    #the full table is never loaded, dashboards go through the donor_* functions below
+    messages = None
+elif DATA_BACKEND == "columnar":
+    import columnar_store
+    #built from the CSV on first use (or when it changed), then only memory-mapped
+    store = columnar_store.open_store(COLUMNAR_PATH, MESSAGES_CSV, donations)
+    messages = None
+elif DATA_BACKEND == "shared":
+    import columnar_store
+    import shared_store
+    #no copy per kernel, the arrays are views of the host's shared memory blocks
+    store = shared_store.attach_store()
+    messages = None
+else:
+    messages = pd.read_csv(MESSAGES_CSV)
+    messages = messages[messages["donation_id"].isin(donations["donation_id"])]
+
+    #normalizing datetime (assign returns a new frame instead of writing into the filtered one)
+    dt = pd.to_datetime(messages["datetime"], errors="coerce")
+    messages = messages.assign(dt=dt, date_only=dt.dt.date, hour=dt.dt.hour)
+
+#Per-donor data access used by the dashboards, each function runs in pandas, as SQL or on the mapped columns depending on DATA_BACKEND
+
+#messages of all WhatsApp donations of one donor, sent_only keeps only messages sent by the donor
+#both filters are applied as one selection so no intermediate frame is materialized
+def donor_messages(donor_id, sent_only=False):
+    if db is not None:
+        return duckdb_backend.donor_messages(db, donor_id, sent_only)
+    if store is not None:
+        return columnar_store.donor_messages(store, donor_id, sent_only)
+    return messages[_donor_mask(donor_id, sent_only)]
+
+def _donor_mask(donor_id, sent_only=False):
+    mask = messages["donation_id"].isin(donations.loc[donations["donor_id"] == donor_id, "donation_id"])
+    if sent_only:
+        mask &= messages["sender_id"] == donor_id
+    return mask
+
+#number of messages of one donor, cheap in every backend (no message rows are loaded)
+def donor_message_count(donor_id):
+    if db is not None:
+        return duckdb_backend.message_count(db, donor_id)
+    if store is not None:
+        return columnar_store.message_count(store, donor_id)
+    return int(_donor_mask(donor_id).sum())
+
+#stratified sample of about n dated messages of one donor, for quick previews of donors with very many messages:
+#the donor's dated messages in time order are split into n strata of equal size and the last message of each is taken,
+#sample_weight = messages per sampled message (all messages with weight 1 when the donor has at most n)
+def donor_message_sample(donor_id, n, sent_only=False):
+    if db is not None:
+        return duckdb_backend.donor_message_sample(db, donor_id, n, sent_only)
+    if store is not None:
+        return columnar_store.donor_message_sample(store, donor_id, n, sent_only)
+    index = np.flatnonzero(_donor_mask(donor_id, sent_only).to_numpy())
+    dt = messages["dt"].to_numpy()[index]
+    index = index[~np.isnat(dt)][np.argsort(dt[~np.isnat(dt)], kind="stable")]
+    size = min(n, len(index))
+    sample = messages.iloc[index[(np.arange(1, size + 1) * len(index) + size - 1) // max(size, 1) - 1]]
+    return sample.assign(sample_weight=len(index) / max(size, 1))
+
+#messages and words sent by the donor per conversation (conversation_id, messages, words)
+def donor_conversation_counts(donor_id):
+    if db is not None:
+        return duckdb_backend.conversation_counts(db, donor_id)
+    if store is not None:
+        return columnar_store.conversation_counts(store, donor_id)
+    sent = donor_messages(donor_id, sent_only=True)
+    counts = sent.groupby("conversation_id")["word_count"].agg(["size", "sum"])
+    return pd.DataFrame({"conversation_id": counts.index, "messages": counts["size"].to_numpy(), "words": counts["sum"].to_numpy()})
+
+#words sent by the donor and by contacts per conversation (conversation_id, words_sent_by_donor, words_sent_by_contacts)
+def donor_words_by_role(donor_id):
+    if db is not None:
+        return duckdb_backend.words_by_role(db, donor_id)
+    if store is not None:
+        return columnar_store.words_by_role(store, donor_id)
+    donor_msgs = donor_messages(donor_id)
+    words = donor_msgs["word_count"].fillna(0)
+    by_role = words.groupby([donor_msgs["conversation_id"], donor_msgs["sender_id"] == donor_id]).sum().unstack(fill_value=0)
+    by_role = by_role.reindex(columns=[True, False], fill_value=0)
+    return pd.DataFrame({
+        "conversation_id": by_role.index,
+        "words_sent_by_donor": by_role[True].to_numpy(dtype=np.int64),
+        "words_sent_by_contacts": by_role[False].to_numpy(dtype=np.int64),
+    })
 
-#normalizing datetime
-messages["dt"] = pd.to_datetime(messages["datetime"], errors="coerce")
-messages["date_only"] = messages["dt"].dt.date
-messages["hour"] = messages["dt"].dt.hour
\ No newline at end of file
+#distinct days with donor messages per conversation (Series of sorted date lists indexed by conversation_id)
+def donor_days_per_chat(donor_id):
+    if db is not None:
+        days = duckdb_backend.days_per_chat(db, donor_id)
+        days["day"] = pd.to_datetime(days["day"]).dt.date
+    elif store is not None:
+        days = columnar_store.days_per_chat(store, donor_id)
+    else:
+        sent = donor_messages(donor_id, sent_only=True)
+        days = pd.DataFrame({"conversation_id": sent["conversation_id"], "day": sent["date_only"]})[sent["dt"].notna()]
+        days = days.drop_duplicates().sort_values(["conversation_id", "day"])
+    return days.groupby("conversation_id")["day"].agg(list)
@@ -0,0 +1,197 @@
+"""Out-of-core DuckDB backend for dataloader.py.
+The messages stay in an embedded DuckDB database file (imported once from the messages CSV) or in Parquet files that
+DuckDB scans in place, so the full table never has to fit in memory. Per-donor filters and aggregations run as SQL
+and only the small per-donor results are returned as pandas DataFrames.
+Every kernel attaches the database file read-only, so any number of notebooks can query it at the same time, and keeps
+the WhatsApp donations in its own in-memory database. The file is (re)built by build_database only when it is missing
+or the messages CSV changed, under a lock file so concurrent kernels build it once.
+Selected in dataloader.py with the WHATSAPP_DATA_BACKEND=duckdb environment variable, duckdb is only needed then.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import duckdb
+
+#all queries select the messages of the donor's WhatsApp donations first
+DONOR_FILTER = "donation_id IN (SELECT donation_id FROM donations WHERE donor_id = $donor)"
+#seconds after which the lock file of a build that never finished (e.g. killed kernel) is ignored
+BUILD_LOCK_TIMEOUT = float(os.environ.get("WHATSAPP_DUCKDB_LOCK_TIMEOUT", 3600))
+
+def _literal(path):
+    #SQL string literal of a file path
+    return "'" + str(path).replace("'", "''") + "'"
+
+def _source_key(messages_csv):
+    #the database is rebuilt when the messages file changes
+    stat = Path(messages_csv).stat()
+    return {"messages_csv": str(messages_csv), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def _stored_key(db_path):
+    #source key recorded in the database file, None if it is missing or was not built by build_database
+    try:
+        with duckdb.connect(str(db_path), read_only=True) as con:
+            return json.loads(con.execute("SELECT source_key FROM meta").fetchone()[0])
+    except (duckdb.Error, OSError, TypeError):
+        return None
+
+def build_database(db_path, messages_csv):
+    """
+    Imports the messages CSV into a new database file and swaps it in for db_path with os.replace, so kernels that have
+    the old file attached keep reading it until they reconnect. Rows keep their file order, so donor frames match the
+    pandas backend. The source key (path, size, mtime) is stored in the meta table.
+    """
+    db_path = Path(db_path)
+    tmp = db_path.with_name(f"{db_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        with duckdb.connect(str(tmp)) as con:
+            con.execute(f"CREATE TABLE messages AS SELECT *, TRY_CAST(datetime AS TIMESTAMP) AS dt FROM read_csv_auto({_literal(messages_csv)})")
+            con.execute("CREATE TABLE meta AS SELECT $key AS source_key", {"key": json.dumps(_source_key(messages_csv))})
+        os.replace(tmp, db_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+        tmp.with_name(tmp.name + ".wal").unlink(missing_ok=True)
+
+def ensure_database(db_path, messages_csv):
+    """Builds the database at db_path if it is missing or its source changed, only one process builds at a time"""
+    db_path = Path(db_path)
+    if _stored_key(db_path) == _source_key(messages_csv):
+        return
+    lock = db_path.with_name(db_path.name + ".lock")
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock.stat().st_mtime > BUILD_LOCK_TIMEOUT:
+                    lock.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+            time.sleep(0.5)
+    try:
+        #another process may have built it while this one waited for the lock
+        if _stored_key(db_path) != _source_key(messages_csv):
+            build_database(db_path, messages_csv)
+    finally:
+        lock.unlink(missing_ok=True)
+
+def connect(db_path, messages_source, donations):
+    """
+    Returns an in-memory DuckDB connection with the tables donations and messages.
+    messages_source: messages CSV file (imported into the database file at db_path once, then attached read-only)
+                     or Parquet file/glob (queried in place, db_path is not used)
+    donations: WhatsApp donations DataFrame, copied into the in-memory database so queries can filter by donor
+    """
+    con = duckdb.connect()
+    con.register("donations_df", donations[["donation_id", "donor_id"]])
+    con.execute("CREATE TABLE donations AS SELECT * FROM donations_df")
+    con.unregister("donations_df")
+
+    source = str(messages_source)
+    if source.endswith(".parquet") or "*" in source:
+        table = f"read_parquet({_literal(source)})"
+        dt = ", TRY_CAST(datetime AS TIMESTAMP) AS dt"
+    else:
+        ensure_database(db_path, source)
+        con.execute(f"ATTACH {_literal(db_path)} AS store (READ_ONLY)")
+        table = "store.messages"
+        dt = ""
+    con.execute(f"""
+        CREATE VIEW messages AS
+        SELECT *{dt}
+        FROM {table}
+        WHERE donation_id IN (SELECT donation_id FROM donations)
+    """)
+    return con
+
+def _query(con, sql, **params):
+    #every query runs on its own cursor, so donors can be prefetched on a background thread
+    with con.cursor() as cursor:
+        return cursor.execute(sql, params).df()
+
+def donor_messages(con, donor_id, sent_only=False):
+    """Message rows of one donor with the same dt, date_only and hour columns as the pandas backend"""
+    sent = "AND sender_id = $donor" if sent_only else ""
+    df = _query(con, f"SELECT * FROM messages WHERE {DONOR_FILTER} {sent}", donor=donor_id)
+    df["dt"] = df["dt"].astype("datetime64[ns]")
+    df["date_only"] = df["dt"].dt.date
+    df["hour"] = df["dt"].dt.hour
+    return df
+
+def message_count(con, donor_id):
+    """Number of messages of one donor"""
+    return int(_query(con, f"SELECT COUNT(*) AS messages FROM messages WHERE {DONOR_FILTER}", donor=donor_id)["messages"].iat[0])
+
+def donor_message_sample(con, donor_id, n, sent_only=False):
+    """
+    Stratified sample of about n dated messages of one donor: the dated messages in time order are split into n strata
+    of equal size and the last message of each is taken, sample_weight = messages per sampled message.
+    Only the sampled rows are returned to pandas.
+    """
+    sent = "AND sender_id = $donor" if sent_only else ""
+    df = _query(con, f"""
+        WITH dated AS (
+            SELECT *, row_number() OVER (ORDER BY dt) - 1 AS position, COUNT(*) OVER () AS total,
+                   LEAST($n, COUNT(*) OVER ()) AS size
+            FROM messages
+            WHERE {DONOR_FILTER} {sent} AND dt IS NOT NULL
+        )
+        SELECT * EXCLUDE (position, total, size), CAST(total AS DOUBLE) / size AS sample_weight
+        FROM dated
+        WHERE (position + 1) * size // total > position * size // total
+        ORDER BY position
+    """, donor=donor_id, n=n)
+    df["dt"] = df["dt"].astype("datetime64[ns]")
+    df["date_only"] = df["dt"].dt.date
+    df["hour"] = df["dt"].dt.hour
+    return df
+
+def conversation_counts(con, donor_id):
+    """Messages and words sent by the donor per conversation"""
+    return _query(con, f"""
+        SELECT conversation_id, COUNT(*) AS messages, CAST(COALESCE(SUM(word_count), 0) AS BIGINT) AS words
+        FROM messages
+        WHERE {DONOR_FILTER} AND sender_id = $donor AND conversation_id IS NOT NULL
+        GROUP BY conversation_id
+        ORDER BY conversation_id
+    """, donor=donor_id)
+
+def words_by_role(con, donor_id):
+    """Words sent by the donor and by contacts per conversation (input of the interaction balance)"""
+    return _query(con, f"""
+        SELECT conversation_id,
+               CAST(COALESCE(SUM(CASE WHEN sender_id = $donor THEN word_count END), 0) AS BIGINT) AS words_sent_by_donor,
+               CAST(COALESCE(SUM(CASE WHEN sender_id IS DISTINCT FROM $donor THEN word_count END), 0) AS BIGINT) AS words_sent_by_contacts
+        FROM messages
+        WHERE {DONOR_FILTER} AND conversation_id IS NOT NULL
+        GROUP BY conversation_id
+        ORDER BY conversation_id
+    """, donor=donor_id)
+
+def days_per_chat(con, donor_id):
+    """Distinct days with donor messages per conversation, one row per (conversation_id, day)"""
+    return _query(con, f"""
+        SELECT DISTINCT conversation_id, CAST(dt AS DATE) AS day
+        FROM messages
+        WHERE {DONOR_FILTER} AND sender_id = $donor AND conversation_id IS NOT NULL AND dt IS NOT NULL
+        ORDER BY conversation_id, day
+    """, donor=donor_id)
+
+def hour_of_week_counts(con, direction="sent"):
+    """
+    Messages and words of all donors per weekday (0 = Monday) and hour.
+    direction: 'sent' (by the donor), 'received' (by contacts) or 'all'
+    """
+    sender = {"sent": "AND m.sender_id = d.donor_id", "received": "AND m.sender_id IS DISTINCT FROM d.donor_id", "all": ""}[direction]
+    return _query(con, f"""
+        SELECT d.donor_id, ISODOW(m.dt) - 1 AS weekday, HOUR(m.dt) AS hour,
+               COUNT(*) AS messages, COALESCE(SUM(m.word_count), 0) AS words
+        FROM messages m
+        JOIN (SELECT DISTINCT donation_id, donor_id FROM donations) d USING (donation_id)
+        WHERE m.dt IS NOT NULL {sender}
+        GROUP BY 1, 2, 3
+    """)
@@ -4,51 +4,70 @@
 from dataloader import *     
 #Imports helper for saving figures and adding notes           
 from functions.pic_notes_save import *  
-
-def plot_words_heatmap_black_yellow_dates(df, threshold=1):
-    if df is None or df.empty:
+#Sorted (conversation, dt) index for date-range filtering
+from functions.time_index import build_time_index, time_window
+#Searchable chat dropdown that only holds the most active chats
+from functions.chat_selector import create_chat_selector, chat_table, chat_labels
+#Persistent cache, figures survive kernel restarts
+from functions.result_cache import cached_figure
+#Next donors in the dropdown are loaded on a background thread
+from functions.prefetch import create_prefetcher, PREFETCH_DEPTH
+#Day, week and month tiles of the words grid, the heatmap reads the level that fits its width
+from functions.tile_pyramid import words_pyramid, data_range, pick_level, read_window, LEVEL_FORMATS
+#Donors with very many messages are first drawn from a stratified sample
+from functions.progressive import create_progressive_loader, scale_sample, preview_status, EXACT_STATUS, PREVIEW_MESSAGES
+
+def plot_words_heatmap_black_yellow_dates(df, threshold=1, pyramid=None, start=None, end=None):
+    """
+    Heatmap of the hours with at least threshold words sent, days on the x-axis (weeks or months when the days don't fit the axes width).
+    pyramid: words_pyramid() of the messages, built from df when not given
+    start, end: shown date range (inclusive, trimmed to the days with messages), default all messages
+    """
+    if pyramid is None:
+        if df is None or df.empty:
+            return None
+        pyramid = words_pyramid(df)
+    shown = data_range(pyramid, start, end) if pyramid is not None else None
+    if shown is None:
         return None
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
 
-    df = df.copy()
-    #extract hour and date only columns for grouping
-    df["hour"] = df["dt"].dt.hour
-    df["date_only"] = df["dt"].dt.date
-
-    #Create a grid: rows = dates, columns = hours
-    #Sum of word counts per day per hour
-    grid = df.groupby(["date_only", "hour"])["word_count"].sum().unstack(fill_value=0)
-    #grid covers all dates (even those without messages)
-    all_dates = pd.date_range(df["date_only"].min(), df["date_only"].max(), freq='D')
-    #ensures grid has all 24 hours
-    all_hours = np.arange(0, 24)
-    grid = grid.reindex(index=all_dates, columns=all_hours, fill_value=0)
+    fig, ax = plt.subplots(figsize=(12, 6))
+    #at most one period per pixel, only the tiles of the shown range are read
+    level = pick_level(pyramid, *shown, ax.get_window_extent().width)
+    #grid rows = days (weeks, months), columns = hours, cells = words sent (largest day of the period)
+    all_dates, grid, _ = read_window(pyramid, level, *shown)
 
     #Converts grid to binary 1 = activity above threshold, 0 = no or low activity
     binary_grid = (grid >= threshold).astype(int)
     #black= no activity to yellow= activity
     cmap = LinearSegmentedColormap.from_list("black_yellow", ["black", "yellow"])
 
-    fig, ax = plt.subplots(figsize=(12, 6))
     #imshow() draws the 2D binary grid as a heatmap
     #.T transposes to show hours on Y-axis and dates on X-axis
-    ax.imshow(binary_grid.T, origin='lower', aspect='auto', cmap=cmap, interpolation='nearest')
+    #vmin/vmax fix the colors, a grid that is active everywhere (common for weeks and months) would otherwise be black
+    ax.imshow(binary_grid.T, origin='lower', aspect='auto', cmap=cmap, interpolation='nearest', vmin=0, vmax=1)
 
     #Set X-axis ticks as dates
     #To avoid messiness, shows roughly 10 evenly spaced date labels
     ax.set_xticks(np.arange(0, len(all_dates), max(1, len(all_dates)//10)))
-    ax.set_xticklabels([all_dates[i].strftime("%Y-%m-%d") for i in ax.get_xticks()], rotation=45, ha='right')
+    ax.set_xticklabels([all_dates[i].strftime(LEVEL_FORMATS[level]) for i in ax.get_xticks()], rotation=45, ha='right')
     #Set Y-axis ticks as hours 0 to 23
     ax.set_yticks(np.arange(0, 24, 1))
     ax.set_yticklabels(np.arange(0, 24, 1))
 
     #label axes and title
-    ax.set_xlabel("Date")
+    ax.set_xlabel("Date" if level == "day" else f"{level.capitalize()} starting")
     ax.set_ylabel("Hour of day")
-    ax.set_title(f"Words Sent Heatmap (Threshold ≥ {threshold})")
+    ax.set_title(f"Words Sent Heatmap (Threshold ≥ {threshold})" + ("" if level == "day" else f", {level}ly: reached on any day"))
     plt.tight_layout()
     return fig
 
-def show_words_heatmap_dashboard_dates():
+def show_words_heatmap_dashboard_dates(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     donor_ids = sorted(donations["donor_id"].unique())
 
     #Donor input
@@ -62,21 +81,26 @@ def show_words_heatmap_dashboard_dates():
         options=donor_ids,
         layout=widgets.Layout(width="300px")
     )
-    #Dropdown to select specific chat or all chats 
-    chat_select = widgets.Dropdown(
-        options=["Select donor first"],
-        description="Chat:",
-        layout=widgets.Layout(width="420px")
-    )
+    #Dropdown to select specific chat or all chats, with a search box
+    chat_selector = create_chat_selector()
+    chat_select = chat_selector["dropdown"]
 
     #date pickers to limit the visualization range
     start_date = widgets.DatePicker(description="Start:", disabled=True)
     end_date   = widgets.DatePicker(description="End:", disabled=True)
     #Slider to change word count threshold minimum word count for marking activity (1 = at least 1 word sent)
     threshold_slider = widgets.IntSlider(value=5, min=1, max=100, step=1, description="Threshold N")
+    #tells whether the figure is a preview or exact
+    status = widgets.HTML()
     out_plot = widgets.Output()
 
-    chat_select._donor_df = None
+    chat_select._donor_index = None
+    #True while the preview of a donor is shown
+    chat_select._preview = False
+    #True while a donor's dates and chats are set, so the donor is drawn once instead of once per date picker change
+    chat_select._loading = False
+    #words pyramid per chat of the loaded donor ("ALL" = all chats)
+    chat_select._pyramids = {}
 
     #Filter dropdown based on input
     def update_donor_dropdown(change):
@@ -89,79 +113,130 @@ def show_words_heatmap_dashboard_dates():
 
     donor_input.observe(update_donor_dropdown, names="value")
 
-    #loads messages of the selected donor and updates available chats and dates
+    #sent messages of a donor, their sorted time index and the words pyramid of all chats,
+    #loaded ahead for the next donors in the dropdown
+    def prepare(donor):
+        return prepare_rows(donor_messages(donor, sent_only=True))
+
+    def prepare_rows(donor_rows):
+        if donor_rows.empty:
+            return donor_rows, None, None
+        return donor_rows, build_time_index(donor_rows), words_pyramid(donor_rows)
+
+    prefetcher = create_prefetcher(prepare, prefetch_depth)
+    progressive = create_progressive_loader(prefetcher)
+
+    #loads messages of the selected donor, a preview from a sample first if they take longer than the latency budget
     def load_donor(*args):
         out_plot.clear_output()
+        status.value = ""
         donor = donor_input.value.strip() or donor_dropdown.value
         #shows error if invalid donor
         if donor not in donor_ids:
-            chat_select.options = ["Invalid donor"]
+            chat_selector["clear"]("Invalid donor")
             with out_plot:
                 display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
             return
-        #filter messages that belong to this donors donations
-        donor_rows = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"]==donor, "donation_id"]
-        )].copy()
-        #Keep only messages sent by this donor not received
-        donor_rows = donor_rows[donor_rows["sender_id"]==donor].copy()
+
+        def show_exact(prepared, refined):
+            prefetcher["prefetch_after"](donor, donor_dropdown.options)
+            show_donor(prepared, EXACT_STATUS if refined else "")
+
+        def show_preview():
+            #word counts of the sampled messages are scaled up by their sample weight
+            sample = donor_message_sample(donor, PREVIEW_MESSAGES, sent_only=True)
+            show_donor(prepare_rows(scale_sample(sample)), preview_status(sample), preview=True)
+
+        def show_error(error):
+            #the exact messages could not be loaded after a preview was drawn, the preview is removed
+            status.value = ""
+            chat_select._preview = False
+            chat_selector["clear"]("Loading failed")
+            with out_plot:
+                out_plot.clear_output()
+                display(HTML(f"<b style='color:red;'>Loading donor {donor} failed: {type(error).__name__}: {error}</b>"))
+
+        progressive["load"](donor, show_exact, show_preview, show_error)
+
+    #updates available chats and dates for the donors (sent) messages and draws them
+    def show_donor(prepared, status_html, preview=False):
+        out_plot.clear_output()
+        status.value = status_html
+        chat_select._preview = preview
+        donor_rows, donor_index, pyramid = prepared
 
         #If no messages show warning and exit
         if donor_rows.empty:
-            chat_select.options = ["No messages"]
+            chat_selector["clear"]("No messages")
             with out_plot:
                 display(HTML("<b style='color:orange;'>No messages for this donor.</b>"))
             return
 
+        #the new donor's pyramids are in place before the date pickers redraw the plot
+        chat_select._date_range = (donor_rows["dt"].min().date(), donor_rows["dt"].max().date())
+        chat_select._donor_index = donor_index
+        chat_select._pyramids = {"ALL": pyramid}
         #enables date selection and set initial range to min or max dates of messages
         start_date.disabled = False
         end_date.disabled = False
-        start_date.value = donor_rows["dt"].min().date()
-        end_date.value = donor_rows["dt"].max().date()
-
-        #showing individual chat
-        chats = donor_rows["conversation_id"].unique()
-        options = [(f"Chat {c}", c) for c in chats]
-        #showing all chats together
-        options.insert(0, ("All Chats", "ALL"))
-        #update dropdown values
-        chat_select.options = options
-        chat_select.value = options[0][1]
-        chat_select._donor_df = donor_rows
+        chat_select._loading = True
+        try:
+            start_date.value, end_date.value = chat_select._date_range
+        finally:
+            chat_select._loading = False
+
+        #showing individual chats, most active (messages sent) first
+        activity = donor_rows["conversation_id"].value_counts(sort=False)
+        #update dropdown values, showing all chats together comes first
+        chat_selector["set_chats"](chat_table(activity.index, chat_labels(activity.index), activity=activity.to_numpy()), [("All Chats", "ALL")])
         draw_plot()
 
-    #filter data based on chat and date
-    def filtered_df():
-        donor_df = chat_select._donor_df
-        if donor_df is None:
-            return pd.DataFrame()
-        df = donor_df.copy()
-        #Convert date pickers to timestamps and filter messages in range
-        start_ts = pd.Timestamp(start_date.value)
-        end_ts = pd.Timestamp(end_date.value) + pd.Timedelta(days=1)
-        df = df[(df["dt"] >= start_ts) & (df["dt"] < end_ts)]
-        if chat_select.value != "ALL":
-            df = df[df["conversation_id"] == chat_select.value]
-        return df
+    #words pyramid of a chat, built once from the chat's slice of the sorted index, None without messages
+    def chat_pyramid(chat):
+        donor_index = chat_select._donor_index
+        if donor_index is None:
+            return None
+        if chat not in chat_select._pyramids:
+            rows = time_window(donor_index, *chat_select._date_range, chat)
+            chat_select._pyramids[chat] = words_pyramid(rows) if len(rows) else None
+        return chat_select._pyramids[chat]
 
     #draws heatmap
     def draw_plot(_=None):
+        if chat_select._loading:
+            return
         out_plot.clear_output()
-        df = filtered_df()
         donor = donor_input.value.strip() or donor_dropdown.value
+        start, end = start_date.value, end_date.value
+
+        def plot():
+            #changing the dates only reads the pyramid tiles of the new range, the messages are not regrouped
+            pyramid = chat_pyramid(chat_select.value)
+            if pyramid is None or start is None or end is None:
+                return None
+            return plot_words_heatmap_black_yellow_dates(None, threshold=threshold_slider.value, pyramid=pyramid, start=start, end=end)
+
         with out_plot:
-            fig = plot_words_heatmap_black_yellow_dates(df, threshold=threshold_slider.value)
+            if chat_select._preview:
+                #previews are not cached, the title marks them
+                fig = plot()
+                if fig is not None:
+                    fig.axes[0].set_title(fig.axes[0].get_title() + " — Preview (sample)")
+            else:
+                #the figure is cached on disk for this donor, chat, date range and threshold
+                fig = cached_figure("words_heatmap", plot,
+                                    donor=donor, chat=chat_select.value, start=start, end=end, threshold=threshold_slider.value)
             #Handles empty data case
             if fig is None:
                 display(HTML("<b style='color:orange;'>No data to plot for selected range/chat.</b>"))
             else:
-                add_save_and_note_controls(fig, donor, chat_select.value, "heatmap")
+                add_save_and_note_controls(fig, donor, chat_select.value, "heatmap-preview" if chat_select._preview else "heatmap")
                 plt.show()
 
     #widget event bindings
     donor_dropdown.observe(lambda ch: load_donor(), names="value")
     donor_input.on_submit(load_donor)
-    chat_select.observe(draw_plot, names="value")
+    chat_selector["on_change"](draw_plot)
     start_date.observe(draw_plot, names="value")
     end_date.observe(draw_plot, names="value")
     threshold_slider.observe(draw_plot, names="value")
@@ -169,7 +244,8 @@ def show_words_heatmap_dashboard_dates():
     #layout
     display(widgets.VBox([
         widgets.HTML("<h2>Words Heatmap Dashboard</h2>"),
-        widgets.HBox([donor_input, donor_dropdown, chat_select], layout=widgets.Layout(gap="10px")),
+        widgets.HBox([donor_input, donor_dropdown, chat_selector["box"]], layout=widgets.Layout(gap="10px")),
         widgets.HBox([start_date, end_date, threshold_slider], layout=widgets.Layout(gap="10px")),
+        status,
         out_plot
     ]))
@@ -4,72 +4,87 @@
 from dataloader import *     
 #Imports helper for saving figures and adding notes           
 from functions.pic_notes_save import * 
-
-def plot_active_chats_heatmap_colored(df, view="All"):
+#Daily series helpers from the headless metrics module
+from functions.metrics import daily_series, moving_average
+#Sorted (conversation, dt) index for date-range filtering
+from functions.time_index import build_time_index, time_window
+#Searchable chat dropdown that only holds the most active chats
+from functions.chat_selector import create_chat_selector, chat_table, chat_labels
+#Persistent cache, series and figures survive kernel restarts
+from functions.result_cache import cached, cached_figure
+#Day, week and month tiles of the chat activity grid, the heatmap reads the level that fits its width
+from functions.tile_pyramid import chats_pyramid, data_range, pick_level, read_window, LEVEL_FORMATS
+#Next donors in the dropdown are loaded on a background thread
+from functions.prefetch import create_prefetcher, PREFETCH_DEPTH
+#Donors with very many messages are first drawn from a stratified sample
+from functions.progressive import create_progressive_loader, scale_sample, preview_status, EXACT_STATUS, PREVIEW_MESSAGES
+
+def plot_active_chats_heatmap_colored(df, view="All", donor_id=None, pyramid=None, start=None, end=None):
     """
-    Heatmap showing chat activity by day.
+    Heatmap showing chat activity by day (by week or month when the days don't fit the axes width).
     Sent = yellow, Received = cyan, Both = orange (for All view)
+    donor_id: sender id of the donor, defaults to the sender of the first row
+    pyramid: chats_pyramid() of the messages, built from df when not given
+    start, end: shown date range (inclusive, trimmed to the days with messages), default all messages
     """
-    if df is None or df.empty:
+    if pyramid is None:
+        if df is None or df.empty:
+            return None
+        if donor_id is None:
+            donor_id = df["sender_id"].iloc[0]
+        pyramid = chats_pyramid(df, donor_id)
+    shown = data_range(pyramid, start, end) if pyramid is not None else None
+    if shown is None:
         return None
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
 
-    df = df.copy()
-    #extracts only the date portion from timestamp ignore hours and minutes
-    df["date_only"] = df["dt"].dt.date
-    #collect all unique chat ids and all unique dates in the period
-    all_chats = sorted(df["conversation_id"].unique())
-    all_dates = pd.date_range(df["date_only"].min(), df["date_only"].max(), freq='D')
+    fig, ax = plt.subplots(figsize=(14,6))
+    #at most one period per pixel, only the tiles of the shown range are read
+    level = pick_level(pyramid, *shown, ax.get_window_extent().width)
+    #grid rows = days (weeks, months), columns = chats, bit 1 = sent, bit 2 = received in the period
+    all_dates, bits, _ = read_window(pyramid, level, *shown)
+    #only the chats with messages in the shown range
+    active_chats = bits.any(axis=0)
+    all_chats = pyramid["columns"][active_chats]
+    bits = bits[:, active_chats].astype(int)
 
     if view in ["Sent", "Received"]:
-        #if user selected sent keep only donors messages
+        #1=active chat that day, 0=inactive
         if view == "Sent":
-            df = df[df["sender_id"] == df["sender_id"].iloc[0]]
+            grid = bits & 1
             color_map = ["black", "yellow"]
         else:
             #otherwise, show only messages from the contact
-            df = df[df["sender_id"] != df["sender_id"].iloc[0]]
+            grid = bits >> 1
             color_map = ["black", "cyan"]
-        #Group by date and conversation, count messages per cell    
-        grid = df.groupby(["date_only", "conversation_id"]).size().unstack(fill_value=0)
-        #convert to binary 1=active chat that day, 0=inactive
-        grid = (grid > 0).astype(int)
-        #reindex so all dates and chats are included, even with no activity
-        grid = grid.reindex(index=all_dates, columns=all_chats, fill_value=0)
         cmap = LinearSegmentedColormap.from_list("custom_cmap", color_map)
 
     else:  #All messages combine both sent & received into one heatmap
-        #Sent grid
-        sent = (df[df["sender_id"]==df["sender_id"].iloc[0]]
-                .groupby(["date_only","conversation_id"]).size().unstack(fill_value=0) > 0).astype(int)
-        #Received grid
-        rec = (df[df["sender_id"]!=df["sender_id"].iloc[0]]
-               .groupby(["date_only","conversation_id"]).size().unstack(fill_value=0) > 0).astype(int)
-        sent = sent.reindex(index=all_dates, columns=all_chats, fill_value=0)
-        rec = rec.reindex(index=all_dates, columns=all_chats, fill_value=0)
         #0=none, 1=sent only, 2=received only, 3=both
-        grid = np.zeros(sent.shape, dtype=int)
-        grid[(sent==1) & (rec==0)] = 1
-        grid[(sent==0) & (rec==1)] = 2
-        grid[(sent==1) & (rec==1)] = 3
+        grid = bits
         cmap = LinearSegmentedColormap.from_list("all_msg_cmap", ["black", "yellow", "cyan", "orange"])
 
-    fig, ax = plt.subplots(figsize=(14,6))
-    ax.imshow(grid.T, origin='lower', aspect='auto', cmap=cmap, interpolation='nearest')
+    #vmin/vmax fix the colors of the codes, also when a code does not occur in the shown range
+    ax.imshow(grid.T, origin='lower', aspect='auto', cmap=cmap, interpolation='nearest', vmin=0, vmax=1 if view in ["Sent", "Received"] else 3)
     #x-axis as dates 
     ax.set_xticks(np.arange(0, len(all_dates), max(1, len(all_dates)//10)))
-    ax.set_xticklabels([all_dates[i].strftime("%Y-%m-%d") for i in ax.get_xticks()], rotation=45, ha='right')
+    ax.set_xticklabels([all_dates[i].strftime(LEVEL_FORMATS[level]) for i in ax.get_xticks()], rotation=45, ha='right')
     #y-axis as chat ids
     ax.set_yticks(np.arange(len(all_chats)))
     ax.set_yticklabels(all_chats)
 
     #labels and title
-    ax.set_xlabel("Date")
+    ax.set_xlabel("Date" if level == "day" else f"{level.capitalize()} starting")
     ax.set_ylabel("Chat ID")
-    ax.set_title(f"Active Chats Heatmap for Donor {df['sender_id'].iloc[0]} ({view} Messages)")
+    ax.set_title(f"Active Chats Heatmap for Donor {donor_id} ({view} Messages)" + ("" if level == "day" else f", {level}ly"))
     plt.tight_layout()
     return fig
 
-def show_active_chats_dashboard():
+def show_active_chats_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     #gets all unique donor ids from donations data
     donor_ids = sorted(donations["donor_id"].unique())
     
@@ -96,9 +111,16 @@ def show_active_chats_dashboard():
     end_date   = widgets.DatePicker(description="End:", disabled=True)
     #output
     out_plot = widgets.Output()
-    #holder for currently loaded donors data
-    donor_df_holder = {"df": None}
+    #holder for currently loaded donors data (chat activity pyramid) and donor id
+    donor_df_holder = {"pyramid": None, "donor": None, "loading": False}
+
 
+    #all messages of a donor and their chat activity pyramid, loaded ahead for the next donors in the dropdown
+    def prepare(donor):
+        df = donor_messages(donor)
+        return df, (None if df.empty else chats_pyramid(df, donor))
+
+    prefetcher = create_prefetcher(prepare, prefetch_depth)
 
     #triggered when donor is selected or entered  and loads all messages for that donor , enables date filters
     def load_donor(*args):
@@ -109,38 +131,42 @@ def show_active_chats_dashboard():
                 display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
             return
         #find all messages for this donor
-        df = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"]==donor, "donation_id"]
-        )].copy()
+        df, pyramid = prefetcher["get"](donor)
+        prefetcher["prefetch_after"](donor, donor_dropdown.options)
         if df.empty:
             with out_plot:
                 display(HTML("<b style='color:orange;'>No messages for this donor.</b>"))
             return
-        #enable date filters
+        #the new donor's pyramid is in place before the date filters are enabled and set, which only redraw once at the end
+        donor_df_holder["pyramid"] = pyramid
+        donor_df_holder["donor"] = donor
         start_date.disabled = False
         end_date.disabled = False
-        start_date.value = df["dt"].min().date()
-        end_date.value = df["dt"].max().date()
-        donor_df_holder["df"] = df
+        donor_df_holder["loading"] = True
+        try:
+            start_date.value = df["dt"].min().date()
+            end_date.value = df["dt"].max().date()
+        finally:
+            donor_df_holder["loading"] = False
         draw_plot()
 
-    #filters donors messages between the selected start and end dates
-    def filtered_df():
-        df = donor_df_holder["df"]
-        if df is None:
-            return pd.DataFrame()
-        df = df.copy()
-        start_ts = pd.Timestamp(start_date.value)
-        end_ts = pd.Timestamp(end_date.value) + pd.Timedelta(days=1)
-        df = df[(df["dt"] >= start_ts) & (df["dt"] < end_ts)]
-        return df
-    #creates and displays the heatmap figure for the filtered data
+    #creates and displays the heatmap figure for the selected dates
     def draw_plot(_=None):
+        if donor_df_holder["loading"]:
+            return
         out_plot.clear_output()
-        df = filtered_df()
+        start, end = start_date.value, end_date.value
         view = view_selector.value
+
+        def plot():
+            #changing the dates only reads the pyramid tiles of the new range, the messages are not regrouped
+            if donor_df_holder["pyramid"] is None or start is None or end is None:
+                return None
+            return plot_active_chats_heatmap_colored(None, view, donor_id=donor_df_holder["donor"],
+                                                     pyramid=donor_df_holder["pyramid"], start=start, end=end)
+
         with out_plot:
-            fig = plot_active_chats_heatmap_colored(df, view)
+            fig = cached_figure("active_chats_heatmap", plot, donor=donor_df_holder["donor"], start=start, end=end, view=view)
             if fig is None:
                 display(HTML("<b style='color:orange;'>No data to plot for selected range.</b>"))
             else:
@@ -163,32 +189,44 @@ def show_active_chats_dashboard():
     ]))
 
 #time series plots 
-def plot_time_series_by_date(df, value_col, ylabel, title, ma_window=20):
+def build_daily_series_cache(df, value_col):
     """
-    Plots a time series with optional moving average.
-    
-    df: DataFrame with 'date_only' column
-    value_col: column to plot (e.g., 'word_count' or 'conversation_id')
-    ylabel: y-axis label
-    title: figure title
-    ma_window: moving average window in days
+    Computes the full-history daily series of df once and keeps it as NumPy arrays.
+    The cumulative sum lets any date window and moving average window be served without touching the message rows.
     """
-    if df is None or df.empty:
+    dates, values, message_counts = daily_series(df, value_col)
+    return {
+        "dates": dates,
+        "values": values,
+        "message_counts": message_counts,
+        "cumsum": np.concatenate(([0.0], np.cumsum(values))),
+    }
+
+def slice_daily_series(series, start, end, ma_window=20):
+    """
+    Returns (dates, values, moving average) for the days between start and end (inclusive) from a cached series,
+    or None if there are no messages in that range.
+    Like the per-redraw groupby it replaces, the range is trimmed to the first and last day with messages.
+    """
+    if start is None or end is None or len(series["dates"]) == 0:
         return None
+    lo = np.searchsorted(series["dates"], np.datetime64(start, "D"), side="left")
+    hi = np.searchsorted(series["dates"], np.datetime64(end, "D"), side="right")
+    active = np.flatnonzero(series["message_counts"][lo:hi])
+    if len(active) == 0:
+        return None
+    lo, hi = lo + active[0], lo + active[-1] + 1
+    ma = moving_average(series["values"][lo:hi], ma_window, cumsum=series["cumsum"][lo:hi + 1])
+    return series["dates"][lo:hi], series["values"][lo:hi], ma
 
-    df["date_only"] = df["dt"].dt.date
-    all_dates = pd.date_range(df["date_only"].min(), df["date_only"].max())
-
-    if value_col != "conversation_id":
-        daily_values = df.groupby("date_only")[value_col].sum().reindex(all_dates, fill_value=0)
-    else:
-        daily_values = df.groupby("date_only")[value_col].nunique().reindex(all_dates, fill_value=0)
-
-    ma = daily_values.rolling(ma_window, min_periods=1).mean()
+def plot_daily_series(dates, values, ma, ylabel, title, ma_window=20):
+    """Plots a precomputed daily series and its moving average"""
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
 
     fig, ax = plt.subplots(figsize=(14, 5))
-    ax.plot(daily_values.index, daily_values.values, alpha=0.4, label=ylabel)
-    ax.plot(ma.index, ma.values, linewidth=2.2, label=f"{ma_window}-day moving avg")
+    ax.plot(dates, values, alpha=0.4, label=ylabel)
+    ax.plot(dates, ma, linewidth=2.2, label=f"{ma_window}-day moving avg")
     ax.set_xlabel("Date")
     ax.set_ylabel(ylabel)
     ax.set_title(title)
@@ -200,8 +238,28 @@ def plot_time_series_by_date(df, value_col, ylabel, title, ma_window=20):
     plt.tight_layout()
     return fig
 
+def plot_time_series_by_date(df, value_col, ylabel, title, ma_window=20):
+    """
+    Plots a time series with optional moving average.
+    
+    df: DataFrame with 'dt' column
+    value_col: column to plot (e.g., 'word_count' or 'conversation_id')
+    ylabel: y-axis label
+    title: figure title
+    ma_window: moving average window in days
+    """
+    if df is None or df.empty:
+        return None
+    dates, values, _ = daily_series(df, value_col)
+    if len(dates) == 0:
+        return None
+    return plot_daily_series(dates.astype("datetime64[ns]"), values, moving_average(values, ma_window), ylabel, title, ma_window)
+
 
-def show_daily_words_dashboard():
+def show_daily_words_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     donor_ids = sorted(donations["donor_id"].unique())
 
     #donor input 
@@ -216,17 +274,21 @@ def show_daily_words_dashboard():
         layout=widgets.Layout(width="300px")
     )
 
-    chat_select = widgets.Dropdown(
-        options=["Select donor first"],
-        description="Chat:",
-        layout=widgets.Layout(width="420px")
-    )
+    #chat dropdown with a search box, most active chats first
+    chat_selector = create_chat_selector()
+    chat_select = chat_selector["dropdown"]
 
     start_date = widgets.DatePicker(description="Start:", disabled=True)
     end_date   = widgets.DatePicker(description="End:", disabled=True)
     ma_slider = widgets.IntSlider(value=20, min=1, max=50, step=1, description="MA window")
+    #tells whether the figure is a preview or exact
+    status = widgets.HTML()
     out_plot = widgets.Output()
-    donor_df_holder = {"df": None}
+    #preview = True while the scaled sample of a donor is shown
+    #loading = True while a donor's dates and chats are set, so the donor is drawn once instead of once per date picker change
+    donor_df_holder = {"df": None, "donor": None, "preview": False, "loading": False}
+    #full-history daily series per chat of the loaded donor, so slider and date changes never regroup messages
+    series_cache = {}
 
     #update dropdown while typing
     def update_donor_dropdown(change):
@@ -239,11 +301,16 @@ def show_daily_words_dashboard():
 
     donor_input.observe(update_donor_dropdown, names="value")
 
-    #load donor automatically on selection
+    #messages of the next donors in the dropdown are loaded ahead
+    prefetcher = create_prefetcher(donor_messages, prefetch_depth)
+    progressive = create_progressive_loader(prefetcher)
+
+    #load donor automatically on selection, a preview from a sample first if the messages take longer than the latency budget
     def load_donor(*args):
         donor = donor_input.value.strip() or donor_dropdown.value
+        status.value = ""
         if donor not in donor_ids:
-            chat_select.options = ["Invalid donor"]
+            chat_selector["clear"]("Invalid donor")
             start_date.disabled = True
             end_date.disabled = True
             with out_plot:
@@ -251,12 +318,33 @@ def show_daily_words_dashboard():
                 display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
             return
 
-        df = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"]==donor, "donation_id"]
-        )].copy()
+        def show_exact(df, refined):
+            prefetcher["prefetch_after"](donor, donor_dropdown.options)
+            show_donor(donor, df, EXACT_STATUS if refined else "")
+
+        def show_preview():
+            #word counts of the sampled messages are scaled up by their sample weight
+            sample = donor_message_sample(donor, PREVIEW_MESSAGES, sent_only=True)
+            show_donor(donor, scale_sample(sample), preview_status(sample), preview=True)
+
+        def show_error(error):
+            #the exact messages could not be loaded after a preview was drawn, the preview is removed
+            status.value = ""
+            donor_df_holder["preview"] = False
+            chat_selector["clear"]("Loading failed")
+            start_date.disabled = True
+            end_date.disabled = True
+            with out_plot:
+                out_plot.clear_output()
+                display(HTML(f"<b style='color:red;'>Loading donor {donor} failed: {type(error).__name__}: {error}</b>"))
+
+        progressive["load"](donor, show_exact, show_preview, show_error)
 
+    #updates available chats and dates for the donors messages and draws them
+    def show_donor(donor, df, status_html, preview=False):
+        status.value = status_html
         if df.empty:
-            chat_select.options = ["No messages"]
+            chat_selector["clear"]("No messages")
             start_date.disabled = True
             end_date.disabled = True
             with out_plot:
@@ -265,61 +353,77 @@ def show_daily_words_dashboard():
             return
 
         #Only donor sent messages for Daily Words
-        df = df[df["sender_id"] == donor].copy()
+        df = df[df["sender_id"] == donor]
+        #the preview and exact data are never mixed, the holder is updated before the date pickers redraw the plot
+        donor_df_holder["df"] = df
+        donor_df_holder["donor"] = donor
+        donor_df_holder["preview"] = preview
+        series_cache.clear()
         start_date.disabled = False
         end_date.disabled = False
-        start_date.value = df["dt"].min().date()
-        end_date.value = df["dt"].max().date()
-
-        chats = df["conversation_id"].unique()
-        options = [(f"Chat {c}", c) for c in chats]
-        options.insert(0, ("All Chats", "ALL"))
-        chat_select.options = options
-        chat_select.value = options[0][1]
-
-        donor_df_holder["df"] = df
+        donor_df_holder["loading"] = True
+        try:
+            start_date.value = df["dt"].min().date()
+            end_date.value = df["dt"].max().date()
+        finally:
+            donor_df_holder["loading"] = False
+
+        activity = df["conversation_id"].value_counts(sort=False)
+        chat_selector["set_chats"](chat_table(activity.index, chat_labels(activity.index), activity=activity.to_numpy()), [("All Chats", "ALL")])
         draw_plot()
 
-    def filtered_df():
+    #cached daily words for the selected chat, built once per donor and chat
+    def chat_series():
         df = donor_df_holder["df"]
         if df is None:
-            return pd.DataFrame()
-        df = df.copy()
-        start_ts = pd.Timestamp(start_date.value)
-        end_ts = pd.Timestamp(end_date.value) + pd.Timedelta(days=1)
-        df = df[(df["dt"] >= start_ts) & (df["dt"] < end_ts)]
-        if chat_select.value != "ALL":
-            df = df[df["conversation_id"] == chat_select.value]
-        return df
+            return None
+        chat = chat_select.value
+        if chat not in series_cache:
+            chat_df = df if chat == "ALL" else df[df["conversation_id"] == chat]
+            if donor_df_holder["preview"]:
+                #series of a preview are not cached
+                series_cache[chat] = build_daily_series_cache(chat_df, "word_count")
+            else:
+                series_cache[chat] = cached("daily_series", lambda: build_daily_series_cache(chat_df, "word_count"),
+                                            donor=donor_df_holder["donor"], chat=chat, column="word_count")
+        return series_cache[chat]
 
     def draw_plot(_=None):
+        if donor_df_holder["loading"]:
+            return
         out_plot.clear_output()
-        df = filtered_df()
+        series = chat_series()
         donor = donor_input.value.strip() or donor_dropdown.value
         with out_plot:
-            fig = plot_time_series_by_date(df, "word_count", "Total words per day", f"Daily Words for Donor {donor}", ma_window=ma_slider.value)
+            window = None if series is None else slice_daily_series(series, start_date.value, end_date.value, ma_slider.value)
+            title = f"Daily Words for Donor {donor}" + (" — Preview (sample)" if donor_df_holder["preview"] else "")
+            fig = None if window is None else plot_daily_series(*window, "Total words per day", title, ma_window=ma_slider.value)
             if fig is None:
                 display(HTML("<b style='color:orange;'>No data to plot for selected range/chat.</b>"))
             else:
-                add_save_and_note_controls(fig, donor, chat_select.value, "daily_words")
+                add_save_and_note_controls(fig, donor, chat_select.value, "daily_words-preview" if donor_df_holder["preview"] else "daily_words")
                 plt.show()
 
     #event bindings
     donor_dropdown.observe(load_donor, names="value")
     donor_input.on_submit(load_donor)
-    chat_select.observe(draw_plot, names="value")
+    chat_selector["on_change"](draw_plot)
     start_date.observe(draw_plot, names="value")
     end_date.observe(draw_plot, names="value")
     ma_slider.observe(draw_plot, names="value")
 
     display(widgets.VBox([
         widgets.HTML("<h2>Daily Words Dashboard</h2>"),
-        widgets.HBox([donor_input, donor_dropdown, chat_select], layout=widgets.Layout(gap="10px")),
+        widgets.HBox([donor_input, donor_dropdown, chat_selector["box"]], layout=widgets.Layout(gap="10px")),
         widgets.HBox([start_date, end_date, ma_slider], layout=widgets.Layout(gap="10px")),
+        status,
         out_plot
     ]))
 
-def show_daily_active_contacts_time_series_dashboard():
+def show_daily_active_contacts_time_series_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     donor_ids = sorted(donations["donor_id"].unique())
 
     #donor input
@@ -334,17 +438,17 @@ def show_daily_active_contacts_time_series_dashboard():
         layout=widgets.Layout(width="300px")
     )
 
-    chat_select = widgets.Dropdown(
-        options=["Select donor first"],
-        description="Chat:",
-        layout=widgets.Layout(width="420px")
-    )
+    #chat dropdown with a search box, most active chats first
+    chat_selector = create_chat_selector()
+    chat_select = chat_selector["dropdown"]
 
     start_date = widgets.DatePicker(description="Start:", disabled=True)
     end_date   = widgets.DatePicker(description="End:", disabled=True)
     ma_slider = widgets.IntSlider(value=20, min=1, max=50, step=1, description="MA window")
     out_plot = widgets.Output()
-    donor_df_holder = {"df": None}
+    donor_df_holder = {"df": None, "donor": None, "loading": False}
+    #full-history daily active chats per chat selection of the loaded donor
+    series_cache = {}
 
     #update dropdown while typing
     def update_donor_dropdown(change):
@@ -357,11 +461,14 @@ def show_daily_active_contacts_time_series_dashboard():
 
     donor_input.observe(update_donor_dropdown, names="value")
 
+    #messages of the next donors in the dropdown are loaded ahead
+    prefetcher = create_prefetcher(donor_messages, prefetch_depth)
+
     #load donor automatically
     def load_donor(*args):
         donor = donor_input.value.strip() or donor_dropdown.value
         if donor not in donor_ids:
-            chat_select.options = ["Invalid donor"]
+            chat_selector["clear"]("Invalid donor")
             start_date.disabled = True
             end_date.disabled = True
             with out_plot:
@@ -369,12 +476,11 @@ def show_daily_active_contacts_time_series_dashboard():
                 display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
             return
 
-        df = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"]==donor, "donation_id"]
-        )].copy()
+        df = prefetcher["get"](donor)
+        prefetcher["prefetch_after"](donor, donor_dropdown.options)
 
         if df.empty:
-            chat_select.options = ["No messages"]
+            chat_selector["clear"]("No messages")
             start_date.disabled = True
             end_date.disabled = True
             with out_plot:
@@ -382,38 +488,43 @@ def show_daily_active_contacts_time_series_dashboard():
                 display(HTML("<b style='color:orange;'>No messages for this donor.</b>"))
             return
 
+        #the holder holds the new donor before the pickers and chats change, which only redraw once at the end
+        donor_df_holder["df"] = df
+        donor_df_holder["donor"] = donor
+        series_cache.clear()
         start_date.disabled = False
         end_date.disabled = False
-        start_date.value = df["dt"].min().date()
-        end_date.value = df["dt"].max().date()
-
-        chats = df["conversation_id"].unique()
-        options = [(f"Chat {c}", c) for c in chats]
-        options.insert(0, ("All Chats", "ALL"))
-        chat_select.options = options
-        chat_select.value = options[0][1]
-
-        donor_df_holder["df"] = df
+        donor_df_holder["loading"] = True
+        try:
+            start_date.value = df["dt"].min().date()
+            end_date.value = df["dt"].max().date()
+            activity = df["conversation_id"].value_counts(sort=False)
+            chat_selector["set_chats"](chat_table(activity.index, chat_labels(activity.index), activity=activity.to_numpy()), [("All Chats", "ALL")])
+        finally:
+            donor_df_holder["loading"] = False
         draw_plot()
 
-    def filtered_df():
+    #cached daily active chats for the selected chat, built once per donor and chat
+    def chat_series():
         df = donor_df_holder["df"]
         if df is None:
-            return pd.DataFrame()
-        df = df.copy()
-        start_ts = pd.Timestamp(start_date.value)
-        end_ts = pd.Timestamp(end_date.value) + pd.Timedelta(days=1)
-        df = df[(df["dt"] >= start_ts) & (df["dt"] < end_ts)]
-        if chat_select.value != "ALL":
-            df = df[df["conversation_id"] == chat_select.value]
-        return df
+            return None
+        chat = chat_select.value
+        if chat not in series_cache:
+            chat_df = df if chat == "ALL" else df[df["conversation_id"] == chat]
+            series_cache[chat] = cached("daily_series", lambda: build_daily_series_cache(chat_df, "conversation_id"),
+                                        donor=donor_df_holder["donor"], chat=chat, column="conversation_id")
+        return series_cache[chat]
 
     def draw_plot(_=None):
+        if donor_df_holder["loading"]:
+            return
         out_plot.clear_output()
-        df = filtered_df()
+        series = chat_series()
         donor = donor_input.value.strip() or donor_dropdown.value
         with out_plot:
-            fig = plot_time_series_by_date(df, "conversation_id", "Number of active chats", f"Daily Active Contacts for Donor {donor}", ma_window=ma_slider.value)
+            window = None if series is None else slice_daily_series(series, start_date.value, end_date.value, ma_slider.value)
+            fig = None if window is None else plot_daily_series(*window, "Number of active chats", f"Daily Active Contacts for Donor {donor}", ma_window=ma_slider.value)
             if fig is None:
                 display(HTML("<b style='color:orange;'>No data to plot for selected range/chat.</b>"))
             else:
@@ -423,39 +534,44 @@ def show_daily_active_contacts_time_series_dashboard():
     #event bindings
     donor_dropdown.observe(load_donor, names="value")
     donor_input.on_submit(load_donor)
-    chat_select.observe(draw_plot, names="value")
+    chat_selector["on_change"](draw_plot)
     start_date.observe(draw_plot, names="value")
     end_date.observe(draw_plot, names="value")
     ma_slider.observe(draw_plot, names="value")
 
     display(widgets.VBox([
         widgets.HTML("<h2>Daily Active Contacts Time Series Dashboard</h2>"),
-        widgets.HBox([donor_input, donor_dropdown, chat_select], layout=widgets.Layout(gap="10px")),
+        widgets.HBox([donor_input, donor_dropdown, chat_selector["box"]], layout=widgets.Layout(gap="10px")),
         widgets.HBox([start_date, end_date, ma_slider], layout=widgets.Layout(gap="10px")),
         out_plot
     ]))
 
 
 #heatmap for words dasboard 
-def plot_daily_words_heatmap_words_axis(df, view="All"):
+def plot_daily_words_heatmap_words_axis(df, view="All", donor_id=None):
     """
     Heatmap of total words per day for selected donor/chat/view.
     Y-axis = total words (0-2000, readable ticks like time series)
+    donor_id: sender id of the donor, defaults to the sender of the first row
     """
     if df is None or df.empty:
         return None
+    if donor_id is None:
+        donor_id = df["sender_id"].iloc[0]
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
 
-    df = df.copy()
-    df["date_only"] = df["dt"].dt.date
-
-    #filter by view
+    #filter by view (a row mask, the input frame is neither copied nor modified)
     if view == "Sent":
-        df = df[df["sender_id"] == df["sender_id"].iloc[0]]
+        keep = df["sender_id"] == donor_id
     elif view == "Received":
-        df = df[df["sender_id"] != df["sender_id"].iloc[0]]
+        keep = df["sender_id"] != donor_id
+    else:
+        keep = slice(None)
+    words = df["word_count"][keep]
 
     #aggregate total words per day
-    daily_words = df.groupby("date_only")["word_count"].sum()
+    daily_words = words.groupby(df["dt"][keep].dt.normalize()).sum()
     all_dates = pd.date_range(daily_words.index.min(), daily_words.index.max(), freq='D')
     daily_words = daily_words.reindex(all_dates, fill_value=0)
 
@@ -486,12 +602,15 @@ def plot_daily_words_heatmap_words_axis(df, view="All"):
 
     ax.set_xlabel("Date")
     ax.set_ylabel("Total Words")
-    ax.set_title(f"Daily Words Heatmap for Donor {df['sender_id'].iloc[0]} ({view} Messages)")
+    ax.set_title(f"Daily Words Heatmap for Donor {donor_id} ({view} Messages)")
     plt.tight_layout()
     return fig
     
 
-def show_daily_words_heatmap_words_axis_dashboard():
+def show_daily_words_heatmap_words_axis_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     donor_ids = sorted(donations["donor_id"].unique())
 
     donor_input = widgets.Text(
@@ -503,11 +622,9 @@ def show_daily_words_heatmap_words_axis_dashboard():
         options=donor_ids[:50],
         layout=widgets.Layout(width="300px")
     )
-    chat_select = widgets.Dropdown(
-        options=["Select donor first"],
-        description="Chat:",
-        layout=widgets.Layout(width="420px")
-    )
+    #chat dropdown with a search box, most active chats first
+    chat_selector = create_chat_selector()
+    chat_select = chat_selector["dropdown"]
     view_selector = widgets.RadioButtons(
         options=["Sent", "Received", "All"],
         description="View:",
@@ -516,7 +633,7 @@ def show_daily_words_heatmap_words_axis_dashboard():
     start_date = widgets.DatePicker(description="Start:", disabled=True)
     end_date   = widgets.DatePicker(description="End:", disabled=True)
     out_plot = widgets.Output()
-    donor_df_holder = {"df": None}
+    donor_df_holder = {"index": None, "donor": None, "loading": False}
 
     #update dropdown while typing
     def update_donor_dropdown(change):
@@ -529,11 +646,18 @@ def show_daily_words_heatmap_words_axis_dashboard():
 
     donor_input.observe(update_donor_dropdown, names="value")
 
+    #all messages of a donor and their sorted time index, loaded ahead for the next donors in the dropdown
+    def prepare(donor):
+        df = donor_messages(donor)
+        return df, (None if df.empty else build_time_index(df))
+
+    prefetcher = create_prefetcher(prepare, prefetch_depth)
+
     #load donor messages
     def load_donor(*args):
         donor = donor_input.value.strip() or donor_dropdown.value
         if donor not in donor_ids:
-            chat_select.options = ["Invalid donor"]
+            chat_selector["clear"]("Invalid donor")
             start_date.disabled = True
             end_date.disabled = True
             with out_plot:
@@ -541,12 +665,11 @@ def show_daily_words_heatmap_words_axis_dashboard():
                 display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
             return
 
-        df = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"]==donor, "donation_id"]
-        )].copy()
+        df, index = prefetcher["get"](donor)
+        prefetcher["prefetch_after"](donor, donor_dropdown.options)
 
         if df.empty:
-            chat_select.options = ["No messages"]
+            chat_selector["clear"]("No messages")
             start_date.disabled = True
             end_date.disabled = True
             with out_plot:
@@ -554,38 +677,35 @@ def show_daily_words_heatmap_words_axis_dashboard():
                 display(HTML("<b style='color:orange;'>No messages for this donor.</b>"))
             return
 
+        #the holder holds the new donor before the pickers and chats change, which only redraw once at the end
+        donor_df_holder["index"] = index
+        donor_df_holder["donor"] = donor
         start_date.disabled = False
         end_date.disabled = False
-        start_date.value = df["dt"].min().date()
-        end_date.value = df["dt"].max().date()
-
-        chats = df["conversation_id"].unique()
-        options = [(f"Chat {c}", c) for c in chats]
-        options.insert(0, ("All Chats", "ALL"))
-        chat_select.options = options
-        chat_select.value = options[0][1]
-
-        donor_df_holder["df"] = df
+        donor_df_holder["loading"] = True
+        try:
+            start_date.value = df["dt"].min().date()
+            end_date.value = df["dt"].max().date()
+            activity = df["conversation_id"].value_counts(sort=False)
+            chat_selector["set_chats"](chat_table(activity.index, chat_labels(activity.index), activity=activity.to_numpy()), [("All Chats", "ALL")])
+        finally:
+            donor_df_holder["loading"] = False
         draw_plot()
 
     def filtered_df():
-        df = donor_df_holder["df"]
-        if df is None:
+        if donor_df_holder["index"] is None:
             return pd.DataFrame()
-        df = df.copy()
-        start_ts = pd.Timestamp(start_date.value)
-        end_ts = pd.Timestamp(end_date.value) + pd.Timedelta(days=1)
-        df = df[(df["dt"] >= start_ts) & (df["dt"] < end_ts)]
-        if chat_select.value != "ALL":
-            df = df[df["conversation_id"] == chat_select.value]
-        return df
+        return time_window(donor_df_holder["index"], start_date.value, end_date.value, chat_select.value)
 
     def draw_plot(_=None):
+        if donor_df_holder["loading"]:
+            return
         out_plot.clear_output()
         df = filtered_df()
         view = view_selector.value
         with out_plot:
-            fig = plot_daily_words_heatmap_words_axis(df, view=view)
+            fig = cached_figure("words_axis_heatmap", lambda: plot_daily_words_heatmap_words_axis(df, view=view, donor_id=donor_df_holder["donor"]),
+                                donor=donor_df_holder["donor"], chat=chat_select.value, start=start_date.value, end=end_date.value, view=view)
             if fig is None:
                 display(HTML("<b style='color:orange;'>No data to plot for selected range/chat.</b>"))
             else:
@@ -598,7 +718,7 @@ def show_daily_words_heatmap_words_axis_dashboard():
     #event bindings
     donor_dropdown.observe(load_donor, names="value")
     donor_input.on_submit(load_donor)
-    chat_select.observe(draw_plot, names="value")
+    chat_selector["on_change"](draw_plot)
     start_date.observe(draw_plot, names="value")
     end_date.observe(draw_plot, names="value")
     view_selector.observe(draw_plot, names="value")
@@ -606,7 +726,7 @@ def show_daily_words_heatmap_words_axis_dashboard():
     #layout
     display(widgets.VBox([
         widgets.HTML("<h2>Daily Words Heatmap Dashboard (Words Axis)</h2>"),
-        widgets.HBox([donor_input, donor_dropdown, chat_select, view_selector], layout=widgets.Layout(gap="10px")),
+        widgets.HBox([donor_input, donor_dropdown, chat_selector["box"], view_selector], layout=widgets.Layout(gap="10px")),
         widgets.HBox([start_date, end_date], layout=widgets.Layout(gap="10px")),
         out_plot
     ]))
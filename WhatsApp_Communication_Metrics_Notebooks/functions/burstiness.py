@@ -4,47 +4,57 @@ By analyzing inter-message intervals (the time between consecutive messages), we
 from dataloader import *                #Imports datasets like 'messages' and 'donations'
 from functions.pic_notes_save import *  #Imports function 'add_save_and_note_controls' for saving figure and taking notes 
 
-def compute_burstiness(days):
-    #Sorts all message dates 
-    days_sorted = sorted(days)
-    #If less than 2 message days, burstiness can't be measured (no intervals)
-    if len(days_sorted) < 2:
-        return (np.nan, np.nan)
-    #Compute time gaps
-    inter_event = np.diff(pd.to_datetime(days_sorted)).astype("timedelta64[D]").astype(int)
-    #mu = mean and sigma = standard deviation of intervals.
-    mu = inter_event.mean()
-    if mu == 0:
-        return (np.nan, np.nan)
-    sigma = inter_event.std(ddof=0)
-    #r=Coefficient of variation tells us how variable the intervals are relative to the mean
-    r = sigma / mu
-    n = len(days_sorted)
-    #B1 (classic burstiness index), 
-    B1 = (r - 1) / (r + 1) if (r + 1) != 0 else np.nan
-    if n > 1:
-        num = (np.sqrt(n + 1) * r) - np.sqrt(n - 1)
-        den = ((np.sqrt(n + 1) - 2) * r) + np.sqrt(n - 1)
-        B2 = num / den if den != 0 else np.nan
-    else:
-        #B2 refines B1 to reduce bias when few events exist
-        B2 = np.nan
-    return (B1, B2)
-
-#B1 < -0.2 is regular,B1 between -0.2 and +0.2 is random, B1 > +0.2 is highly bursty
-def classify_b1(b1, lo=-0.2, hi=0.2):
-    if pd.isna(b1):
-        return "N/A"
-    if b1 < lo:
-        return "Regular"
-    if b1 > hi:
-        return "Bursty"
-    return "Random"
+#Metric implementations live in the headless metrics module
+from functions.metrics import compute_burstiness, compute_burstiness_streaming, classify_b1, classify_b1_grouped, burstiness_ci
+from functions.metrics import burstiness_null_test
+#Searchable chat dropdown that only holds the top chats
+from functions.chat_selector import create_chat_selector, chat_table, chat_labels
+#Sorted (conversation, dt) index for message-level timestamps per chat
+from functions.time_index import build_time_index, event_times_by_chat
+#Persistent cache, per-chat results survive kernel restarts
+from functions.result_cache import cached
+#Next donors in the dropdown are loaded on a background thread
+from functions.prefetch import create_prefetcher, PREFETCH_DEPTH
+
+#opacity of a raster line holding a single event when other lines hold more
+RASTER_MIN_ALPHA = 0.3
+#surrogates of the null-model tests shown under a raster (sequences that are clearly not significant stop earlier),
+#long message-level chats get fewer so that surrogates x gaps stays below DASHBOARD_NULL_CELLS, but at least DASHBOARD_NULL_MIN
+DASHBOARD_NULL_SURROGATES = 200
+DASHBOARD_NULL_CELLS = 1 << 24
+DASHBOARD_NULL_MIN = 20
 
 def plot_raster(days, title, B1=None, B2=None, ax=None, color=None):
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import to_rgba
     if ax is None:
         fig, ax = plt.subplots(figsize=(8, 2))
-    ax.eventplot(pd.to_datetime(sorted(days)), orientation="horizontal", colors=color or "black", linewidths=1.5)
+    #events are binned into pixel-width time bins and drawn as one LineCollection (one line per non-empty bin),
+    #so drawing cost depends on the plot width and not on the number of days or messages
+    times = np.sort(pd.to_datetime(days).to_numpy())
+    ax.xaxis.update_units(times)
+    x = ax.convert_xunits(times)
+    if len(x):
+        n_bins = max(1, int(ax.get_window_extent().width))
+        span = x[-1] - x[0]
+        bins = np.zeros(len(x), dtype=np.int64) if span == 0 else np.minimum(((x - x[0]) / span * n_bins).astype(np.int64), n_bins - 1)
+        counts = np.bincount(bins)
+        filled = counts > 0
+        counts = counts[filled]
+        #line at the mean time of its bin (the exact event time when a bin holds a single event),
+        #the number of events of a bin is encoded in the opacity, so it shows for any plot color (also black):
+        #the busiest bin is opaque and a single event is drawn at RASTER_MIN_ALPHA
+        positions = np.bincount(bins, weights=x)[filled] / counts
+        colors = np.tile(to_rgba(color or "black"), (len(counts), 1))
+        if counts.max() > 1:
+            colors[:, 3] *= RASTER_MIN_ALPHA + (1 - RASTER_MIN_ALPHA) * (counts - 1) / (counts.max() - 1)
+        segments = np.stack([np.column_stack([positions, np.full(len(positions), 0.5)]),
+                             np.column_stack([positions, np.full(len(positions), 1.5)])], axis=1)
+        ax.add_collection(LineCollection(segments, colors=colors, linewidths=1.5), autolim=False)
+        #same data limits as ax.eventplot (first to last event, line offset 1 +- line length 1)
+        ax.update_datalim([(x[0], 0), (x[-1], 2)])
+        ax.autoscale_view()
     extra = ""
     if B1 is not None and B2 is not None:
         extra = f"  (B1={B1:.2f}, B2={B2:.2f})"
@@ -55,7 +65,10 @@ def plot_raster(days, title, B1=None, B2=None, ax=None, color=None):
     return ax
 
 
-def show_raster_dashboard_overall():
+def show_raster_dashboard_overall(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     donor_ids = sorted(donations["donor_id"].unique())
 
     #Input text to write donor id 
@@ -70,18 +83,27 @@ def show_raster_dashboard_overall():
         layout=widgets.Layout(width="300px")
     )
     #Dropdown to select Chat(Overall aggregate,overall dominant, largest absolute b1 value or individual chats)
-    chat_select = widgets.Dropdown(
-        options=["Select donor first"],
-        description="Chat:",
-        layout=widgets.Layout(width="600px")
+    #with a search box, sorted by activity or |B1|
+    chat_selector = create_chat_selector(
+        sort_options=[("Most active", "activity"), ("Largest |B1|", "abs_b1")],
+        width="600px"
+    )
+    chat_select = chat_selector["dropdown"]
+    #Inter-event times between distinct message days or between individual messages (second resolution)
+    resolution_select = widgets.Dropdown(
+        options=[("Days", "day"), ("Seconds (message level)", "second")],
+        value="day",
+        description="Resolution:",
+        layout=widgets.Layout(width="280px")
     )
 
     out_raster = widgets.Output()
 
-    #Internal storage
+    #Internal storage, events are message days or message timestamps depending on resolution
     chat_select._burst_df = None
-    chat_select._days_by_chat = None
+    chat_select._events_by_chat = None
     chat_select._donor_df = None
+    chat_select._resolution = None
     #updates when new donor id selected
     def update_donor_dropdown(change):
         text = change["new"].strip()
@@ -93,6 +115,39 @@ def show_raster_dashboard_overall():
 
     donor_input.observe(update_donor_dropdown, names="value")
 
+    #per-chat events and B1/B2 of a donor at a resolution (None without sent messages),
+    #computed ahead for the next donors in the dropdown. Null-model tests are only run for the chat that is shown
+    def prepare(donor, resolution):
+        if resolution == "second":
+            #Filters messages sent by the selected donor
+            donor_rows = donor_messages(donor, sent_only=True)
+            if donor_rows.empty:
+                return None
+            #message timestamps per chat are contiguous sorted slices of the time index
+            events_by_chat = pd.Series(event_times_by_chat(build_time_index(donor_rows)), dtype=object)
+        else:
+            #only the distinct message days per chat are needed, no message rows are loaded
+            donor_rows = None
+            events_by_chat = donor_days_per_chat(donor)
+            if events_by_chat.empty:
+                return None
+
+        def chat_burstiness():
+            if resolution == "second":
+                #B1/B2 accumulated in one streaming pass per chat
+                burst = events_by_chat.apply(compute_burstiness_streaming)
+            else:
+                #Compute burstiness per chat where each chat has list of message days and B1, B2 burstiness scores
+                burst = events_by_chat.apply(lambda d: compute_burstiness(d))
+            return pd.DataFrame(burst.tolist(), index=events_by_chat.index, columns=["B1","B2"]).dropna(how="all")
+
+        burst_df = cached("burstiness_chats", chat_burstiness, donor=donor, resolution=resolution)
+        return donor_rows, events_by_chat, burst_df
+
+    #one prefetcher per resolution, so a prefetched donor always matches the selected resolution
+    prefetchers = {resolution: create_prefetcher(lambda donor, resolution=resolution: prepare(donor, resolution), prefetch_depth)
+                   for _, resolution in resolution_select.options}
+
     #Load donor data
     def load_donor(*args):
         out_raster.clear_output()
@@ -100,70 +155,97 @@ def show_raster_dashboard_overall():
         if donor not in donor_ids:
             with out_raster:
                 display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
-            chat_select.options = ["Invalid donor"]
+            chat_selector["clear"]("Invalid donor")
             return
-        #Filters messages sent by the selected donor
-        donor_rows = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"] == donor, "donation_id"]
-        )].copy()
-        donor_rows = donor_rows[donor_rows["sender_id"] == donor].copy()
-
-        if donor_rows.empty:
-            chat_select.options = ["No messages from donor"]
+        resolution = resolution_select.value
+        prepared = prefetchers[resolution]["get"](donor)
+        prefetchers[resolution]["prefetch_after"](donor, donor_dropdown.options)
+
+        if prepared is None:
+            chat_selector["clear"]("No messages from donor")
             with out_raster:
                 display(HTML("<b style='color:orange;'>This donor has no sent messages.</b>"))
             return
-        #Compute burstiness per chat where each chat has list of message days and B1, B2 burstiness scores
-        days_by_chat = donor_rows.groupby("conversation_id")["date_only"].apply(lambda s: sorted(set(s)))
-        burst = days_by_chat.apply(lambda d: compute_burstiness(d))
-        burst_df = pd.DataFrame(burst.tolist(), index=days_by_chat.index, columns=["B1","B2"]).dropna(how="all")
-
-        chat_options = []
-        for cid, row in burst_df.iterrows():
-            b1 = row["B1"]
-            label = classify_b1(b1)
-            #adds chat labels like Chat 12 (Bursty, B1=0.65) also adds three overall views
-            chat_options.append((f"Chat {cid} ({label}, B1={b1:.2f})", cid))
-        
+        donor_rows, events_by_chat, burst_df = prepared
+
+        #chat labels like Chat 12 (Bursty, B1=0.65), built column-wise
+        b1 = burst_df["B1"].to_numpy(dtype=float)
+        labels = (chat_labels(burst_df.index) + " (" + classify_b1_grouped(b1).astype(object) + ", B1=" + np.char.mod("%.2f", b1).astype(object) + ")")
+        chats = chat_table(burst_df.index, labels,
+                           activity=events_by_chat.reindex(burst_df.index).map(len).to_numpy(),
+                           abs_b1=np.abs(b1))
+
         """OVERALL_AGGREGATE show a raster that aggregates all donor's days across all chats into a single set of days and compute an aggregate B1. Useful to see the donor's overall pattern.
         OVERALL_DOMINANT finds classification counts across chats (how many Regular/Bursty/Random) and plots an example chat for the dominant class (or multiple if tie).
         OVERALL_EXTREME finds the chat with the largest absolute B1 (most extreme) and plots it."""
 
-        chat_options.insert(0, ("Overall (Aggregate B1)", "OVERALL_AGGREGATE"))
-        chat_options.insert(1, ("Overall (Dominant Behavior)", "OVERALL_DOMINANT"))
-        chat_options.insert(2, ("Overall (Largest Absolute B1 Value)", "OVERALL_EXTREME"))
-
-        chat_select.options = chat_options
-        chat_select.value = chat_options[0][1]
+        overall_options = [
+            ("Overall (Aggregate B1)", "OVERALL_AGGREGATE"),
+            ("Overall (Dominant Behavior)", "OVERALL_DOMINANT"),
+            ("Overall (Largest Absolute B1 Value)", "OVERALL_EXTREME"),
+        ]
+        #the three overall views come first, then the top chats
+        chat_selector["set_chats"](chats, overall_options)
         chat_select._burst_df = burst_df
-        chat_select._days_by_chat = days_by_chat
+        chat_select._events_by_chat = events_by_chat
         chat_select._donor_df = donor_rows
+        chat_select._resolution = resolution
         draw_raster()
 
+    #bootstrap confidence intervals of B1/B2 shown under a raster, resamples are capped for long message-level chats
+    def display_ci(events, donor, chat):
+        (b1_low, b1_high), (b2_low, b2_high) = cached("burstiness_ci", lambda: burstiness_ci(events, max_cells=1 << 24),
+                                                      donor=donor, chat=chat, resolution=chat_select._resolution)
+        if not np.isnan(b1_low):
+            display(HTML(f"<small><b>95% CI</b> (bootstrap over inter-event gaps): "
+                         f"B1 [{b1_low:.2f}, {b1_high:.2f}], B2 [{b2_low:.2f}, {b2_high:.2f}]</small>"))
+
+    #null-model p-values under a raster: B1 against Poisson surrogates, memory coefficient M against shuffled gaps,
+    #computed when the raster is shown, with DASHBOARD_NULL_SURROGATES surrogates capped for long message-level chats
+    def display_null(events, donor, chat):
+        row = cached("burstiness_null",
+                     lambda: burstiness_null_test(pd.Series([events]), DASHBOARD_NULL_SURROGATES, max_cells=DASHBOARD_NULL_CELLS,
+                                                  min_surrogates=DASHBOARD_NULL_MIN).iloc[0],
+                     donor=donor, chat=chat, resolution=chat_select._resolution)
+        if np.isnan(row["p_poisson"]):
+            return
+        memory = "" if np.isnan(row["M"]) else f", memory M = {row['M']:.2f} (p = {row['p_shuffled']:.3f} vs shuffled gaps)"
+        display(HTML(f"<small><b>Null models</b>: B1 p = {row['p_poisson']:.3f} vs Poisson events{memory}</small>"))
+
     def draw_raster(_=None):
         out_raster.clear_output()
         burst_df = chat_select._burst_df
-        days_by_chat = chat_select._days_by_chat
+        days_by_chat = chat_select._events_by_chat
         donor_df = chat_select._donor_df
         choice = chat_select.value
         donor = donor_input.value.strip() or donor_dropdown.value
 
         if burst_df is None or choice is None:
             return
+        #message-level figures get their own title suffix and file names
+        seconds = chat_select._resolution == "second"
+        level = " [message level]" if seconds else ""
+        tag_suffix = "-seconds" if seconds else ""
 
         with out_raster:
             if choice == "OVERALL_AGGREGATE":
-                all_days = sorted(set(donor_df["date_only"]))
-                B1, B2 = compute_burstiness(all_days)
+                if seconds:
+                    all_days = np.sort(donor_df["dt"].dropna().to_numpy())
+                    B1, B2 = compute_burstiness_streaming(all_days)
+                else:
+                    all_days = sorted(set().union(*days_by_chat))
+                    B1, B2 = compute_burstiness(all_days)
                 label = classify_b1(B1)
                 fig, ax = plt.subplots(figsize=(10, 2.5))
-                plot_raster(all_days, f"Overall Donor Chats (Aggregate B1: {label})", B1, B2, ax=ax,
+                plot_raster(all_days, f"Overall Donor Chats (Aggregate B1: {label}){level}", B1, B2, ax=ax,
                             color=("green" if label == "Regular" else "red" if label == "Bursty" else "blue"))
-                add_save_and_note_controls(fig, donor, choice, "burstiness", extra_tag="overall-aggregate")
+                add_save_and_note_controls(fig, donor, choice, "burstiness", extra_tag="overall-aggregate" + tag_suffix)
                 plt.show()
+                display_ci(all_days, donor, choice)
+                display_null(all_days, donor, choice)
 
             elif choice == "OVERALL_DOMINANT":
-                classifications = burst_df["B1"].apply(classify_b1)
+                classifications = pd.Series(classify_b1_grouped(burst_df["B1"]), index=burst_df.index)
                 if classifications.empty:
                     display(HTML("<b style='color:orange;'>No chats to analyze.</b>"))
                     return
@@ -175,10 +257,11 @@ def show_raster_dashboard_overall():
                     row = burst_df.loc[chat_id]
                     days = days_by_chat[chat_id]
                     fig, ax = plt.subplots(figsize=(10, 2.5))
-                    plot_raster(days, f"Example of {dt} chat", row["B1"], row["B2"], ax=ax,
+                    plot_raster(days, f"Example of {dt} chat{level}", row["B1"], row["B2"], ax=ax,
                                 color=("green" if dt == "Regular" else "red" if dt == "Bursty" else "blue"))
-                    add_save_and_note_controls(fig, donor, chat_id, "burstiness", extra_tag=f"overall-dominant-tie{i}-{dt}")
+                    add_save_and_note_controls(fig, donor, chat_id, "burstiness", extra_tag=f"overall-dominant-tie{i}-{dt}{tag_suffix}")
                     plt.show()
+                    display_null(days, donor, chat_id)
 
             elif choice == "OVERALL_EXTREME":
                 most_extreme_chat_id = burst_df["B1"].abs().idxmax()
@@ -186,10 +269,11 @@ def show_raster_dashboard_overall():
                 days = days_by_chat[most_extreme_chat_id]
                 label = classify_b1(row["B1"])
                 fig, ax = plt.subplots(figsize=(10, 2.5))
-                plot_raster(days, f"Largest Absolute B1 Value: {label}", row["B1"], row["B2"], ax=ax,
+                plot_raster(days, f"Largest Absolute B1 Value: {label}{level}", row["B1"], row["B2"], ax=ax,
                             color=("green" if label == "Regular" else "red" if label == "Bursty" else "blue"))
-                add_save_and_note_controls(fig, donor, most_extreme_chat_id, "burstiness", extra_tag="overall-extreme")
+                add_save_and_note_controls(fig, donor, most_extreme_chat_id, "burstiness", extra_tag="overall-extreme" + tag_suffix)
                 plt.show()
+                display_null(days, donor, most_extreme_chat_id)
 
             else:
                 if choice in burst_df.index:
@@ -197,18 +281,22 @@ def show_raster_dashboard_overall():
                     days = days_by_chat[choice]
                     label = classify_b1(row["B1"])
                     fig, ax = plt.subplots(figsize=(10, 2.5))
-                    plot_raster(days, f"Chat {choice} ({label})", row["B1"], row["B2"], ax=ax,
+                    plot_raster(days, f"Chat {choice} ({label}){level}", row["B1"], row["B2"], ax=ax,
                                 color=("green" if label == "Regular" else "red" if label == "Bursty" else "blue"))
-                    add_save_and_note_controls(fig, donor, choice, "burstiness")
+                    add_save_and_note_controls(fig, donor, choice, "burstiness", extra_tag=tag_suffix.lstrip("-"))
                     plt.show()
+                    display_ci(days, donor, choice)
+                    display_null(days, donor, choice)
 
     #dynamically reloads and redraws plots when donor or chat is changed
     donor_dropdown.observe(lambda ch: load_donor(), names="value")
     donor_input.on_submit(load_donor)
-    chat_select.observe(draw_raster, names="value")
+    chat_selector["on_change"](draw_raster)
+    resolution_select.observe(lambda ch: load_donor() if chat_select._burst_df is not None else None, names="value")
 
     display(widgets.VBox([
         widgets.HTML("<h2>Raster Plot Dashboard</h2>"),
-        widgets.HBox([donor_input, donor_dropdown, chat_select], layout=widgets.Layout(gap="10px")),
+        widgets.HBox([donor_input, donor_dropdown, resolution_select], layout=widgets.Layout(gap="10px")),
+        chat_selector["box"],
         out_raster
     ]))
@@ -0,0 +1,118 @@
+"""Searchable chat selector for donors with many chats.
+The full chat table (labels and sort keys) stays in Python. The dropdown only receives the fixed entries
+(e.g. All Chats) and the top N chats for the current search and sort order, so the frontend payload stays small.
+"""
+import numpy as np
+import pandas as pd
+
+#number of chats sent to the dropdown at once, the other chats are reached with the search box
+CHAT_OPTIONS_TOP_N = 50
+
+def chat_table(chats, labels, **sort_keys):
+    """Chat table for the selector: labels and sort key columns indexed by conversation_id"""
+    return pd.DataFrame({"label": labels, **sort_keys}, index=pd.Index(chats, name="conversation_id"))
+
+def chat_labels(chats, prefix="Chat "):
+    #column-wise labels like "Chat 12"
+    return prefix + pd.Index(chats).astype(str).to_numpy(dtype=object)
+
+def top_chats(table, query="", sort_by=None, top_n=CHAT_OPTIONS_TOP_N):
+    """
+    (label, conversation_id) options of the top_n chats whose label contains query, largest sort_by first
+    (missing sort keys last, ties keep table order). Also returns the number of matching chats.
+    """
+    if query:
+        table = table[table["label"].str.contains(query, case=False, regex=False)]
+    if sort_by is not None:
+        keys = table[sort_by].to_numpy(dtype=float)
+        order = np.argsort(-np.nan_to_num(keys, nan=-np.inf), kind="stable")[:top_n]
+    else:
+        order = np.arange(min(top_n, len(table)))
+    top = table.iloc[order]
+    return list(zip(top["label"], top.index)), len(table)
+
+def create_chat_selector(sort_options=(("Most active", "activity"),), description="Chat:", width="420px", top_n=CHAT_OPTIONS_TOP_N):
+    """
+    Chat dropdown with a search box and sort order.
+    sort_options: (label, column) pairs of the chat table columns to sort by.
+    Returns a dict with the dropdown, the widget box to display and the functions
+        set_chats(table, fixed_options) to load a donor's chats (selects the first fixed option, no change event),
+        clear(message) to show a message instead of chats,
+        on_change(callback) to observe the selected chat (not called while the options are refreshed).
+    """
+    import ipywidgets as widgets
+    chat_select = widgets.Dropdown(
+        options=["Select donor first"],
+        description=description,
+        layout=widgets.Layout(width=width)
+    )
+    chat_search = widgets.Text(
+        placeholder="Search chats",
+        layout=widgets.Layout(width="160px")
+    )
+    chat_sort = widgets.Dropdown(
+        options=list(sort_options),
+        layout=widgets.Layout(width="140px")
+    )
+    chat_count = widgets.HTML()
+    state = {"table": None, "fixed": [], "refreshing": False, "callbacks": []}
+
+    def set_options(options, keep_value):
+        #options are replaced without change events, the previous chat stays selected when it is still an option
+        previous = chat_select.value
+        state["refreshing"] = True
+        try:
+            chat_select.options = options
+            if keep_value and previous in [value for _, value in options]:
+                chat_select.value = previous
+        finally:
+            state["refreshing"] = False
+        if keep_value and chat_select.value != previous:
+            for callback in state["callbacks"]:
+                callback({"name": "value", "old": previous, "new": chat_select.value})
+
+    def refresh(change=None, keep_value=True):
+        table = state["table"]
+        if table is None:
+            return
+        options, matches = top_chats(table, chat_search.value.strip(), chat_sort.value, top_n)
+        #the selected chat stays in the list while searching
+        current = chat_select.value
+        if keep_value and current in table.index and current not in [value for _, value in options]:
+            options.insert(0, (table.at[current, "label"], current))
+        set_options(state["fixed"] + options, keep_value)
+        chat_count.value = f"<small>{min(matches, top_n)} of {len(table)} chats</small>" if len(table) > top_n or chat_search.value else ""
+
+    def set_chats(table, fixed_options=()):
+        state["table"] = table
+        state["fixed"] = list(fixed_options)
+        state["refreshing"] = True
+        chat_search.value = ""
+        state["refreshing"] = False
+        refresh(keep_value=False)
+
+    def clear(message):
+        state["table"] = None
+        chat_count.value = ""
+        chat_select.options = [message]
+
+    def on_change(callback):
+        state["callbacks"].append(callback)
+
+    def notify(change):
+        if not state["refreshing"]:
+            for callback in state["callbacks"]:
+                callback(change)
+
+    chat_select.observe(notify, names="value")
+    chat_search.observe(lambda ch: None if state["refreshing"] else refresh(), names="value")
+    chat_sort.observe(refresh, names="value")
+
+    controls = [chat_select, chat_search] + ([chat_sort] if len(sort_options) > 1 else []) + [chat_count]
+    return {
+        "dropdown": chat_select,
+        "box": widgets.HBox(controls, layout=widgets.Layout(gap="6px", align_items="center")),
+        "set_chats": set_chats,
+        "clear": clear,
+        "on_change": on_change,
+    }
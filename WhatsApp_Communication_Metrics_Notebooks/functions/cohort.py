@@ -0,0 +1,309 @@
+"""Cohort Distribution — where a donor stands relative to all other donors.
+The per-donor metrics (Gini by messages and words, aggregate B1/B2, mean and median bias) and bootstrap confidence
+intervals are computed once into a table that is saved in the outputs folder. The dashboard only reads this table, so switching donors never scans messages.
+"""
+import json
+
+from dataloader import *                #Imports datasets like 'messages' and 'donations'
+from functions.pic_notes_save import *  #Imports function 'add_save_and_note_controls' for saving figure and taking notes
+
+#All metrics of the table come from one pass of the metric planner
+from functions.planner import run_metric_plan
+#Hour-of-week grids of all donors, computed with bincount over the whole message table
+from functions.metrics import datetime_values, hour_of_week_counts, cohort_hour_of_week, HOURS_PER_WEEK
+#Persistent cache, the hour-of-week grids are only recomputed when the data changes
+from functions.result_cache import cached, DATA_VERSION, CODE_VERSION
+
+COHORT_METRICS_CSV = OUTPUT_DIR / "cohort_metrics.csv"
+#data and code fingerprints the saved table was computed with, it is rebuilt when they change
+COHORT_METRICS_PROVENANCE = OUTPUT_DIR / "cohort_metrics.json"
+
+#table column -> label shown in the dashboard
+COHORT_COLUMNS = {
+    "gini_messages": "Gini (Messages)",
+    "gini_words": "Gini (Words)",
+    "B1": "Aggregate B1",
+    "B2": "Aggregate B2",
+    "mean_bias": "Mean Bias",
+    "median_bias": "Median Bias",
+}
+#bootstrap confidence interval columns (low, high) of the table
+COHORT_CI_COLUMNS = {
+    "gini_messages": ("gini_messages_low", "gini_messages_high"),
+    "gini_words": ("gini_words_low", "gini_words_high"),
+    "B1": ("B1_low", "B1_high"),
+    "B2": ("B2_low", "B2_high"),
+}
+COHORT_TABLE_COLUMNS = list(COHORT_COLUMNS) + [c for pair in COHORT_CI_COLUMNS.values() for c in pair]
+
+def _cohort_table(results):
+    #one row per donor from the planner results, bias averaged over chats with a valid bias like the interaction dashboard
+    bias = results["interaction_balance"].dropna(subset=["bias"]).groupby("donor_id")["bias"].agg(["mean", "median"])
+    return pd.DataFrame({
+        "gini_messages": results["gini_messages"],
+        "gini_words": results["gini_words"],
+        "B1": results["burstiness_aggregate"]["B1"],
+        "B2": results["burstiness_aggregate"]["B2"],
+        "mean_bias": bias["mean"],
+        "median_bias": bias["median"],
+        "gini_messages_low": results["gini_messages_ci"]["low"],
+        "gini_messages_high": results["gini_messages_ci"]["high"],
+        "gini_words_low": results["gini_words_ci"]["low"],
+        "gini_words_high": results["gini_words_ci"]["high"],
+        "B1_low": results["burstiness_aggregate_ci"]["B1_low"],
+        "B1_high": results["burstiness_aggregate_ci"]["B1_high"],
+        "B2_low": results["burstiness_aggregate_ci"]["B2_low"],
+        "B2_high": results["burstiness_aggregate_ci"]["B2_high"],
+    })
+
+def build_cohort_metrics(chunk_size=50):
+    """
+    Computes the per-donor metrics table (indexed by donor_id, donors without messages get NaN)
+    with bootstrap confidence intervals for the Gini and aggregate burstiness columns.
+    With the out-of-core backend donors are processed in chunks, so only chunk_size donors' messages are loaded at a time.
+    """
+    metrics = ["gini_messages", "gini_words", "burstiness_aggregate", "interaction_balance",
+               "gini_messages_ci", "gini_words_ci", "burstiness_aggregate_ci"]
+    donor_ids = sorted(donations["donor_id"].unique())
+    if messages is not None:
+        table = _cohort_table(run_metric_plan(messages, donations, metrics))
+    else:
+        tables = []
+        for i in range(0, len(donor_ids), chunk_size):
+            chunk = donor_ids[i:i + chunk_size]
+            chunk_msgs = pd.concat([donor_messages(d) for d in chunk])
+            if not chunk_msgs.empty:
+                tables.append(_cohort_table(run_metric_plan(chunk_msgs, donations, metrics)))
+        table = pd.concat(tables) if tables else pd.DataFrame(columns=COHORT_TABLE_COLUMNS)
+    table = table.reindex(pd.Index(donor_ids, name="donor_id"))
+    return table[COHORT_TABLE_COLUMNS]
+
+def _cohort_provenance():
+    return {"data_version": DATA_VERSION, "code_version": CODE_VERSION}
+
+def load_cohort_metrics(rebuild=False):
+    """
+    Reads the saved cohort table, computes and saves it first if it doesn't exist yet, lacks columns,
+    was computed from other data or code (see COHORT_METRICS_PROVENANCE) or rebuild=True
+    """
+    if not rebuild and COHORT_METRICS_CSV.exists() and COHORT_METRICS_PROVENANCE.exists():
+        table = pd.read_csv(COHORT_METRICS_CSV, index_col="donor_id")
+        if (set(COHORT_TABLE_COLUMNS) <= set(table.columns)
+                and json.loads(COHORT_METRICS_PROVENANCE.read_text()) == _cohort_provenance()):
+            return table
+    table = build_cohort_metrics()
+    table.to_csv(COHORT_METRICS_CSV)
+    COHORT_METRICS_PROVENANCE.write_text(json.dumps(_cohort_provenance(), indent=2))
+    return table
+
+def cohort_percentile(values, value):
+    #percentage of donors with a value less than or equal to the donor's value
+    values = np.sort(values[~np.isnan(values)])
+    if len(values) == 0 or np.isnan(value):
+        return np.nan
+    return 100 * np.searchsorted(values, value, side="right") / len(values)
+
+#Hour-of-week activity of all donors
+#messages per bincount call, bounds the temporary arrays when the table is large or memory-mapped
+HOUR_OF_WEEK_CHUNK = 1_000_000
+DIRECTIONS = {"sent": "Sent by Donors", "received": "Received by Donors", "all": "All Messages"}
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def _hour_of_week_chunks(donor_ids, direction, chunk_size):
+    #(donor code, epoch seconds, word count) of consecutive chunks of the message table,
+    #donor code -1 for messages without datetime or of the other direction
+    nat = np.iinfo(np.int64).min
+    if store is not None:
+        #rows of the memory-mapped store are sorted by donor, the donor of a row comes from the offsets
+        donor_codes = pd.Index(donor_ids).get_indexer(store["donors"])
+        for start in range(0, len(store["ts"]), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(store["ts"])))
+            groups = donor_codes[np.searchsorted(store["donor_offsets"], rows, side="right") - 1]
+            seconds = store["ts"][rows]
+            skip = seconds == nat
+            if direction != "all":
+                skip |= store["sent"][rows] != (direction == "sent")
+            yield np.where(skip, -1, groups), seconds, store["word_count"][rows]
+    else:
+        donation_to_donor = donations.drop_duplicates("donation_id").set_index("donation_id")["donor_id"]
+        donor_array = np.array(donor_ids, dtype=object)
+        for start in range(0, len(messages), chunk_size):
+            chunk = messages.iloc[start:start + chunk_size]
+            groups = pd.Index(donor_ids).get_indexer(chunk["donation_id"].map(donation_to_donor))
+            seconds = datetime_values(chunk["dt"]).astype("datetime64[s]").astype(np.int64)
+            skip = (groups < 0) | (seconds == nat)
+            if direction != "all":
+                sent = chunk["sender_id"].to_numpy(dtype=object) == donor_array[np.maximum(groups, 0)]
+                skip |= sent != (direction == "sent")
+            yield np.where(skip, -1, groups), seconds, chunk["word_count"].to_numpy(dtype=float)
+
+def build_hour_of_week(direction="sent", chunk_size=HOUR_OF_WEEK_CHUNK):
+    """
+    Messages and words of every donor per weekday and hour, arrays of shape (n_donors, 7, 24) in sorted donor order.
+    direction: 'sent' (by the donor), 'received' (by contacts) or 'all'.
+    The table is processed in chunks of chunk_size messages with one bincount per chunk, so memory-mapped stores are never loaded as a whole.
+    Returns (donor_ids, messages, words)
+    """
+    donor_ids = sorted(donations["donor_id"].unique())
+    shape = (len(donor_ids), 7, 24)
+    if db is not None:
+        #aggregated in SQL, only the (donor, weekday, hour) rows are returned
+        counts = duckdb_backend.hour_of_week_counts(db, direction)
+        keys = pd.Index(donor_ids).get_indexer(counts["donor_id"]) * HOURS_PER_WEEK + counts["weekday"].to_numpy() * 24 + counts["hour"].to_numpy()
+        size = len(donor_ids) * HOURS_PER_WEEK
+        return (donor_ids,
+                np.bincount(keys, weights=counts["messages"], minlength=size).astype(np.int64).reshape(shape),
+                np.bincount(keys, weights=counts["words"], minlength=size).reshape(shape))
+    message_grid = np.zeros(shape, dtype=np.int64)
+    word_grid = np.zeros(shape)
+    for groups, seconds, words in _hour_of_week_chunks(donor_ids, direction, chunk_size):
+        chunk_messages, chunk_words = hour_of_week_counts(groups, seconds, words, len(donor_ids))
+        message_grid += chunk_messages
+        word_grid += chunk_words
+    return donor_ids, message_grid, word_grid
+
+def show_cohort_dashboard(rebuild=False):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
+
+    #loaded once, every redraw below only reads this table
+    table = load_cohort_metrics(rebuild)
+    donor_ids = list(table.index)
+
+    #Input text to write donor id
+    donor_input = widgets.Text(
+        placeholder="Type donor ID",
+        description="Donor:",
+        layout=widgets.Layout(width="300px")
+    )
+    #Dropdown to select donor id
+    donor_dropdown = widgets.Dropdown(
+        options=donor_ids,
+        layout=widgets.Layout(width="300px")
+    )
+
+    chart_output = widgets.Output()
+    summary_output = widgets.Output()
+
+    #dynamically filters donor dropdown as user types
+    def filter_dropdown(change):
+        text = change["new"].strip().lower()
+        if not text:
+            donor_dropdown.options = donor_ids
+        else:
+            matches = [d for d in donor_ids if text in str(d).lower()]
+            donor_dropdown.options = matches if matches else ["No match"]
+
+    donor_input.observe(filter_dropdown, names="value")
+
+    def draw(change=None):
+        chart_output.clear_output()
+        summary_output.clear_output()
+        donor = donor_input.value.strip() or donor_dropdown.value
+        if donor not in table.index:
+            with summary_output:
+                display(HTML(f"<b style='color:red;'>Invalid donor ID: {donor}</b>"))
+            return
+
+        rows = []
+        with chart_output:
+            fig, axes = plt.subplots(2, 3, figsize=(14, 7))
+            for ax, (column, label) in zip(axes.ravel(), COHORT_COLUMNS.items()):
+                values = table[column].to_numpy(dtype=float)
+                value = table.at[donor, column]
+                percentile = cohort_percentile(values, value)
+                low, high = (table.at[donor, c] for c in COHORT_CI_COLUMNS[column]) if column in COHORT_CI_COLUMNS else (np.nan, np.nan)
+                rows.append((label, value, percentile, low, high))
+
+                ax.hist(values[~np.isnan(values)], bins=20, color="skyblue", edgecolor="black")
+                #selected donor's position
+                if not np.isnan(value):
+                    ax.axvline(value, color="red", linewidth=2, label=f"Donor ({percentile:.0f}th pct)")
+                    ax.legend(fontsize=8)
+                ax.set_title(label)
+                ax.set_ylabel("Number of Donors")
+                ax.grid(alpha=0.3)
+            fig.suptitle(f"Cohort Distributions — Donor {donor}")
+            plt.tight_layout()
+            add_save_and_note_controls(fig, donor, "ALL", "cohort")
+            plt.show()
+
+        with summary_output:
+            table_rows = "".join(
+                f"<tr><td>{label}</td><td>{'—' if np.isnan(value) else f'{value:.3f}'}</td>"
+                f"<td>{'' if np.isnan(low) else f'[{low:.3f}, {high:.3f}]'}</td>"
+                f"<td>{'—' if np.isnan(percentile) else f'{percentile:.0f}'}</td></tr>"
+                for label, value, percentile, low, high in rows
+            )
+            display(HTML(
+                f"<div style='background:#f5f5f5;padding:16px;border-radius:8px;width:460px;'>"
+                f"<h4 style='margin-top:0;'>Donor {donor} in the Cohort ({len(table)} donors)</h4>"
+                f"<table><tr><th>Metric</th><th>Value</th><th>95% CI</th><th>Percentile</th></tr>{table_rows}</table>"
+                f"<p><small>Percentile = % of donors with a value less than or equal to this donor's.<br>"
+                f"95% CI = bootstrap interval over the donor's contacts (Gini) or inter-event gaps (B1/B2).</small></p>"
+                f"</div>"
+            ))
+
+    donor_dropdown.observe(draw, names="value")
+    donor_input.on_submit(draw)
+
+    display(widgets.VBox([
+        widgets.HTML("<h2>Cohort Distribution Dashboard</h2>"),
+        widgets.HBox([donor_input, donor_dropdown], layout=widgets.Layout(gap="10px")),
+        widgets.HBox([chart_output, summary_output], layout=widgets.Layout(gap="20px", align_items="flex-start"))
+    ]))
+    draw()
+
+def show_hour_of_week_dashboard():
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
+
+    #Dropdowns for the messages included, the value shown and how donors are combined
+    direction_select = widgets.Dropdown(options=[(label, key) for key, label in DIRECTIONS.items()], description="Messages:")
+    value_select = widgets.Dropdown(options=[("Words", "words"), ("Messages", "messages")], description="Value:")
+    aggregate_select = widgets.Dropdown(options=[("Sum over Donors", "sum"), ("Mean per Donor", "mean")], description="Combine:")
+    #each donor's grid as a share of the donor's activity, so very active donors don't dominate the cohort
+    normalize_check = widgets.Checkbox(value=False, description="Normalize per donor")
+    out_plot = widgets.Output()
+
+    def draw(change=None):
+        out_plot.clear_output()
+        direction = direction_select.value
+        donor_ids, message_grid, word_grid = cached("hour_of_week", lambda: build_hour_of_week(direction), direction=direction)
+        grids = word_grid if value_select.value == "words" else message_grid
+        grid = cohort_hour_of_week(grids, normalize=normalize_check.value, mean=aggregate_select.value == "mean")
+        n_active = int((grids.sum(axis=(1, 2)) > 0).sum())
+
+        with out_plot:
+            if n_active == 0:
+                display(HTML("<b style='color:orange;'>No messages for this selection.</b>"))
+                return
+            value_label = value_select.label + (" (Share of Donor's Activity)" if normalize_check.value else "")
+            fig, ax = plt.subplots(figsize=(12, 4))
+            image = ax.imshow(grid, aspect="auto", cmap="viridis", interpolation="nearest")
+            fig.colorbar(image, ax=ax, label=value_label)
+            ax.set_xticks(np.arange(24))
+            ax.set_yticks(np.arange(7))
+            ax.set_yticklabels(WEEKDAYS)
+            ax.set_xlabel("Hour of day")
+            ax.set_ylabel("Weekday")
+            ax.set_title(f"{value_select.label} per Hour of Week — {DIRECTIONS[direction]}, {aggregate_select.label} ({n_active} donors)")
+            plt.tight_layout()
+            add_save_and_note_controls(fig, "ALL", "ALL", f"hourofweek-{direction}-{value_select.value}-{aggregate_select.value}"
+                                       + ("-normalized" if normalize_check.value else ""))
+            plt.show()
+
+            weekday, hour = np.unravel_index(np.argmax(grid), grid.shape)
+            display(HTML(f"<b>Peak:</b> {WEEKDAYS[weekday]} {hour:02d}:00–{hour + 1:02d}:00"))
+
+    for widget in (direction_select, value_select, aggregate_select, normalize_check):
+        widget.observe(draw, names="value")
+
+    display(widgets.VBox([
+        widgets.HTML("<h2>Cohort Hour-of-Week Activity</h2>"),
+        widgets.HBox([direction_select, value_select, aggregate_select, normalize_check], layout=widgets.Layout(gap="10px")),
+        out_plot
+    ]))
+    draw()
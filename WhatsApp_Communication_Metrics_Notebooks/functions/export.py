@@ -0,0 +1,224 @@
+"""Parquet export of the per-donor and per-conversation metric tables for downstream statistics (R, pandas, DuckDB).
+Donors are processed in batches through the metric planner and every batch is appended as one row group to the datasets
+
+    outputs/metrics_parquet/<version>/donors/shard=7/part-0.parquet
+    outputs/metrics_parquet/<version>/conversations/shard=7/part-0.parquet
+
+partitioned by donor shard (a stable hash of the donor id). The current <version> directory is named in the file
+outputs/metrics_parquet/CURRENT (see versioned_dir.py), so a new export never replaces one that is being read.
+Only one batch of messages and results is in memory at a time, and downstream tools can read single shards or donors
+without scanning the whole export. Every file carries the
+column descriptions and the provenance (data and code fingerprints, metric options, export time) as schema metadata,
+the provenance is also written to provenance.json. pyarrow is only needed for the export.
+"""
+import json
+import zlib
+from pathlib import Path
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from dataloader import *
+#All metrics of a batch come from one pass of the metric planner
+from functions.planner import run_metric_plan
+from functions.metrics import classify_b1_grouped
+#Data and code fingerprints recorded as provenance
+from functions.result_cache import DATA_VERSION, CODE_VERSION
+#every export is a new version directory, so an export that is being read is never deleted in place
+from versioned_dir import current_version, discard_version, new_version, publish_version
+
+EXPORT_DIR = OUTPUT_DIR / "metrics_parquet"
+#number of donor shards (hive partitions shard=0 .. shard=N-1) of every table
+DONOR_SHARDS = 16
+EXPORT_FORMAT = 1
+
+def _field(name, type_, description):
+    return pa.field(name, type_, metadata={"description": description})
+
+#ids are written as strings so the schema is the same for every batch and every data source
+DONOR_FIELDS = [
+    _field("donor_id", pa.string(), "Donor id"),
+    _field("conversations", pa.int64(), "Conversations in the donor's WhatsApp donations"),
+    _field("words_sent", pa.float64(), "Words sent by the donor"),
+    _field("words_received", pa.float64(), "Words sent by contacts"),
+    _field("gini_messages", pa.float64(), "Gini coefficient of messages sent per contact (conversations the donor sent to)"),
+    _field("gini_words", pa.float64(), "Gini coefficient of words sent per contact (conversations the donor sent to)"),
+    _field("B1", pa.float64(), "Burstiness B1 of the donor's message days over all conversations"),
+    _field("B2", pa.float64(), "Finite-size corrected burstiness B2 of the donor's message days over all conversations"),
+    _field("burstiness_class", pa.string(), "Regular (B1 < -0.2), Random, Bursty (B1 > 0.2) or N/A"),
+    _field("mean_bias", pa.float64(), "Mean interaction bias (0.5 - donor words / all words) over conversations with words"),
+    _field("median_bias", pa.float64(), "Median interaction bias over conversations with words"),
+]
+DONOR_CI_FIELDS = [
+    _field(f"{metric}_{bound}", pa.float64(), f"{'Lower' if bound == 'low' else 'Upper'} bound of the 95% bootstrap interval of {metric}")
+    for metric in ("gini_messages", "gini_words", "B1", "B2") for bound in ("low", "high")
+]
+CONVERSATION_FIELDS = [
+    _field("donor_id", pa.string(), "Donor id"),
+    _field("conversation_id", pa.string(), "Conversation id"),
+    _field("words_sent_by_donor", pa.int64(), "Words sent by the donor in the conversation"),
+    _field("words_sent_by_contacts", pa.int64(), "Words sent by contacts in the conversation"),
+    _field("bias", pa.float64(), "Interaction bias 0.5 - donor words / all words (NaN without words)"),
+    _field("B1", pa.float64(), "Burstiness B1 of the donor's message days in the conversation"),
+    _field("B2", pa.float64(), "Finite-size corrected burstiness B2 of the donor's message days in the conversation"),
+    _field("burstiness_class", pa.string(), "Regular (B1 < -0.2), Random, Bursty (B1 > 0.2) or N/A"),
+]
+CONVERSATION_NULL_FIELDS = [
+    _field("p_poisson", pa.float64(), "Two-sided p-value of B1 against Poisson surrogates"),
+    _field("M", pa.float64(), "Memory coefficient (correlation of consecutive gaps between message days)"),
+    _field("p_shuffled", pa.float64(), "Two-sided p-value of M against shuffled-gap surrogates"),
+]
+
+def donor_shard(donor_id, n_shards=DONOR_SHARDS):
+    """Shard of a donor, stable across runs, machines and languages (CRC-32 of the id string)"""
+    return zlib.crc32(str(donor_id).encode()) % n_shards
+
+def _batch_messages(batch):
+    #messages of a batch of donors, one selection on the in-memory table or the donor_* functions of the other backends
+    if messages is not None:
+        return messages[messages["donation_id"].isin(donations.loc[donations["donor_id"].isin(batch), "donation_id"])]
+    return pd.concat([donor_messages(donor) for donor in batch])
+
+def _batch_tables(batch, with_ci, with_null):
+    #(donors, conversations) DataFrames of one batch, donors without messages get a row of NaN metrics
+    metrics = ["gini_messages", "gini_words", "burstiness", "burstiness_aggregate", "interaction_balance"]
+    metrics += ["gini_messages_ci", "gini_words_ci", "burstiness_aggregate_ci"] if with_ci else []
+    metrics += ["burstiness_null"] if with_null else []
+    batch_msgs = _batch_messages(batch)
+    donor_index = pd.Index(batch, name="donor_id")
+    if batch_msgs.empty:
+        return pd.DataFrame(index=donor_index).reset_index(), pd.DataFrame()
+    results = run_metric_plan(batch_msgs, donations, metrics)
+
+    balance = results["interaction_balance"]
+    conversations = balance.join(results["burstiness"], on=["donor_id", "conversation_id"])
+    conversations["burstiness_class"] = classify_b1_grouped(conversations["B1"])
+    if with_null:
+        conversations = conversations.join(results["burstiness_null"].drop(columns="B1"), on=["donor_id", "conversation_id"])
+
+    by_donor = balance.groupby("donor_id")
+    bias = balance.dropna(subset=["bias"]).groupby("donor_id")["bias"]
+    donors = pd.DataFrame({
+        "conversations": by_donor.size(),
+        "words_sent": by_donor["words_sent_by_donor"].sum(),
+        "words_received": by_donor["words_sent_by_contacts"].sum(),
+        "gini_messages": results["gini_messages"],
+        "gini_words": results["gini_words"],
+        "B1": results["burstiness_aggregate"]["B1"],
+        "B2": results["burstiness_aggregate"]["B2"],
+        "mean_bias": bias.mean(),
+        "median_bias": bias.median(),
+    }).reindex(donor_index)
+    donors["burstiness_class"] = classify_b1_grouped(donors["B1"])
+    if with_ci:
+        donors = donors.join(results["gini_messages_ci"].add_prefix("gini_messages_"))
+        donors = donors.join(results["gini_words_ci"].add_prefix("gini_words_"))
+        donors = donors.join(results["burstiness_aggregate_ci"])
+    return donors.reset_index(), conversations
+
+def _to_arrow(df, schema):
+    #ids as strings, integer counts of donors without messages stay null
+    columns = {}
+    for field in schema:
+        values = df[field.name] if field.name in df else pd.Series(np.nan, index=df.index)
+        if pa.types.is_string(field.type):
+            values = values.astype(object).where(values.notna(), None).map(lambda v: v if v is None else str(v))
+        elif pa.types.is_integer(field.type):
+            values = values.astype("Int64")
+        columns[field.name] = pa.array(values, type=field.type, from_pandas=True)
+    return pa.table(columns, schema=schema)
+
+def provenance(n_shards=DONOR_SHARDS, batch_size=50, with_ci=False, with_null=False):
+    """Provenance of an export with these options: input and code fingerprints, backend, options and library versions"""
+    return {
+        "format": EXPORT_FORMAT,
+        "data_version": DATA_VERSION,
+        "code_version": CODE_VERSION,
+        "data_backend": DATA_BACKEND,
+        "donations_csv": str(DONATION_CSV),
+        "messages_source": str(MESSAGES_PARQUET or MESSAGES_CSV),
+        "n_shards": n_shards,
+        "shard_function": "crc32(utf-8 donor_id) % n_shards",
+        "batch_size": batch_size,
+        "with_ci": with_ci,
+        "with_null": with_null,
+        "versions": {"numpy": np.__version__, "pandas": pd.__version__, "pyarrow": pa.__version__},
+    }
+
+def read_provenance(path=EXPORT_DIR):
+    """Provenance of the export at path, None if there is none"""
+    version = current_version(path)
+    try:
+        return None if version is None else json.loads((version / "provenance.json").read_text())
+    except FileNotFoundError:
+        return None
+
+def export_metric_tables(path=EXPORT_DIR, n_shards=DONOR_SHARDS, batch_size=50, with_ci=False, with_null=False, rebuild=False):
+    """
+    Exports the donors and conversations metric tables of all donors to Parquet datasets under path, partitioned by donor shard.
+    batch_size: donors whose messages and results are in memory at a time, every batch is one row group per shard file
+    with_ci: adds bootstrap confidence intervals of the Gini and aggregate burstiness columns to the donors table
+    with_null: adds the null-model p-values to the conversations table
+    An existing export of the same data, code and options is kept unless rebuild=True. The export is written to a new
+    version directory of path that replaces the current one when complete, so readers never see a partial export.
+    Returns the directory of the current export (with the donors and conversations datasets).
+    """
+    path = Path(path)
+    info = provenance(n_shards, batch_size, with_ci, with_null)
+    existing = read_provenance(path)
+    if not rebuild and existing is not None and {k: existing.get(k) for k in info} == info:
+        return current_version(path)
+
+    info["exported_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    schema_metadata = {"whatsapp_metrics.provenance": json.dumps(info)}
+    schemas = {
+        "donors": pa.schema(DONOR_FIELDS + (DONOR_CI_FIELDS if with_ci else []), metadata=schema_metadata),
+        "conversations": pa.schema(CONVERSATION_FIELDS + (CONVERSATION_NULL_FIELDS if with_null else []), metadata=schema_metadata),
+    }
+    tmp = new_version(path)
+    #one open writer per (table, shard), each batch appends one row group
+    writers = {}
+    try:
+        donor_ids = sorted(donations["donor_id"].unique())
+        for start in range(0, len(donor_ids), batch_size):
+            batch = donor_ids[start:start + batch_size]
+            for table, df in zip(schemas, _batch_tables(batch, with_ci, with_null)):
+                if df.empty:
+                    continue
+                shards = df["donor_id"].map(lambda donor: donor_shard(donor, n_shards)).to_numpy()
+                for shard in np.unique(shards):
+                    key = (table, shard)
+                    if key not in writers:
+                        shard_dir = tmp / table / f"shard={shard}"
+                        shard_dir.mkdir(parents=True)
+                        writers[key] = pq.ParquetWriter(shard_dir / "part-0.parquet", schemas[table])
+                    writers[key].write_table(_to_arrow(df[shards == shard], schemas[table]))
+    except BaseException:
+        for writer in writers.values():
+            writer.close()
+        discard_version(tmp)
+        raise
+    for writer in writers.values():
+        writer.close()
+    (tmp / "provenance.json").write_text(json.dumps(info, indent=2))
+    return publish_version(path, tmp)
+
+def read_metric_table(table, donors=None, columns=None, path=EXPORT_DIR):
+    """
+    Reads the 'donors' or 'conversations' table of an export as a DataFrame.
+    donors: optional donor ids, only the shards of these donors are read
+    columns: optional column subset
+    """
+    version = current_version(path)
+    if version is None:
+        raise FileNotFoundError(f"No metric export in {path}, run export_metric_tables() first")
+    info = json.loads((version / "provenance.json").read_text())
+    dataset = ds.dataset(version / table, format="parquet", partitioning=ds.partitioning(pa.schema([("shard", pa.int32())]), flavor="hive"))
+    condition = None
+    if donors is not None:
+        donors = [str(donor) for donor in donors]
+        shards = sorted({donor_shard(donor, info["n_shards"]) for donor in donors})
+        condition = ds.field("shard").isin(shards) & ds.field("donor_id").isin(donors)
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
@@ -4,22 +4,31 @@ This notebook analyzes how unevenly messages are distributed among different con
 from dataloader import *                #Imports datasets like 'messages' and 'donations'
 from functions.pic_notes_save import *  #Imports function 'add_save_and_note_controls' for saving figure and taking notes 
 
-#Metric implementations
-def calculate_gini(counts):
-    # Sorting the values in ascending order to assign ranks (lowest to highest)
-    values = sorted(list(counts.values()))
-    n = len(values) #Total number of contacts
-    total = sum(values) #Sum of all counts (total messages or words)
-    # If no contacts or no messages/words
-    if n == 0 or total == 0:
-        #Gini is undefined, treat as perfectly equal
-        return 0.0
-    #Weighted sum: each value multiplied by its rank (i+1 because rank starts from 1)
-    weighted_sum = sum((i + 1) * val for i, val in enumerate(values))
-    return (2 * weighted_sum) / (n * total) - (n + 1) / n #This formula am using from dona research paper
+#Metric implementation lives in the headless metrics module
+from functions.metrics import calculate_gini, gini_ci, top_k_with_others, lorenz_points, datetime_values
+#Gini of sliding time windows, updated per changed contact in a sorted count structure
+from functions.incremental import rolling_gini
+#Persistent cache, results survive kernel restarts
+from functions.result_cache import cached
+#Next donors in the dropdown are loaded on a background thread
+from functions.prefetch import create_prefetcher, PREFETCH_DEPTH
+
+#window choices of the Gini over time view, 0 = expanding window from the first message
+GINI_WINDOWS = [("Expanding", 0), ("30 days", 30), ("90 days", 90), ("180 days", 180), ("365 days", 365)]
+
+def donor_gini_over_time(donor, window=None):
+    """Gini of the messages and words the donor sent per conversation, for every day over a window of days (None = expanding)"""
+    sent = donor_messages(donor, sent_only=True)
+    sent = sent[sent["dt"].notna() & sent["conversation_id"].notna()]
+    groups, _ = pd.factorize(sent["conversation_id"])
+    days = datetime_values(sent["dt"]).astype("datetime64[D]").astype(np.int64)
+    return rolling_gini(groups, days, sent["word_count"].to_numpy(dtype=float), window)
 
 #To show dashboard
-def show_gini_dashboard():
+def show_gini_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
 
     #finds list of all unique donors and sorts
     donor_ids = sorted(donations['donor_id'].unique())
@@ -44,17 +53,34 @@ def show_gini_dashboard():
     )
     #to select view betwen bar chart and lorenz curve 
     view_select = widgets.RadioButtons(
-        options=["Bar Chart", "Lorenz Curve + Summary"],
+        options=["Bar Chart", "Lorenz Curve + Summary", "Gini Over Time"],
         description="View:",
         layout=widgets.Layout(width="260px")
     )
+    #window of the Gini over time view, only shown with that view
+    window_select = widgets.Dropdown(
+        options=GINI_WINDOWS,
+        value=90,
+        description="Window:",
+        layout=widgets.Layout(width="200px", display="none")
+    )
 
     #outputs
     bar_output = widgets.Output()
     lorenz_output = widgets.Output()
     summary_output = widgets.Output()
 
-    donor_data_cache = {}
+    #per-conversation counts and bootstrap intervals of a donor (so switching between views doesn't reload data every time),
+    #computed ahead for the next donors in the dropdown
+    def prepare(donor):
+        donor_counts = cached("conversation_counts", lambda: donor_conversation_counts(donor), donor=donor)
+        intervals = {}
+        for metric, column in (("Messages", "messages"), ("Words", "words")):
+            counts = dict(zip(donor_counts["conversation_id"], donor_counts[column]))
+            intervals[metric] = cached("gini_ci", lambda: gini_ci(counts), donor=donor, metric=metric)
+        return donor_counts, intervals
+
+    prefetcher = create_prefetcher(prepare, prefetch_depth)
 
     #for clearing the previous output and updates when anything change donor, metric or view
     def update_dashboard(change=None):
@@ -65,40 +91,41 @@ def show_gini_dashboard():
         donor = donor_dropdown.value
         metric = metric_select.value
         view = view_select.value
+        window_select.layout.display = "flex" if view == "Gini Over Time" else "none"
 
         if donor not in donor_ids:
             with summary_output:
                 display(HTML(f"<b style='color:red;'>Donor '{donor}' not found.</b>"))
             return
 
-        #Cache donor data stores already loaded donor messages (so switching between views doesn't reload data every time)
-        if donor in donor_data_cache:
-            donor_msgs = donor_data_cache[donor]
-        else:
-            donor_msgs = messages[messages['donation_id'].isin(
-                donations[donations['donor_id'] == donor]['donation_id']
-            )]
-            donor_data_cache[donor] = donor_msgs
-
-        #Calculation for messages or words counts (based on messages sent by donor)
-        if metric == "Messages":
-            counts = donor_msgs[donor_msgs['sender_id'] == donor].groupby('conversation_id').size().to_dict()
-        else:
-            counts = donor_msgs[donor_msgs['sender_id'] == donor].groupby('conversation_id')['word_count'].sum().to_dict()
+        donor_counts, intervals = prefetcher["get"](donor)
+        prefetcher["prefetch_after"](donor, donor_dropdown.options)
+
+        #Messages or words counts per conversation (based on messages sent by donor)
+        column = "messages" if metric == "Messages" else "words"
+        counts = dict(zip(donor_counts["conversation_id"], donor_counts[column]))
 
         gini = calculate_gini(counts)
 
         #Visualization
         if view == "Bar Chart":
             with bar_output:
-                counts_series = pd.Series(counts).sort_values(ascending=False)
+                counts_series = pd.Series(counts)
                 if counts_series.empty:
                     display(HTML("<b style='color:orange;'>No data to plot.</b>"))
                 else:
+                    #one bar for each of the top contacts and one for all others, so the figure size stays bounded
+                    top, others_total, n_others = top_k_with_others(counts_series.to_numpy())
+                    counts_series = counts_series.iloc[top].sort_values(ascending=False)
                     short_labels = [str(x)[:8] + "..." if len(str(x)) > 8 else str(x) for x in counts_series.index]
+                    if n_others:
+                        counts_series = pd.concat([counts_series, pd.Series({"others": others_total})])
+                        short_labels.append(f"Others ({n_others})")
                     fig, ax = plt.subplots(figsize=(max(6, len(counts_series) * 0.6), 5))
                     counts_series.plot(kind='bar', ax=ax)
-                    ax.set_title(f"{metric} Count per Contact")
+                    if n_others:
+                        ax.patches[-1].set_color("gray")
+                    ax.set_title(f"{metric} Count per Contact" + (f" (Top {len(top)} of {len(counts)})" if n_others else ""))
                     ax.set_xticks(range(len(short_labels)))
                     ax.set_xticklabels(short_labels, rotation=45, ha='right')
                     ax.grid(True, alpha=0.3)
@@ -112,9 +139,8 @@ def show_gini_dashboard():
                 if values.sum() == 0:
                     display(HTML("<b style='color:orange;'>Not enough data for Lorenz curve.</b>"))
                 else:
-                    cumulative = np.cumsum(values) / values.sum()
-                    cumulative = np.insert(cumulative, 0, 0)
-                    contacts = np.linspace(0, 1, len(values) + 1)
+                    #fixed number of quantile points for donors with very many contacts, Gini above uses all counts
+                    contacts, cumulative = lorenz_points(values)
                     fig, ax = plt.subplots(figsize=(6, 5))
                     ax.plot(contacts * 100, cumulative * 100, label='Lorenz Curve')
                     ax.plot([0, 100], [0, 100], linestyle='--', color='gray', label='Perfect Equality')
@@ -129,14 +155,45 @@ def show_gini_dashboard():
                     plt.show()
 
             with summary_output:
+                #bootstrap interval over the donor's contacts, noisy Gini values with few contacts get a wide interval
+                low, high = intervals[metric]
                 display(HTML(
                     f"<div style='background:#f5f5f5;padding:16px;border-radius:8px;width:260px;'>"
                     f"<h4 style='margin-top:0;'>Summary</h4>"
                     f"<p><b>Gini:</b> {gini:.3f}</p>"
+                    f"<p><b>95% CI:</b> {'—' if np.isnan(low) else f'[{low:.3f}, {high:.3f}]'}</p>"
                     f"<p>{'High inequality (few contacts dominate)' if gini > 0.5 else 'Relatively balanced distribution'}.</p>"
                     f"</div>"
                 ))
 
+        elif view == "Gini Over Time":
+            with bar_output:
+                window = window_select.value or None
+                series = cached("gini_over_time", lambda: donor_gini_over_time(donor, window), donor=donor, window=window)
+                if series.empty:
+                    display(HTML("<b style='color:orange;'>No dated messages for this donor.</b>"))
+                    return
+                window_label = "Expanding Window" if window is None else f"{window}-Day Window"
+                fig, ax = plt.subplots(figsize=(10, 5))
+                ax.plot(series.index, series[metric], color="tab:blue", label=f"Gini ({window_label})")
+                ax.axhline(gini, linestyle="--", color="gray", label=f"Whole History ({gini:.3f})")
+                ax.set_ylim(0, 1)
+                ax.set_ylabel("Gini")
+                #contacts in the window, few contacts make the Gini noisy
+                contacts_ax = ax.twinx()
+                contacts_ax.fill_between(series.index, series["contacts"], step="post", color="lightgray", alpha=0.5)
+                contacts_ax.set_ylabel("Contacts in Window")
+                contacts_ax.set_ylim(0, max(1, series["contacts"].max()) * 1.1)
+                ax.set_zorder(contacts_ax.get_zorder() + 1)
+                ax.patch.set_visible(False)
+                ax.set_title(f"{metric} Gini Over Time — Donor {donor}")
+                ax.legend(loc="upper left")
+                ax.grid(True, alpha=0.3)
+                fig.autofmt_xdate()
+                plt.tight_layout()
+                add_save_and_note_controls(fig, donor, "ALL", "gini", extra_tag=f"overtime-{metric.lower()}-{window or 'expanding'}")
+                plt.show()
+
     #Search filtering
     def filter_donors(change):
         query = donor_search.value.lower().strip()
@@ -164,11 +221,12 @@ def show_gini_dashboard():
     donor_dropdown.observe(update_dashboard, names='value')
     metric_select.observe(update_dashboard, names='value')
     view_select.observe(update_dashboard, names='value')
+    window_select.observe(update_dashboard, names='value')
 
     #Layout
     display(widgets.VBox([
         widgets.HTML("<h2>WhatsApp Donation Dashboard (Interaction Heterogenity)</h2>"),
-        widgets.HBox([donor_search, donor_dropdown, metric_select, view_select], layout=widgets.Layout(gap="12px")),
+        widgets.HBox([donor_search, donor_dropdown, metric_select, view_select, window_select], layout=widgets.Layout(gap="12px")),
         bar_output,
         widgets.HBox([lorenz_output, summary_output], layout=widgets.Layout(gap="20px", align_items='flex-start'))
     ]))
@@ -0,0 +1,346 @@
+"""Incremental metric state for longitudinal monitoring.
+A DonorMetricState keeps a compact state per donor and conversation for Gini, burstiness and interaction balance:
+- per-conversation sent counts in a sorted count structure (RankSumTree) for Gini
+- running inter-event moments (count, mean, M2) at day and second resolution for burstiness
+- running word totals by sender role for interaction balance
+Appending a batch of new messages updates every metric in time proportional to the batch and the results match a full
+recompute with calculate_gini, compute_burstiness / compute_burstiness_streaming and compute_interaction_balance.
+to_state() returns a plain JSON-serializable dict, DonorMetricState.from_state() restores it.
+rolling_gini() computes the Gini of sliding or expanding time windows, on a dense day x contact matrix or, when that is
+too large, with the same structure.
+"""
+import numpy as np
+import pandas as pd
+
+from functions.metrics import burstiness_from_moments, datetime_values, interaction_bias, merge_interval_moments
+
+class RankSumTree:
+    """
+    Sorted multiset of non-negative integer counts stored in a Fenwick tree over the count values.
+    Inserting or removing one count costs O(log U) and keeps the weighted rank sum (sum of rank * value over the
+    ascending-sorted counts) that the Gini formula of calculate_gini needs, so no re-sort is required.
+    The tree is sparse (dicts) for the default 48-bit count range and dense (lists) when bits <= DENSE_BITS.
+    """
+    BITS = 48
+    DENSE_BITS = 20
+
+    def __init__(self, bits=None):
+        #counts must stay below 2**bits, fewer bits make every update cheaper
+        self.bits = self.BITS if bits is None else bits
+        self._dense = self.bits <= self.DENSE_BITS
+        size = (1 << self.bits) + 1
+        self._counts = [0] * size if self._dense else {}
+        self._sums = [0] * size if self._dense else {}
+        self.n = 0
+        self.total = 0
+        self.weighted_sum = 0
+
+    def _add(self, value, count):
+        i = value + 1
+        size = 1 << self.bits
+        counts, sums, weighted = self._counts, self._sums, count * value
+        if self._dense:
+            while i <= size:
+                counts[i] += count
+                sums[i] += weighted
+                i += i & -i
+            return
+        while i <= size:
+            counts[i] = counts.get(i, 0) + count
+            sums[i] = sums.get(i, 0) + weighted
+            i += i & -i
+
+    def _prefix(self, value):
+        #number and sum of stored values <= value
+        i = value + 1
+        count = total = 0
+        counts, sums = self._counts, self._sums
+        if self._dense:
+            while i > 0:
+                count += counts[i]
+                total += sums[i]
+                i -= i & -i
+            return count, total
+        while i > 0:
+            count += counts.get(i, 0)
+            total += sums.get(i, 0)
+            i -= i & -i
+        return count, total
+
+    def insert(self, value):
+        value = int(value)
+        le_count, le_sum = self._prefix(value)
+        #the new value ranks after every value <= it and every larger value moves up one rank
+        self.weighted_sum += (le_count + 1) * value + (self.total - le_sum)
+        self._add(value, 1)
+        self.n += 1
+        self.total += value
+
+    def remove(self, value):
+        value = int(value)
+        le_count, le_sum = self._prefix(value)
+        #the removed value is taken as the last of its ties and every larger value moves down one rank
+        self.weighted_sum -= le_count * value + (self.total - le_sum)
+        self._add(value, -1)
+        self.n -= 1
+        self.total -= value
+
+    def gini(self):
+        #same formula and conventions as calculate_gini
+        if self.n == 0 or self.total == 0:
+            return 0.0
+        return (2 * self.weighted_sum) / (self.n * self.total) - (self.n + 1) / self.n
+
+#largest days x contacts matrix for which rolling_gini works on dense window counts, bigger inputs use RankSumTrees
+ROLLING_GINI_DENSE_CELLS = 1 << 22
+
+def rolling_gini(groups, days, words, window=None):
+    """
+    Gini of messages and words per contact over time, equal to calculate_gini on the counts of the contacts with messages
+    in a window of days.
+    Up to ROLLING_GINI_DENSE_CELLS days x contacts the window counts of all days are differences of cumulative sums of a
+    dense day x contact matrix and every row is sorted at once. Above that, moving the window by one day only updates the
+    contacts that enter or leave it in two RankSumTrees, O(log U) per changed contact instead of re-sorting every day.
+    groups: integer contact code per message, days: integer day per message, words: word count per message
+    window: window length in days ending at each day, None = expanding window from the first day
+    Returns a DataFrame indexed by day from the first to the last message day with the Gini columns Messages and Words
+    (NaN when no contact has messages in the window) and the number of contacts in the window.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    if len(days) == 0:
+        return pd.DataFrame(columns=["Messages", "Words", "contacts"], index=pd.DatetimeIndex([], name="day"), dtype=float)
+    groups = np.asarray(groups, dtype=np.int64)
+    words = np.nan_to_num(np.asarray(words, dtype=float)).astype(np.int64)
+    first_day = days.min()
+    n_days = int(days.max() - first_day + 1)
+    n_groups = int(groups.max() + 1)
+    index = pd.DatetimeIndex((first_day + np.arange(n_days)).astype("datetime64[D]"), name="day")
+    if n_days * n_groups <= ROLLING_GINI_DENSE_CELLS:
+        result = _rolling_gini_dense((days - first_day) * n_groups + groups, words, window, n_days, n_groups)
+        return pd.DataFrame(result, index=index, columns=["Messages", "Words", "contacts"])
+
+    max_messages = int(np.bincount(groups).max())
+    max_words = int(np.bincount(groups, weights=words).max())
+
+    #net change of messages and words per (day, contact) in the window: messages enter on their day and leave window days
+    #later, a contact that is active on both days is moved only once
+    offsets = (days - first_day) * n_groups + groups
+    signs = np.ones(len(days), dtype=np.int64)
+    if window is not None:
+        leaving = offsets + window * n_groups < n_days * n_groups
+        offsets = np.concatenate((offsets, offsets[leaving] + window * n_groups))
+        signs = np.concatenate((signs, -signs[leaving]))
+        words = np.concatenate((words, words[leaving]))
+    cells, inverse = np.unique(offsets, return_inverse=True)
+    inverse = inverse.ravel()
+    cell_messages = np.bincount(inverse, weights=signs, minlength=len(cells)).astype(np.int64)
+    cell_words = np.bincount(inverse, weights=signs * words, minlength=len(cells)).astype(np.int64)
+    changed = (cell_messages != 0) | (cell_words != 0)
+    cells, cell_messages, cell_words = cells[changed], cell_messages[changed].tolist(), cell_words[changed].tolist()
+    cell_groups = (cells % n_groups).tolist()
+    bounds = np.searchsorted(cells // n_groups, np.arange(n_days + 1)).tolist()
+
+    #the trees only need enough bits for the largest total of one contact
+    trees = [RankSumTree(bits=max(1, max_messages.bit_length())), RankSumTree(bits=max(1, max_words.bit_length()))]
+    totals = [[0] * n_groups, [0] * n_groups]
+
+    def move(cell):
+        #replaces the contact's window totals in both trees, a contact only counts while it has messages in the window
+        group = cell_groups[cell]
+        n_messages, n_words = totals[0][group], totals[1][group]
+        if n_messages > 0:
+            trees[0].remove(n_messages)
+            trees[1].remove(n_words)
+        n_messages += cell_messages[cell]
+        n_words += cell_words[cell]
+        if n_messages > 0:
+            trees[0].insert(n_messages)
+            trees[1].insert(n_words)
+        totals[0][group], totals[1][group] = n_messages, n_words
+
+    result = np.full((n_days, 3), np.nan)
+    for day in range(n_days):
+        for cell in range(bounds[day], bounds[day + 1]):
+            move(cell)
+        result[day, 2] = trees[0].n
+        if trees[0].n:
+            result[day, 0] = trees[0].gini()
+            result[day, 1] = trees[1].gini()
+    return pd.DataFrame(result, index=index, columns=["Messages", "Words", "contacts"])
+
+def _rolling_gini_dense(cells, words, window, n_days, n_groups):
+    #(Messages, Words, contacts) per day from the day x contact cell of every message
+    result = np.empty((n_days, 3))
+    counts = []
+    for weights in (None, words):
+        per_day = np.bincount(cells, weights=weights, minlength=n_days * n_groups).reshape(n_days, n_groups)
+        in_window = np.cumsum(per_day.astype(np.int64), axis=0)
+        if window is not None:
+            in_window[window:] -= in_window[:-window].copy()
+        counts.append(in_window)
+    n = (counts[0] > 0).sum(axis=1)
+    result[:, 2] = n
+    ranks = np.arange(1, n_groups + 1)
+    for column, values in enumerate(counts):
+        #contacts without messages in the window hold 0 and sort first, so a value at sorted position j (from 1)
+        #has rank j - (n_groups - n) among the contacts of the window, like in calculate_gini
+        values = np.sort(values, axis=1)
+        total = values.sum(axis=1)
+        weighted_sum = values @ ranks - (n_groups - n) * total
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gini = (2 * weighted_sum) / (n * total) - (n + 1) / n
+        result[:, column] = np.where(n == 0, np.nan, np.where(total == 0, 0.0, gini))
+    return result
+
+def _new_moments():
+    return {"last": None, "n_events": 0, "count": 0, "mean": 0.0, "m2": 0.0}
+
+def _append_events(moments, events, distinct):
+    """Adds sorted integer event times (days or seconds) that are not older than moments['last']"""
+    if len(events) == 0:
+        return
+    if distinct:
+        events = np.unique(events)
+        if moments["last"] is not None:
+            events = events[events > moments["last"]]
+        if len(events) == 0:
+            return
+    previous = [] if moments["last"] is None else [moments["last"]]
+    gaps = np.diff(np.concatenate((previous, events)))
+    moments["count"], moments["mean"], moments["m2"] = merge_interval_moments(moments["count"], moments["mean"], moments["m2"], gaps)
+    moments["n_events"] += len(events)
+    moments["last"] = int(events[-1])
+
+def _plain(value):
+    #numpy scalars -> python values for JSON
+    return value.item() if hasattr(value, "item") else value
+
+class DonorMetricState:
+    """
+    Running Gini, burstiness and interaction balance for one donor.
+    update() takes batches of appended messages (conversation_id, sender_id, dt, word_count) in any row order.
+    Donor messages in a batch must not be older than the donor messages already added, otherwise a ValueError is
+    raised and the state is left unchanged. Word counts are treated as integers.
+    """
+
+    def __init__(self, donor_id):
+        self.donor_id = donor_id
+        self.conversations = {}
+        self.aggregate = {"days": _new_moments(), "seconds": _new_moments()}
+        self._trees = {"messages": RankSumTree(), "words": RankSumTree()}
+
+    def _conversation(self, conversation_id):
+        if conversation_id not in self.conversations:
+            self.conversations[conversation_id] = {
+                "sent_messages": 0, "sent_words": 0, "received_words": 0,
+                "days": _new_moments(), "seconds": _new_moments(),
+            }
+        return self.conversations[conversation_id]
+
+    def update(self, batch):
+        if batch is None or batch.empty:
+            return self
+        batch = batch[batch["conversation_id"].notna()]
+        dt = datetime_values(batch["dt"])
+        sent = (batch["sender_id"] == self.donor_id).to_numpy()
+        words = np.nan_to_num(batch["word_count"].to_numpy(dtype=float)).astype(np.int64)
+        conversations = batch["conversation_id"].to_numpy()
+
+        #donor message times in seconds, sorted by (conversation, time)
+        timed = sent & ~np.isnat(dt)
+        event_convs = conversations[timed]
+        seconds = dt[timed].astype("datetime64[s]").astype(np.int64)
+        conv_codes, conv_index = pd.factorize(event_convs)
+        order = np.lexsort((seconds, conv_codes))
+        conv_codes, seconds = conv_codes[order], seconds[order]
+        bounds = np.searchsorted(conv_codes, np.arange(len(conv_index) + 1))
+
+        #validate before touching the state so a rejected batch leaves it unchanged
+        #(every conversation's last message is at or before the donor-wide last message)
+        last = self.aggregate["seconds"]["last"]
+        if last is not None and len(seconds) and seconds.min() < last:
+            raise ValueError("Batch contains donor messages older than the last message already added; rebuild the state instead.")
+
+        #word totals by sender role and sent message counts, O(batch)
+        per_conv = pd.DataFrame({"conversation_id": conversations, "sent": sent, "words": words}).groupby(["conversation_id", "sent"])["words"].agg(["size", "sum"])
+        for (cid, is_sent), row in per_conv.iterrows():
+            conv = self._conversation(cid)
+            if not is_sent:
+                conv["received_words"] += int(row["sum"])
+                continue
+            #replace this conversation's old counts in the sorted count structures
+            if conv["sent_messages"] > 0:
+                self._trees["messages"].remove(conv["sent_messages"])
+                self._trees["words"].remove(conv["sent_words"])
+            conv["sent_messages"] += int(row["size"])
+            conv["sent_words"] += int(row["sum"])
+            self._trees["messages"].insert(conv["sent_messages"])
+            self._trees["words"].insert(conv["sent_words"])
+
+        #interval moments per conversation and over all conversations
+        for code, cid in enumerate(conv_index):
+            conv_seconds = seconds[bounds[code]:bounds[code + 1]]
+            conv = self._conversation(cid)
+            _append_events(conv["seconds"], conv_seconds, distinct=False)
+            _append_events(conv["days"], conv_seconds // 86400, distinct=True)
+        all_seconds = np.sort(seconds)
+        _append_events(self.aggregate["seconds"], all_seconds, distinct=False)
+        _append_events(self.aggregate["days"], all_seconds // 86400, distinct=True)
+        return self
+
+    def gini(self, metric="Messages"):
+        return self._trees["messages" if metric == "Messages" else "words"].gini()
+
+    def burstiness(self, conversation_id=None, resolution="day"):
+        """(B1, B2) of one conversation, or over all conversations when conversation_id is None"""
+        key = "days" if resolution == "day" else "seconds"
+        if conversation_id is None:
+            moments = self.aggregate[key]
+        elif conversation_id in self.conversations:
+            moments = self.conversations[conversation_id][key]
+        else:
+            return (np.nan, np.nan)
+        return burstiness_from_moments(moments["count"], moments["mean"], moments["m2"], moments["n_events"])
+
+    def burstiness_table(self, resolution="day"):
+        """B1, B2 per conversation with donor messages, like the burstiness dashboard's per-chat table"""
+        key = "days" if resolution == "day" else "seconds"
+        chats = sorted(cid for cid, conv in self.conversations.items() if conv[key]["n_events"] > 0)
+        rows = [self.burstiness(cid, resolution) for cid in chats]
+        return pd.DataFrame(rows, index=pd.Index(chats, name="conversation_id"), columns=["B1", "B2"]).dropna(how="all")
+
+    def interaction_balance(self):
+        """Same table as compute_interaction_balance"""
+        records = []
+        for cid in sorted(self.conversations):
+            conv = self.conversations[cid]
+            records.append({
+                "conversation_id": cid,
+                "words_sent_by_donor": conv["sent_words"],
+                "words_sent_by_contacts": conv["received_words"],
+                "bias": float(interaction_bias(conv["sent_words"], conv["received_words"])),
+            })
+        return pd.DataFrame(records)
+
+    def to_state(self):
+        return {
+            "donor_id": _plain(self.donor_id),
+            "aggregate": {key: dict(m) for key, m in self.aggregate.items()},
+            "conversations": [
+                {"conversation_id": _plain(cid), **{k: (dict(v) if isinstance(v, dict) else v) for k, v in conv.items()}}
+                for cid, conv in self.conversations.items()
+            ],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        acc = cls(state["donor_id"])
+        acc.aggregate = {key: dict(m) for key, m in state["aggregate"].items()}
+        for record in state["conversations"]:
+            conv = {k: (dict(v) if isinstance(v, dict) else v) for k, v in record.items() if k != "conversation_id"}
+            acc.conversations[record["conversation_id"]] = conv
+            #the sorted count structures are derived from the counts and rebuilt on load
+            if conv["sent_messages"] > 0:
+                acc._trees["messages"].insert(conv["sent_messages"])
+                acc._trees["words"].insert(conv["sent_words"])
+        return acc
@@ -4,27 +4,54 @@
 from dataloader import *     
 #Imports helper for saving figures and adding notes           
 from functions.pic_notes_save import * 
+#Top chats plus an others bucket for donors with very many chats
+from functions.metrics import top_k_with_others
+#Bias of the per-chat word totals, the same function as compute_interaction_balance
+from functions.metrics import interaction_bias
+#Balance over sliding windows from cumulative daily words by sender role
+from functions.metrics import datetime_values, daily_role_cumsums, rolling_balance, TOP_K_CONTACTS
+#Persistent cache, results survive kernel restarts
+from functions.result_cache import cached
+#Next donors in the dropdown are loaded on a background thread
+from functions.prefetch import create_prefetcher, PREFETCH_DEPTH
 
-def compute_interaction_balance(df, donor_id):
-    #for each conversation calculates total words sent by donor and by contacts
-    records = []
-    for cid, group in df.groupby("conversation_id"):
-        w_donor = group.loc[group["sender_id"] == donor_id, "word_count"].sum()
-        w_contacts = group.loc[group["sender_id"] != donor_id, "word_count"].sum()
-        total = w_donor + w_contacts
-        #bias = 0.5 - (donor_words / total_words) ,if no words NaN
-        bias = np.nan if total == 0 else 0.5 - (w_donor / total)
-        #stores metrics for this conversation
-        records.append({
-            "conversation_id": cid,
-            "words_sent_by_donor": int(w_donor),
-            "words_sent_by_contacts": int(w_contacts),
-            "bias": float(bias) if not np.isnan(bias) else np.nan
-        })
-    return pd.DataFrame(records)
-
-
-def show_interaction_balance_dashboard():
+def daily_balance_cumsums(donor, top_k=TOP_K_CONTACTS):
+    """
+    Cumulative words per day sent by the donor and by contacts, for all chats together and for the top_k chats with the most words.
+    Returns a dict with chats (row 0 = all chats), dates and the donor / contacts cumulative sums of shape (len(chats), n_days + 1)
+    """
+    df = donor_messages(donor)
+    codes, chats = pd.factorize(df["conversation_id"], sort=True)
+    dt = datetime_values(df["dt"])
+    keep = (codes >= 0) & ~np.isnat(dt)
+    if not keep.any():
+        return None
+    codes = codes[keep]
+    days = dt[keep].astype("datetime64[D]").astype(np.int64)
+    first_day = days.min()
+    days -= first_day
+    n_days = int(days.max()) + 1
+    words = df["word_count"].to_numpy(dtype=float)[keep]
+    sent = (df["sender_id"] == donor).to_numpy()[keep]
+
+    #row of every chat: 1 + rank among the top chats, -1 for the other chats (only counted in the all chats row)
+    top, _, _ = top_k_with_others(np.bincount(codes, weights=np.nan_to_num(words), minlength=len(chats)), top_k)
+    rows = np.full(len(chats), -1)
+    rows[top] = np.arange(1, len(top) + 1)
+    groups = np.concatenate((np.zeros(len(codes), dtype=np.int64), rows[codes]))
+    donor_cumsum, contact_cumsum = daily_role_cumsums(groups, np.tile(days, 2), np.tile(words, 2), np.tile(sent, 2), len(top) + 1, n_days)
+    return {
+        "chats": ["All Chats"] + list(chats[top]),
+        "dates": (first_day + np.arange(n_days)).astype("datetime64[D]"),
+        "donor_cumsum": donor_cumsum,
+        "contact_cumsum": contact_cumsum,
+    }
+
+
+def show_interaction_balance_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     donor_ids = sorted(donations["donor_id"].unique())
 
     #Donor input text
@@ -42,17 +69,24 @@ def show_interaction_balance_dashboard():
     view_radio = widgets.RadioButtons(
         options=[
             ("Bias Distribution + Summary", "bias_summary"),
-            ("Per Chat Word Comparison", "per_chat")
+            ("Per Chat Word Comparison", "per_chat"),
+            ("Balance Over Time", "over_time")
         ],
         description="View:",
         layout=widgets.Layout(width="300px")
     )
 
+    #sliding window of the balance over time view, only shown in that view
+    window_slider = widgets.IntSlider(value=30, min=1, max=365, step=1, description="Window (days)",
+                                      continuous_update=False, layout=widgets.Layout(width="400px", display="none"))
+
     #outputs
     chart_output = widgets.Output()
     summary_output = widgets.Output()
     summary_output.layout.display = "block"
     donor_data_cache = {}
+    #cumulative daily words per donor, a new window size only recomputes differences of these
+    daily_cache = {}
 
     #dynamically filters donor dropdown as user types
     def filter_dropdown(change):
@@ -67,21 +101,22 @@ def show_interaction_balance_dashboard():
 
 
     def compute_donor_data(donor):
-        #extracts all messages linked to this donor id
-        donor_msgs = messages[messages["donation_id"].isin(
-            donations.loc[donations["donor_id"] == donor, "donation_id"]
-        )].copy()
+        #words sent by donor and by contacts per conversation of this donor id
+        balance_df = donor_words_by_role(donor)
 
-        if donor_msgs.empty:
+        if balance_df.empty:
             return None, "No messages for this donor."
 
-        balance_df = compute_interaction_balance(donor_msgs, donor)
+        balance_df["bias"] = interaction_bias(balance_df["words_sent_by_donor"], balance_df["words_sent_by_contacts"])
         balance_df = balance_df.dropna(subset=["bias"])
         if balance_df.empty:
             return None, "No valid bias data for this donor."
 
         return balance_df, None
 
+    #computed ahead for the next donors in the dropdown
+    prefetcher = create_prefetcher(lambda donor: cached("interaction_balance", lambda: compute_donor_data(donor), donor=donor), prefetch_depth)
+
     #draws chart depending on selected view
     def render_view(change=None):
         chart_output.clear_output(wait=True)
@@ -95,6 +130,7 @@ def show_interaction_balance_dashboard():
 
         balance_df = donor_data_cache[donor]
         view_choice = view_radio.value
+        window_slider.layout.display = "flex" if view_choice == "over_time" else "none"
 
         if view_choice == "bias_summary":
             summary_output.layout.display = "block"
@@ -140,7 +176,17 @@ def show_interaction_balance_dashboard():
 
             #view2= per chat word comparison
             with chart_output:
-                sorted_df = balance_df.sort_values("bias")
+                #the chats with the most words (sorted by bias) and one bucket for all other chats, so the figure size stays bounded
+                total_words = balance_df["words_sent_by_donor"] + balance_df["words_sent_by_contacts"]
+                top, _, n_others = top_k_with_others(total_words.to_numpy())
+                sorted_df = balance_df.iloc[top].sort_values("bias")
+                if n_others:
+                    rest = balance_df.drop(index=balance_df.index[top])
+                    sorted_df = pd.concat([sorted_df, pd.DataFrame({
+                        "conversation_id": [f"Others ({n_others})"],
+                        "words_sent_by_donor": [rest["words_sent_by_donor"].sum()],
+                        "words_sent_by_contacts": [rest["words_sent_by_contacts"].sum()],
+                    })], ignore_index=True)
                 fig, ax = plt.subplots(figsize=(max(8, len(sorted_df)*0.4), 5))
                 #Two bars per chat, donor vs contacts
                 x = np.arange(len(sorted_df))
@@ -151,16 +197,59 @@ def show_interaction_balance_dashboard():
                 ax.set_xticks(x)
                 short_labels = [str(cid)[:8] + "..." if len(str(cid)) > 8 else str(cid)
                                 for cid in sorted_df["conversation_id"]]
+                if n_others:
+                    short_labels[-1] = sorted_df["conversation_id"].iloc[-1]
                 ax.set_xticklabels(short_labels, rotation=45, ha="right")
                 #Axis titles and grid
                 ax.set_ylabel("Total Words Sent")
-                ax.set_title(f"Per-Chat Word Exchange — Donor {donor}")
+                ax.set_title(f"Per-Chat Word Exchange — Donor {donor}" + (f" (Top {len(top)} of {len(balance_df)} Chats)" if n_others else ""))
                 ax.legend()
                 ax.grid(axis="y", alpha=0.3)
                 plt.tight_layout()
                 add_save_and_note_controls(fig, donor, "ALL", "interactionbalance-perchat")
                 plt.show()
 
+        elif view_choice == "over_time":
+            summary_output.layout.display = "none"
+
+            #view3 = bias over sliding windows, all chats as a line and the chats with the most words as a heatmap
+            with chart_output:
+                if donor not in daily_cache:
+                    daily_cache[donor] = cached("interaction_balance_daily", lambda: daily_balance_cumsums(donor), donor=donor)
+                daily = daily_cache[donor]
+                if daily is None:
+                    display(HTML("<b style='color:orange;'>No dated messages for this donor.</b>"))
+                    return
+                window = window_slider.value
+                bias = rolling_balance(daily["donor_cumsum"], daily["contact_cumsum"], window)
+                dates = daily["dates"]
+
+                fig, (ax_all, ax_chats) = plt.subplots(2, 1, figsize=(12, 8), sharex=True,
+                                                        gridspec_kw={"height_ratios": [1, 3]}, constrained_layout=True)
+                ax_all.plot(np.arange(len(dates)), bias[0], color="steelblue")
+                ax_all.axhline(0, color="red", linestyle="--", label="Perfectly Balanced (0)")
+                ax_all.set_ylim(-0.55, 0.55)
+                ax_all.set_ylabel("Bias (All Chats)")
+                ax_all.legend(loc="upper right", fontsize=8)
+                ax_all.grid(alpha=0.3)
+
+                #blue = donor sends more, red = contacts send more, black = no words in the window
+                cmap = plt.get_cmap("coolwarm").copy()
+                cmap.set_bad("black")
+                image = ax_chats.imshow(np.ma.masked_invalid(bias[1:]), aspect="auto", cmap=cmap, vmin=-0.5, vmax=0.5, interpolation="nearest")
+                fig.colorbar(image, ax=[ax_all, ax_chats], label="Bias")
+                ax_chats.set_yticks(np.arange(len(daily["chats"]) - 1))
+                ax_chats.set_yticklabels([str(cid)[:8] + "..." if len(str(cid)) > 8 else str(cid) for cid in daily["chats"][1:]])
+                ax_chats.set_ylabel("Chat (Most Words First)")
+                #To avoid messiness, shows roughly 10 evenly spaced date labels
+                ticks = np.arange(0, len(dates), max(1, len(dates) // 10))
+                ax_chats.set_xticks(ticks)
+                ax_chats.set_xticklabels([str(dates[i]) for i in ticks], rotation=45, ha="right")
+                ax_chats.set_xlabel("Window End Date")
+                ax_all.set_title(f"Interaction Balance Over Time — Donor {donor} ({window}-Day Window)")
+                add_save_and_note_controls(fig, donor, "ALL", f"interactionbalance-overtime-{window}d")
+                plt.show()
+
     #loads data for the selected donor and triggers rendering
     def load_donor(_=None):
         donor = donor_input.value.strip() or donor_dropdown.value
@@ -173,7 +262,8 @@ def show_interaction_balance_dashboard():
                 display(HTML(f"<b style='color:red;'>Donor '{donor}' not found.</b>"))
             return
 
-        balance_df, msg = compute_donor_data(donor)
+        balance_df, msg = prefetcher["get"](donor)
+        prefetcher["prefetch_after"](donor, donor_dropdown.options)
         if msg:
             summary_output.layout.display = "none"
             with chart_output:
@@ -187,11 +277,13 @@ def show_interaction_balance_dashboard():
     donor_input.on_submit(load_donor)
     donor_dropdown.observe(load_donor, names='value')
     view_radio.observe(render_view, names='value')
+    window_slider.observe(render_view, names='value')
 
     #Layout
     display(widgets.VBox([
         widgets.HTML("<h2>Interaction Balance Dashboard</h2>"),
         widgets.HBox([donor_input, donor_dropdown], layout=widgets.Layout(gap="10px")),
         view_radio,
+        window_slider,
         widgets.HBox([chart_output, summary_output], layout=widgets.Layout(gap="20px", align_items="flex-start"))
     ]))
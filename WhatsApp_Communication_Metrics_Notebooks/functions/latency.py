@@ -0,0 +1,227 @@
+"Measures how quickly donor and contacts reply to each other"
+
+#Imports datasets like messages and donations
+from dataloader import *
+#Imports helper for saving figures and adding notes
+from functions.pic_notes_save import *
+#Vectorized reply detection and latency summaries, top chats for donors with very many chats
+from functions.metrics import datetime_values, reply_latencies, reply_latency_summary, top_k_with_others
+#Persistent cache, results survive kernel restarts
+from functions.result_cache import cached
+#Next donors in the dropdown are loaded on a background thread
+from functions.prefetch import create_prefetcher, PREFETCH_DEPTH
+
+#replier labels, code 0 = a contact answers the donor, 1 = the donor answers a contact
+REPLIERS = ["Contact", "Donor"]
+#log-spaced histogram bins from 1 second to 16 weeks, longer latencies are counted in the last bin
+LATENCY_BINS = np.logspace(0, np.log10(16 * 7 * 86400), 61)
+LATENCY_TICKS = {1: "1 s", 60: "1 min", 3600: "1 h", 86400: "1 d", 7 * 86400: "1 w"}
+
+def donor_reply_latencies(donor):
+    """
+    Replies in the donor's chats: a message whose sender role (donor or contact) differs from the previous message of the chat.
+    Returns a DataFrame with conversation_id, latency (seconds since the previous message) and donor_replied.
+    """
+    df = donor_messages(donor)
+    codes, chats = pd.factorize(df["conversation_id"], sort=True)
+    keep = codes >= 0
+    conversations, latencies, donor_replied = reply_latencies(
+        codes[keep], datetime_values(df["dt"])[keep], (df["sender_id"] == donor).to_numpy()[keep]
+    )
+    return pd.DataFrame({"conversation_id": chats[conversations], "latency": latencies, "donor_replied": donor_replied})
+
+def summarize_reply_latencies(replies):
+    """
+    Latency summaries (replies, mean, median, p25, p75, p90 in seconds) of a replies frame.
+    Returns (per_chat indexed by (conversation_id, replier), per_donor indexed by replier)
+    """
+    codes, chats = pd.factorize(replies["conversation_id"], sort=True)
+    role = replies["donor_replied"].to_numpy().astype(np.int64)
+    latencies = replies["latency"].to_numpy()
+    per_chat = reply_latency_summary(codes * 2 + role, latencies, 2 * len(chats))
+    per_chat.index = pd.MultiIndex.from_product([chats, REPLIERS], names=["conversation_id", "replier"])
+    per_donor = reply_latency_summary(role, latencies, 2)
+    per_donor.index = pd.Index(REPLIERS, name="replier")
+    return per_chat, per_donor
+
+#duration units, largest first
+DURATION_UNITS = [("days", "d", 86400), ("hours", "h", 3600), ("minutes", "min", 60), ("seconds", "s", 1)]
+
+def duration_unit(seconds):
+    #largest unit that the duration reaches (seconds for shorter or missing durations)
+    return next((unit for unit in DURATION_UNITS if seconds >= unit[2]), DURATION_UNITS[-1])
+
+def format_duration(seconds):
+    #latency as a short readable duration
+    if np.isnan(seconds):
+        return "—"
+    _, unit, size = duration_unit(seconds)
+    return f"{seconds / size:.0f} {unit}" if size == 1 else f"{seconds / size:.1f} {unit}"
+
+def show_reply_latency_dashboard(prefetch_depth=PREFETCH_DEPTH):
+    import matplotlib.pyplot as plt
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
+    donor_ids = sorted(donations["donor_id"].unique())
+
+    #Donor input text
+    donor_input = widgets.Text(
+        placeholder="Type donor ID",
+        description="Donor:",
+        layout=widgets.Layout(width="300px")
+    )
+    donor_dropdown = widgets.Dropdown(
+        options=donor_ids,
+        layout=widgets.Layout(width="250px")
+    )
+
+    #View selector
+    view_radio = widgets.RadioButtons(
+        options=[
+            ("Latency Distribution + Summary", "distribution"),
+            ("Per Chat Median Latency", "per_chat")
+        ],
+        description="View:",
+        layout=widgets.Layout(width="300px")
+    )
+
+    #outputs
+    chart_output = widgets.Output()
+    summary_output = widgets.Output()
+    donor_data_cache = {}
+
+    #dynamically filters donor dropdown as user types
+    def filter_dropdown(change):
+        text = change["new"].strip().lower()
+        if not text:
+            donor_dropdown.options = donor_ids
+        else:
+            matches = [d for d in donor_ids if text in str(d).lower()]
+            donor_dropdown.options = matches if matches else ["No match"]
+
+    donor_input.observe(filter_dropdown, names="value")
+
+    def compute_donor_data(donor):
+        #only the summaries and fixed-bin histograms are kept, not one row per reply
+        replies = donor_reply_latencies(donor)
+        if replies.empty:
+            return None, "No replies for this donor."
+        per_chat, per_donor = summarize_reply_latencies(replies)
+        clipped = np.clip(replies["latency"].to_numpy(), LATENCY_BINS[0], LATENCY_BINS[-1])
+        histograms = {
+            replier: np.histogram(clipped[replies["donor_replied"].to_numpy() == bool(code)], bins=LATENCY_BINS)[0]
+            for code, replier in enumerate(REPLIERS)
+        }
+        return {"per_chat": per_chat, "per_donor": per_donor, "histograms": histograms}, None
+
+    #computed ahead for the next donors in the dropdown
+    prefetcher = create_prefetcher(lambda donor: cached("reply_latency", lambda: compute_donor_data(donor), donor=donor), prefetch_depth)
+
+    #draws chart depending on selected view
+    def render_view(change=None):
+        chart_output.clear_output(wait=True)
+        summary_output.clear_output(wait=True)
+
+        donor = donor_input.value.strip() or donor_dropdown.value
+        if donor not in donor_data_cache:
+            with chart_output:
+                display(HTML("<b style='color:orange;'>Please load a donor first.</b>"))
+            return
+        data = donor_data_cache[donor]
+
+        if view_radio.value == "distribution":
+            #view1 = latency histograms on a log time axis
+            with chart_output:
+                fig, ax = plt.subplots(figsize=(8, 5))
+                for replier, color in (("Donor", "mediumseagreen"), ("Contact", "orange")):
+                    ax.stairs(data["histograms"][replier], LATENCY_BINS, color=color, linewidth=2, label=f"{replier} replies")
+                ax.set_xscale("log")
+                ax.set_xticks(list(LATENCY_TICKS))
+                ax.set_xticklabels(list(LATENCY_TICKS.values()))
+                ax.set_title(f"Reply Latency Distribution — Donor {donor}")
+                ax.set_xlabel("Time to Reply")
+                ax.set_ylabel("Number of Replies")
+                ax.legend()
+                ax.grid(alpha=0.3)
+                plt.tight_layout()
+                add_save_and_note_controls(fig, donor, "ALL", "replylatency-distribution")
+                plt.show()
+
+            with summary_output:
+                per_donor = data["per_donor"]
+                rows = "".join(
+                    f"<tr><td>{replier}</td><td>{per_donor.at[replier, 'replies']}</td>"
+                    f"<td>{format_duration(per_donor.at[replier, 'median'])}</td>"
+                    f"<td>{format_duration(per_donor.at[replier, 'p25'])} – {format_duration(per_donor.at[replier, 'p75'])}</td>"
+                    f"<td>{format_duration(per_donor.at[replier, 'p90'])}</td></tr>"
+                    for replier in ("Donor", "Contact")
+                )
+                display(HTML(f"""
+                <div style='background:#f9f9f9;padding:12px;border-radius:8px;width:420px;'>
+                    <h4>Reply Latency Summary</h4>
+                    <table><tr><th>Replier</th><th>Replies</th><th>Median</th><th>IQR</th><th>90th pct</th></tr>{rows}</table>
+                    <p><small>A reply is a message following a message of the other side in the same chat,<br>
+                    its latency is the time since that message.</small></p>
+                </div>
+                """))
+
+        elif view_radio.value == "per_chat":
+            #view2 = median latency of both sides for the chats with the most replies
+            with chart_output:
+                medians = data["per_chat"]["median"].unstack("replier")
+                replies = data["per_chat"]["replies"].unstack("replier").sum(axis=1)
+                top, _, n_others = top_k_with_others(replies.to_numpy())
+                medians = medians.iloc[top]
+                #one time unit for all bars, chosen from the longest median
+                unit, _, size = duration_unit(np.nanmax(medians.to_numpy()))
+                fig, ax = plt.subplots(figsize=(max(8, len(medians)*0.4), 5))
+                #Two bars per chat, donor vs contacts
+                x = np.arange(len(medians))
+                width = 0.4
+                ax.bar(x - width/2, medians["Donor"] / size, width, label="Donor", color="mediumseagreen")
+                ax.bar(x + width/2, medians["Contact"] / size, width, label="Contacts", color="orange")
+                #label chats on x-axis
+                ax.set_xticks(x)
+                ax.set_xticklabels([str(cid)[:8] + "..." if len(str(cid)) > 8 else str(cid) for cid in medians.index],
+                                   rotation=45, ha="right")
+                ax.set_ylabel(f"Median Time to Reply ({unit})")
+                ax.set_title(f"Per-Chat Reply Latency — Donor {donor}" + (f" (Top {len(top)} of {len(replies)} Chats)" if n_others else ""))
+                ax.legend()
+                ax.grid(axis="y", alpha=0.3)
+                plt.tight_layout()
+                add_save_and_note_controls(fig, donor, "ALL", "replylatency-perchat")
+                plt.show()
+
+    #loads data for the selected donor and triggers rendering
+    def load_donor(_=None):
+        donor = donor_input.value.strip() or donor_dropdown.value
+        chart_output.clear_output(wait=True)
+        summary_output.clear_output(wait=True)
+
+        if donor not in donor_ids:
+            with chart_output:
+                display(HTML(f"<b style='color:red;'>Donor '{donor}' not found.</b>"))
+            return
+
+        data, msg = prefetcher["get"](donor)
+        prefetcher["prefetch_after"](donor, donor_dropdown.options)
+        if msg:
+            with chart_output:
+                display(HTML(f"<b style='color:orange;'>{msg}</b>"))
+            return
+
+        donor_data_cache[donor] = data
+        render_view()
+
+    #Reactive Updates
+    donor_input.on_submit(load_donor)
+    donor_dropdown.observe(load_donor, names='value')
+    view_radio.observe(render_view, names='value')
+
+    #Layout
+    display(widgets.VBox([
+        widgets.HTML("<h2>Reply Latency Dashboard</h2>"),
+        widgets.HBox([donor_input, donor_dropdown], layout=widgets.Layout(gap="10px")),
+        view_radio,
+        widgets.HBox([chart_output, summary_output], layout=widgets.Layout(gap="20px", align_items="flex-start"))
+    ]))
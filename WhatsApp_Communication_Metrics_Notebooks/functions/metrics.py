@@ -0,0 +1,615 @@
+"""Headless metric implementations shared by all dashboards.
+Only numpy and pandas are imported here so batch jobs, worker processes and CLI tools can compute metrics without loading matplotlib, ipywidgets or the message data.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+#datetime column as a numpy datetime64 array, tz-aware timestamps are converted to wall time so dates and hours match .dt.date / .dt.hour
+def datetime_values(dt):
+    if getattr(dt.dt, "tz", None) is not None:
+        dt = dt.dt.tz_localize(None)
+    return dt.to_numpy(dtype="datetime64[ns]")
+
+#Gini coefficient of a {contact: count} mapping
+def calculate_gini(counts):
+    # Sorting the values in ascending order to assign ranks (lowest to highest)
+    values = sorted(list(counts.values()))
+    n = len(values) #Total number of contacts
+    total = sum(values) #Sum of all counts (total messages or words)
+    # If no contacts or no messages/words
+    if n == 0 or total == 0:
+        #Gini is undefined, treat as perfectly equal
+        return 0.0
+    #Weighted sum: each value multiplied by its rank (i+1 because rank starts from 1)
+    weighted_sum = sum((i + 1) * val for i, val in enumerate(values))
+    return (2 * weighted_sum) / (n * total) - (n + 1) / n #This formula am using from dona research paper
+
+def compute_burstiness(days):
+    #Sorts all message dates 
+    days_sorted = sorted(days)
+    #If less than 2 message days, burstiness can't be measured (no intervals)
+    if len(days_sorted) < 2:
+        return (np.nan, np.nan)
+    #Compute time gaps
+    inter_event = np.diff(pd.to_datetime(days_sorted)).astype("timedelta64[D]").astype(int)
+    #mu = mean and sigma = standard deviation of intervals.
+    mu = inter_event.mean()
+    if mu == 0:
+        return (np.nan, np.nan)
+    sigma = inter_event.std(ddof=0)
+    #r=Coefficient of variation tells us how variable the intervals are relative to the mean
+    r = sigma / mu
+    n = len(days_sorted)
+    #B1 (classic burstiness index), 
+    B1 = (r - 1) / (r + 1) if (r + 1) != 0 else np.nan
+    if n > 1:
+        num = (np.sqrt(n + 1) * r) - np.sqrt(n - 1)
+        den = ((np.sqrt(n + 1) - 2) * r) + np.sqrt(n - 1)
+        B2 = num / den if den != 0 else np.nan
+    else:
+        #B2 refines B1 to reduce bias when few events exist
+        B2 = np.nan
+    return (B1, B2)
+
+#B1 < -0.2 is regular,B1 between -0.2 and +0.2 is random, B1 > +0.2 is highly bursty
+def classify_b1(b1, lo=-0.2, hi=0.2):
+    if pd.isna(b1):
+        return "N/A"
+    if b1 < lo:
+        return "Regular"
+    if b1 > hi:
+        return "Bursty"
+    return "Random"
+
+def interaction_bias(donor_words, contact_words):
+    """Interaction bias 0.5 - donor words / all words (NaN without words), for single totals or arrays of totals"""
+    donor_words = np.asarray(donor_words, dtype=float)
+    total = donor_words + np.asarray(contact_words, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total != 0, 0.5 - donor_words / total, np.nan)
+
+def compute_interaction_balance(df, donor_id):
+    #for each conversation calculates total words sent by donor and by contacts
+    records = []
+    for cid, group in df.groupby("conversation_id"):
+        w_donor = group.loc[group["sender_id"] == donor_id, "word_count"].sum()
+        w_contacts = group.loc[group["sender_id"] != donor_id, "word_count"].sum()
+        #stores metrics for this conversation
+        records.append({
+            "conversation_id": cid,
+            "words_sent_by_donor": int(w_donor),
+            "words_sent_by_contacts": int(w_contacts),
+            "bias": float(interaction_bias(w_donor, w_contacts))
+        })
+    return pd.DataFrame(records)
+
+#Time-resolved interaction balance: words per day by sender role are accumulated once, every window is a difference of cumulative sums
+def daily_role_cumsums(groups, days, words, sent, n_groups, n_days):
+    """
+    Cumulative words per day sent by the donor and by contacts for every group (e.g. chat), one bincount per role.
+    groups: group code per message (-1 = skipped), days: day offset 0..n_days-1, words: word counts (NaN counts as 0),
+    sent: True for the donor's messages.
+    Returns (donor, contacts) arrays of shape (n_groups, n_days + 1) starting with a 0 column,
+    so the words of days [a, b) are cumsum[:, b] - cumsum[:, a].
+    """
+    groups = np.asarray(groups)
+    keep = groups >= 0
+    keys = groups[keep].astype(np.int64) * n_days + np.asarray(days)[keep]
+    words = np.nan_to_num(np.asarray(words, dtype=float)[keep])
+    sent = np.asarray(sent, dtype=bool)[keep]
+    cumsums = []
+    for role_words in (words * sent, words * ~sent):
+        per_day = np.bincount(keys, weights=role_words, minlength=n_groups * n_days).reshape(n_groups, n_days)
+        cumsums.append(np.concatenate((np.zeros((n_groups, 1)), np.cumsum(per_day, axis=1)), axis=1))
+    return cumsums[0], cumsums[1]
+
+def rolling_balance(donor_cumsum, contact_cumsum, window):
+    """
+    Interaction bias (0.5 - donor share of the words, like compute_interaction_balance) over sliding windows of
+    window days ending at every day, from cumulative sums of daily_role_cumsums. NaN for windows without words.
+    Returns an array of shape (n_groups, n_days)
+    """
+    end = np.arange(1, donor_cumsum.shape[1])
+    start = np.maximum(0, end - window)
+    return interaction_bias(donor_cumsum[:, end] - donor_cumsum[:, start], contact_cumsum[:, end] - contact_cumsum[:, start])
+
+#Vectorized variants used when many donors or chats are computed at once (metric planner, cohort tables)
+def calculate_gini_grouped(groups, values, n_groups):
+    """
+    calculate_gini for many groups at once.
+    groups: integer group code per value, values: counts, n_groups: number of groups
+    Returns an array of Gini values (0.0 for groups without data, like calculate_gini)
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    #sort by group then value so ranks inside each group run from lowest to highest
+    order = np.lexsort((values, groups))
+    g = groups[order]
+    v = values[order]
+    n = np.bincount(g, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(n)[:-1]))
+    ranks = np.arange(len(g)) - starts[g] + 1
+    weighted_sum = np.bincount(g, weights=ranks * v, minlength=n_groups)
+    total = np.bincount(g, weights=v, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gini = (2 * weighted_sum) / (n * total) - (n + 1) / n
+    return np.where((n == 0) | (total == 0), 0.0, gini)
+
+def compute_burstiness_grouped(groups, days, n_groups):
+    """
+    compute_burstiness for many event sequences at once.
+    groups and days must be sorted by (group, day) with distinct days inside each group,
+    days are integers (e.g. days since epoch). Returns (B1, B2) arrays of length n_groups.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    n = np.bincount(groups, minlength=n_groups).astype(float)
+    #inter-event gaps only between consecutive events of the same group
+    same = groups[1:] == groups[:-1]
+    gaps = np.diff(days)[same].astype(float)
+    gap_groups = groups[1:][same]
+    k = np.bincount(gap_groups, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = np.bincount(gap_groups, weights=gaps, minlength=n_groups) / k
+        sigma = np.sqrt(np.bincount(gap_groups, weights=(gaps - mu[gap_groups]) ** 2, minlength=n_groups) / k)
+        r = sigma / mu
+        B1 = (r - 1) / (r + 1)
+        num = (np.sqrt(n + 1) * r) - np.sqrt(n - 1)
+        den = ((np.sqrt(n + 1) - 2) * r) + np.sqrt(n - 1)
+        B2 = np.where(den != 0, num / den, np.nan)
+    #fewer than 2 events or zero mean gap cannot be measured
+    undefined = (n < 2) | ~(mu > 0)
+    B1 = np.where(undefined | (r + 1 == 0), np.nan, B1)
+    B2 = np.where(undefined, np.nan, B2)
+    return B1, B2
+
+def classify_b1_grouped(b1, lo=-0.2, hi=0.2):
+    """classify_b1 for an array of B1 values, returns an array of labels"""
+    b1 = np.asarray(b1, dtype=float)
+    with np.errstate(invalid="ignore"):
+        return np.select([np.isnan(b1), b1 < lo, b1 > hi], ["N/A", "Regular", "Bursty"], "Random")
+
+#Plot reductions for donors with very many contacts, so drawing cost doesn't grow with the number of contacts.
+#The metrics themselves (Gini, bias) are always computed on the full data.
+TOP_K_CONTACTS = 30
+LORENZ_POINTS = 201
+
+def top_k_with_others(values, k=TOP_K_CONTACTS):
+    """
+    Positions of the k largest values (found with np.argpartition, returned in their original order)
+    and the sum and number of the remaining values for an "others" bucket. All positions when there are at most k values.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) <= k:
+        return np.arange(len(values)), 0.0, 0
+    top = np.sort(np.argpartition(-values, k - 1)[:k])
+    return top, values.sum() - values[top].sum(), len(values) - k
+
+def lorenz_points(values, n_points=LORENZ_POINTS):
+    """
+    Lorenz curve of values as (cumulative share of contacts, cumulative share of the total), both from 0 to 1.
+    With more than n_points - 1 values the curve is sampled at n_points fixed quantiles instead of one point per value.
+    """
+    values = np.sort(np.asarray(values, dtype=float))
+    cumulative = np.insert(np.cumsum(values) / values.sum(), 0, 0)
+    contacts = np.linspace(0, 1, len(values) + 1)
+    if len(values) + 1 <= n_points:
+        return contacts, cumulative
+    #the curve is piecewise linear between contacts, so interpolation gives its exact value at every quantile
+    quantiles = np.linspace(0, 1, n_points)
+    return quantiles, np.interp(quantiles, contacts, cumulative)
+
+#Daily time series used by the daily words / active contacts dashboards
+def daily_series(df, value_col):
+    """
+    Full-history daily series of a message frame as NumPy arrays, one entry per calendar day between the first and last message.
+    value_col = 'conversation_id' counts distinct active chats per day, any other column is summed per day.
+    Returns (dates, values, message_counts)
+    """
+    dt = datetime_values(df["dt"])
+    valid = ~np.isnat(dt)
+    days = dt[valid].astype("datetime64[D]").astype(np.int64)
+    if len(days) == 0:
+        return np.array([], dtype="datetime64[D]"), np.array([], dtype=float), np.array([], dtype=np.int64)
+    first_day = days.min()
+    offsets = days - first_day
+    n_days = int(offsets.max()) + 1
+    message_counts = np.bincount(offsets, minlength=n_days)
+    if value_col == "conversation_id":
+        chats = pd.factorize(df["conversation_id"].to_numpy()[valid])[0]
+        known = chats >= 0
+        #distinct (day, chat) pairs, then count chats per day
+        pairs = np.unique(offsets[known] * (chats.max() + 1) + chats[known])
+        values = np.bincount(pairs // (chats.max() + 1), minlength=n_days).astype(float)
+    else:
+        words = np.nan_to_num(df[value_col].to_numpy(dtype=float)[valid])
+        values = np.bincount(offsets, weights=words, minlength=n_days)
+    dates = (first_day + np.arange(n_days)).astype("datetime64[D]")
+    return dates, values, message_counts
+
+def moving_average(values, window, cumsum=None):
+    """
+    Same result as pd.Series(values).rolling(window, min_periods=1).mean(), computed from cumulative-sum differences.
+    cumsum: optional precomputed np.concatenate(([0], np.cumsum(values))) (or a slice of it) so a new window costs O(len(values))
+    """
+    if cumsum is None:
+        cumsum = np.concatenate(([0.0], np.cumsum(values, dtype=float)))
+    end = np.arange(1, len(cumsum))
+    start = np.maximum(0, end - window)
+    return (cumsum[end] - cumsum[start]) / (end - start)
+
+#Hour-of-week activity used by the cohort rhythm dashboard, one grid row per weekday (Monday first) and one column per hour
+HOURS_PER_WEEK = 7 * 24
+
+def hour_of_week_codes(seconds):
+    """Hour-of-week code (weekday * 24 + hour, Monday 0:00 = 0) of epoch-second timestamps"""
+    hours = np.asarray(seconds) // 3600
+    #1970-01-01 was a Thursday
+    return (hours // 24 + 3) % 7 * 24 + hours % 24
+
+def hour_of_week_counts(groups, seconds, words, n_groups):
+    """
+    Messages and words per group (e.g. donor code) and hour of week, one np.bincount over combined group/hour codes each.
+    groups: int code per message (-1 = skipped), seconds: epoch-second timestamps, words: word counts (NaN counts as 0).
+    Returns (messages, words) arrays of shape (n_groups, 7, 24), which can be added up over chunks of messages.
+    """
+    groups = np.asarray(groups)
+    keep = groups >= 0
+    keys = groups[keep].astype(np.int64) * HOURS_PER_WEEK + hour_of_week_codes(np.asarray(seconds)[keep])
+    size = n_groups * HOURS_PER_WEEK
+    messages = np.bincount(keys, minlength=size)
+    words = np.bincount(keys, weights=np.nan_to_num(np.asarray(words, dtype=float)[keep]), minlength=size)
+    return messages.reshape(n_groups, 7, 24), words.reshape(n_groups, 7, 24)
+
+def cohort_hour_of_week(grids, normalize=False, mean=False):
+    """
+    7x24 cohort grid from per-donor grids of shape (n_donors, 7, 24), only donors with activity are included.
+    normalize: every donor's grid is divided by its total first (share of the donor's activity), so all donors weigh the same
+    mean: averaged over these donors instead of summed
+    """
+    totals = grids.sum(axis=(1, 2))
+    active = totals > 0
+    grids = grids[active].astype(float)
+    if normalize:
+        grids /= totals[active, None, None]
+    grid = grids.sum(axis=0)
+    if mean and active.any():
+        grid /= active.sum()
+    return grid
+
+#Reply latencies used by the reply latency dashboard, computed with shifted comparisons on sorted arrays
+def _conversation_time_order(conversations, seconds):
+    #stable order by (conversation, time), so messages with the same timestamp keep their order
+    if len(seconds) == 0:
+        return np.arange(0)
+    conversations = conversations.astype(np.int64) - conversations.min()
+    seconds = seconds - seconds.min()
+    row_bits = (len(seconds) - 1).bit_length()
+    time_bits = int(seconds.max()).bit_length()
+    conversation_bits = int(conversations.max()).bit_length()
+    if conversation_bits + time_bits + row_bits <= 63:
+        #(conversation, time, row) packed into one int64 key, a plain value sort then gives the order in its low bits
+        keys = (conversations << (time_bits + row_bits)) | (seconds << row_bits) | np.arange(len(seconds))
+        return np.sort(keys) & ((1 << row_bits) - 1)
+    if conversation_bits + time_bits <= 63:
+        return np.argsort((conversations << time_bits) | seconds, kind="stable")
+    return np.lexsort((seconds, conversations))
+
+def reply_latencies(conversations, times, sent):
+    """
+    Replies of one donor's messages: a message whose sender role (donor or contact) differs from the previous message
+    of the same conversation, its latency is the time since that previous message.
+    conversations: integer conversation code per message, times: datetime64 timestamps (NaT skipped), sent: True for the donor's messages.
+    Returns (conversation codes, latencies in seconds, donor_replied) of all replies, in (conversation, time) order
+    """
+    seconds = np.asarray(times).astype("datetime64[s]").astype(np.int64)
+    valid = ~np.isnat(np.asarray(times))
+    conversations, seconds, sent = np.asarray(conversations)[valid], seconds[valid], np.asarray(sent, dtype=bool)[valid]
+    order = _conversation_time_order(conversations, seconds)
+    conversations, seconds, sent = conversations[order], seconds[order], sent[order]
+    reply = (conversations[1:] == conversations[:-1]) & (sent[1:] != sent[:-1])
+    return conversations[1:][reply], (seconds[1:] - seconds[:-1])[reply], sent[1:][reply]
+
+def grouped_quantiles(groups, values, n_groups, quantiles):
+    """
+    Quantiles of values per group (linear interpolation like np.quantile) from one sort of all values.
+    Returns an array of shape (n_groups, len(quantiles)), NaN for groups without values.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=float)
+    quantiles = np.asarray(quantiles, dtype=float)
+    result = np.full((n_groups, len(quantiles)), np.nan)
+    if len(values) == 0:
+        return result
+    #values sorted within groups: sorted by value first, then stably by group (radix sort for small group codes)
+    order = np.argsort(values)
+    group_keys = groups[order].astype(np.uint16) if n_groups <= 1 << 16 else groups[order]
+    values = values[order[np.argsort(group_keys, kind="stable")]]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has = counts > 0
+    position = (counts[has, None] - 1) * quantiles
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, counts[has, None] - 1)
+    fraction = position - low
+    first = starts[has, None]
+    result[has] = values[first + low] * (1 - fraction) + values[first + high] * fraction
+    return result
+
+def reply_latency_summary(groups, latencies, n_groups):
+    """Number of replies, mean, median and 25th/75th/90th percentile of the latencies per group, as a DataFrame indexed by group code"""
+    groups = np.asarray(groups)
+    counts = np.bincount(groups, minlength=n_groups)
+    sums = np.bincount(groups, weights=np.asarray(latencies, dtype=float), minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+    quantiles = grouped_quantiles(groups, latencies, n_groups, [0.5, 0.25, 0.75, 0.9])
+    return pd.DataFrame({
+        "replies": counts,
+        "mean": mean,
+        "median": quantiles[:, 0],
+        "p25": quantiles[:, 1],
+        "p75": quantiles[:, 2],
+        "p90": quantiles[:, 3],
+    })
+
+def compute_burstiness_streaming(timestamps, chunk_size=65536):
+    """
+    Message-level burstiness at second resolution, computed in a single streaming pass.
+    timestamps: sorted datetime64 array (e.g. a chat's dt values); NaT entries are skipped.
+    The inter-event mean and variance are accumulated chunk by chunk with Welford/Chan updates,
+    so no interval array is built for the whole chat. n is the number of messages.
+    Returns (B1, B2) on the same scale as compute_burstiness.
+    """
+    timestamps = np.asarray(timestamps)
+    if not np.issubdtype(timestamps.dtype, np.datetime64):
+        timestamps = pd.to_datetime(timestamps).to_numpy()
+    n_events = 0
+    count, mean, m2 = 0, 0.0, 0.0
+    last = None
+    for start in range(0, len(timestamps), chunk_size):
+        chunk = timestamps[start:start + chunk_size]
+        chunk = chunk[~np.isnat(chunk)].astype("datetime64[s]").astype(np.int64)
+        if len(chunk) == 0:
+            continue
+        n_events += len(chunk)
+        #gap to the last message of the previous chunk is part of this chunk
+        gaps = np.diff(chunk if last is None else np.concatenate(([last], chunk))).astype(float)
+        last = chunk[-1]
+        count, mean, m2 = merge_interval_moments(count, mean, m2, gaps)
+    return burstiness_from_moments(count, mean, m2, n_events)
+
+def merge_interval_moments(count, mean, m2, gaps):
+    """Merges a batch of inter-event gaps into running (count, mean, M2) moments (Welford/Chan update)"""
+    gaps = np.asarray(gaps, dtype=float)
+    if len(gaps) == 0:
+        return count, mean, m2
+    batch_mean = gaps.mean()
+    batch_m2 = ((gaps - batch_mean) ** 2).sum()
+    total = count + len(gaps)
+    delta = batch_mean - mean
+    mean += delta * len(gaps) / total
+    m2 += batch_m2 + delta ** 2 * count * len(gaps) / total
+    return total, mean, m2
+
+def burstiness_from_moments(count, mean, m2, n_events):
+    """B1 and B2 from running inter-event moments (count gaps, mean, M2) of n_events events, same formulas as compute_burstiness"""
+    if n_events < 2 or count == 0 or mean == 0:
+        return (np.nan, np.nan)
+    r = np.sqrt(m2 / count) / mean
+    n = n_events
+    B1 = (r - 1) / (r + 1) if (r + 1) != 0 else np.nan
+    num = (np.sqrt(n + 1) * r) - np.sqrt(n - 1)
+    den = ((np.sqrt(n + 1) - 2) * r) + np.sqrt(n - 1)
+    B2 = num / den if den != 0 else np.nan
+    return (B1, B2)
+
+#Bootstrap confidence intervals, every block of replicates is one 2-D array (replicates x resampled values)
+#largest block built at once, bigger bootstraps are computed in several blocks
+BOOTSTRAP_BLOCK_CELLS = 1 << 22
+
+def replicate_blocks(n_boot, n_values):
+    rows = max(1, min(n_boot, BOOTSTRAP_BLOCK_CELLS // max(n_values, 1)))
+    return [(start, min(rows, n_boot - start)) for start in range(0, n_boot, rows)]
+
+def gini_replicates(values, n_boot=2000, seed=0):
+    """calculate_gini of n_boot resamples (with replacement) of the per-contact counts"""
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    replicates = np.zeros(n_boot)
+    if n == 0:
+        return replicates
+    rng = np.random.default_rng(seed)
+    ranks = np.arange(1, n + 1)
+    for start, rows in replicate_blocks(n_boot, n):
+        samples = np.sort(values[rng.integers(0, n, size=(rows, n))], axis=1)
+        total = samples.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gini = (2 * (samples @ ranks)) / (n * total) - (n + 1) / n
+        replicates[start:start + rows] = np.where(total == 0, 0.0, gini)
+    return replicates
+
+def burstiness_replicates(gaps, n_events, n_boot=2000, seed=0):
+    """(B1, B2) arrays of n_boot resamples (with replacement) of the inter-event gaps, same formulas as compute_burstiness"""
+    gaps = np.asarray(gaps, dtype=float)
+    B1 = np.full(n_boot, np.nan)
+    B2 = np.full(n_boot, np.nan)
+    if n_events < 2 or len(gaps) == 0:
+        return B1, B2
+    rng = np.random.default_rng(seed)
+    n = n_events
+    for start, rows in replicate_blocks(n_boot, len(gaps)):
+        samples = gaps[rng.integers(0, len(gaps), size=(rows, len(gaps)))]
+        mu = samples.mean(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = samples.std(axis=1) / mu
+            b1 = (r - 1) / (r + 1)
+            num = (np.sqrt(n + 1) * r) - np.sqrt(n - 1)
+            den = ((np.sqrt(n + 1) - 2) * r) + np.sqrt(n - 1)
+            b2 = np.where(den != 0, num / den, np.nan)
+        B1[start:start + rows] = np.where(mu > 0, b1, np.nan)
+        B2[start:start + rows] = np.where(mu > 0, b2, np.nan)
+    return B1, B2
+
+def percentile_interval(replicates, ci=0.95):
+    """(low, high) percentile interval of bootstrap replicates, NaN when no replicate is defined"""
+    replicates = np.asarray(replicates, dtype=float)
+    replicates = replicates[~np.isnan(replicates)]
+    if len(replicates) == 0:
+        return (np.nan, np.nan)
+    low, high = np.percentile(replicates, [50 * (1 - ci), 50 * (1 + ci)])
+    return (low, high)
+
+def gini_ci(counts, n_boot=2000, ci=0.95, seed=0):
+    """Bootstrap confidence interval of calculate_gini, counts is a {contact: count} mapping or an array of counts"""
+    values = list(counts.values()) if isinstance(counts, dict) else counts
+    return percentile_interval(gini_replicates(values, n_boot, seed), ci)
+
+def event_gaps(events):
+    """Inter-event gaps of events: in days for dates (like compute_burstiness), in seconds for datetime64 timestamps"""
+    events = event_values(events)
+    return np.diff(events), len(events)
+
+def burstiness_ci(events, n_boot=2000, ci=0.95, seed=0, max_cells=None):
+    """
+    Bootstrap confidence intervals ((B1 low, B1 high), (B2 low, B2 high)) of the burstiness of a chat's message days or timestamps.
+    max_cells caps resamples x gaps for interactive use: long (message-level) sequences then get fewer, but at least 200, resamples.
+    """
+    gaps, n_events = event_gaps(events)
+    if max_cells is not None:
+        n_boot = int(min(n_boot, max(200, max_cells // max(len(gaps), 1))))
+    B1, B2 = burstiness_replicates(gaps, n_events, n_boot, seed)
+    return percentile_interval(B1, ci), percentile_interval(B2, ci)
+
+def map_parallel(func, items, workers=None):
+    """func over items (e.g. one bootstrap per donor) in a thread pool, numpy releases the GIL in the array work"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, items))
+
+#Null-model tests of burstiness. B1 only depends on the gap distribution, so shuffling the gaps cannot change it:
+#B1 is tested against Poisson surrogates and the shuffled-gap surrogates test the memory coefficient M (correlation of consecutive gaps).
+#Sequences with the same number of gaps are scored together as one 3-D array (surrogates x sequences x gaps).
+#Surrogates are drawn in rounds and a sequence stops once both tails hold NULL_STOP_COUNT surrogates (sequential Monte Carlo
+#p-value, Besag & Clifford), so only sequences that may be significant get all n_surrogates.
+NULL_SURROGATES = 1000
+NULL_ROUND = 100
+NULL_STOP_COUNT = 10
+
+def _b1_rows(gaps):
+    #B1 along the last axis
+    mu = gaps.mean(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = gaps.std(axis=-1) / mu
+        return np.where(mu > 0, (r - 1) / (r + 1), np.nan)
+
+def _memory_rows(gaps):
+    #memory coefficient along the last axis: correlation of every gap with the next one
+    if gaps.shape[-1] < 2:
+        return np.full(gaps.shape[:-1], np.nan)
+    a = gaps[..., :-1] - gaps[..., :-1].mean(axis=-1, keepdims=True)
+    b = gaps[..., 1:] - gaps[..., 1:].mean(axis=-1, keepdims=True)
+    scale = np.sqrt((a * a).sum(axis=-1) * (b * b).sum(axis=-1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(scale > 0, (a * b).sum(axis=-1) / scale, np.nan)
+
+def _sequential_tail_counts(observed, surrogates, n_surrogates, length):
+    """
+    (surrogates >= observed, surrogates <= observed, surrogates drawn) per sequence.
+    surrogates(rows, ids) returns a (rows, len(ids)) array of the null statistic for the sequences ids, each of length gaps.
+    """
+    counts = np.zeros((3, len(observed)), dtype=np.int64)
+    active = ~np.isnan(observed)
+    for done in range(0, n_surrogates, NULL_ROUND):
+        ids = np.flatnonzero(active)
+        if len(ids) == 0:
+            break
+        for _, rows in replicate_blocks(min(NULL_ROUND, n_surrogates - done), len(ids) * length):
+            null = surrogates(rows, ids)
+            counts[:, ids] += np.stack([(null >= observed[ids]).sum(axis=0), (null <= observed[ids]).sum(axis=0), (~np.isnan(null)).sum(axis=0)])
+        active &= np.minimum(counts[0], counts[1]) < NULL_STOP_COUNT
+    return counts
+
+def _two_sided_p(counts, observed):
+    high, low, n = counts
+    tail = np.minimum(high, low)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        #stopped sequences: tail / surrogates drawn, the others: Monte Carlo (tail + 1) / (n + 1)
+        p = np.where(tail >= NULL_STOP_COUNT, 2 * tail / n, 2 * (tail + 1) / (n + 1))
+    return np.where(np.isnan(observed) | (n == 0), np.nan, np.minimum(1.0, p))
+
+def burstiness_null_test_grouped(groups, events, n_groups, n_surrogates=NULL_SURROGATES, seed=0):
+    """
+    Null-model tests for many event sequences at once.
+    groups and events must be sorted by (group, event), events are integers (days or seconds since epoch).
+    Poisson null: gaps of a Bernoulli process at the events' resolution (geometric gaps) with each sequence's
+    event count and mean gap, so the surrogates cover the same span on average. Sequences with 0 gaps (several events
+    at the same time) get geometric gaps that can be 0 as well.
+    Shuffled null: the sequence's own gaps in random order.
+    Returns a DataFrame with B1, p_poisson, M and p_shuffled per group (two-sided Monte Carlo p-values, NaN when undefined).
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    events = np.asarray(events, dtype=np.int64)
+    same = groups[1:] == groups[:-1]
+    gaps = np.diff(events)[same].astype(float)
+    gap_groups = groups[1:][same]
+    k = np.bincount(gap_groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(k)[:-1]))
+
+    def test_class(length):
+        #every length class has its own seed so results don't depend on thread scheduling
+        ids = np.flatnonzero(k == length)
+        class_gaps = gaps[starts[ids][:, None] + np.arange(length)]
+        rng = np.random.default_rng([seed, length])
+        b1, memory = _b1_rows(class_gaps), _memory_rows(class_gaps)
+        #geometric gaps by inversion with the sequence's mean gap: on 1, 2, ... (success probability 1 / mean), or on
+        #0, 1, ... (probability 1 / (1 + mean)) for sequences with 0 gaps, e.g. messages sent in the same second
+        shift = (class_gaps.min(axis=1) > 0).astype(float)[:, None]
+        with np.errstate(divide="ignore"):
+            log_q = np.log1p(-np.minimum(1.0, 1.0 / (class_gaps.mean(axis=1)[:, None] + 1 - shift)))
+        #all surrogate gaps equal (mean gap 1 on 1, 2, ...): no variance to compare with, p_poisson stays NaN
+        tested = np.where(np.isfinite(log_q[:, 0]), b1, np.nan)
+
+        def poisson(rows, sub):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return _b1_rows(np.floor(np.log1p(-rng.random((rows, len(sub), length))) / log_q[sub]) + shift[sub])
+
+        def shuffled(rows, sub):
+            return _memory_rows(rng.permuted(np.broadcast_to(class_gaps[sub], (rows, len(sub), length)), axis=-1))
+
+        return (ids, b1, _two_sided_p(_sequential_tail_counts(tested, poisson, n_surrogates, length), tested),
+                memory, _two_sided_p(_sequential_tail_counts(memory, shuffled, n_surrogates, length), memory))
+
+    result = pd.DataFrame(np.nan, index=np.arange(n_groups), columns=["B1", "p_poisson", "M", "p_shuffled"])
+    for ids, b1, p_poisson, memory, p_shuffled in map_parallel(test_class, np.unique(k[k > 0])):
+        result.loc[ids, "B1"] = b1
+        result.loc[ids, "p_poisson"] = p_poisson
+        result.loc[ids, "M"] = memory
+        result.loc[ids, "p_shuffled"] = p_shuffled
+    return result
+
+def event_values(events):
+    """Sorted integer event times: days since epoch for dates, seconds since epoch for datetime64 timestamps (NaT skipped)"""
+    events = np.asarray(events)
+    if np.issubdtype(events.dtype, np.datetime64):
+        return np.sort(events[~np.isnat(events)]).astype("datetime64[s]").astype(np.int64)
+    return pd.to_datetime(sorted(events)).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+def burstiness_null_test(events_by_chat, n_surrogates=NULL_SURROGATES, seed=0, max_cells=None, min_surrogates=200):
+    """
+    burstiness_null_test_grouped for all chats of a donor in one batch.
+    events_by_chat: Series of message days or timestamps per chat (indexed by conversation_id).
+    max_cells caps surrogates x gaps for interactive use: long (message-level) donors then get fewer, but at least
+    min_surrogates, surrogates.
+    Returns a DataFrame with B1, p_poisson, M and p_shuffled indexed like events_by_chat.
+    """
+    values = [event_values(events) for events in events_by_chat]
+    lengths = np.array([len(v) for v in values], dtype=np.int64)
+    groups = np.repeat(np.arange(len(values)), lengths)
+    events = np.concatenate(values) if len(values) else np.array([], dtype=np.int64)
+    if max_cells is not None:
+        n_surrogates = int(min(n_surrogates, max(min_surrogates, max_cells // max(len(events), 1))))
+    result = burstiness_null_test_grouped(groups, events, len(values), n_surrogates, seed)
+    result.index = events_by_chat.index
+    return result
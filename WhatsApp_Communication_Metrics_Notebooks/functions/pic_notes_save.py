@@ -1,6 +1,8 @@
 from dataloader import *
 
 def add_save_and_note_controls(fig, donor_id, chat_id, analysis_type, extra_tag=""):
+    import ipywidgets as widgets
+    from IPython.display import display, HTML
     save_btn = widgets.Button(description="Save Figure", button_style="success")
     note_text = widgets.Text(placeholder="Write a note...")
     note_btn = widgets.Button(description="Add Note", button_style="info")
@@ -0,0 +1,279 @@
+"""Metric planner — computes several metrics from a single pass over donor or cohort messages.
+Every metric declares the aggregations it is built from. The planner runs the union of those aggregations once
+over integer-coded rows and feeds each metric from the shared intermediates instead of re-scanning the messages per metric.
+Like functions/metrics.py this module only imports numpy and pandas.
+"""
+import numpy as np
+import pandas as pd
+
+from functions.metrics import calculate_gini_grouped, compute_burstiness_grouped, datetime_values
+from functions.metrics import burstiness_replicates, gini_replicates, map_parallel, percentile_interval
+from functions.metrics import burstiness_null_test_grouped, interaction_bias
+
+#Aggregations each metric needs
+#conversation_role = messages and words per conversation split by sender role (donor or contact)
+#conversation_day  = distinct days with donor messages per conversation
+#day_hour          = words sent by the donor per day and hour
+METRIC_AGGREGATIONS = {
+    "gini_messages": ["conversation_role"],
+    "gini_words": ["conversation_role"],
+    "interaction_balance": ["conversation_role"],
+    "burstiness": ["conversation_day"],
+    "burstiness_aggregate": ["conversation_day"],
+    "heatmap": ["day_hour"],
+    #bootstrap confidence intervals, computed per donor in parallel
+    "gini_messages_ci": ["conversation_role"],
+    "gini_words_ci": ["conversation_role"],
+    "burstiness_aggregate_ci": ["conversation_day"],
+    #null-model p-values of every chat, all chats of all donors in one batch
+    "burstiness_null": ["conversation_day"],
+}
+
+#resamples per donor for the *_ci metrics
+BOOTSTRAP_RESAMPLES = 2000
+
+def plan_metrics(metrics):
+    """Returns the minimal sorted list of aggregations needed for the requested metrics"""
+    unknown = [m for m in metrics if m not in METRIC_AGGREGATIONS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}. Available: {sorted(METRIC_AGGREGATIONS)}")
+    return sorted({agg for m in metrics for agg in METRIC_AGGREGATIONS[m]})
+
+def _encode_rows(df, row_donors):
+    """Integer-codes every row once. All aggregations below work on these codes only"""
+    row_donors = np.asarray(row_donors, dtype=object)
+    donor_codes, donor_index = pd.factorize(row_donors, sort=True)
+    conv_codes, conv_index = pd.factorize(df["conversation_id"], sort=True)
+    #(donor, conversation) pairs sorted by donor then conversation
+    pair_keys = donor_codes.astype(np.int64) * max(len(conv_index), 1) + conv_codes
+    pair_index, pair_codes = np.unique(pair_keys, return_inverse=True)
+
+    dt = datetime_values(df["dt"])
+    valid = ~np.isnat(dt)
+    days = dt.astype("datetime64[D]")
+    hours = (dt.astype("datetime64[h]") - days).astype(np.int64)
+    return {
+        "donor_index": donor_index,
+        "conv_index": conv_index,
+        "pair_index": pair_index,
+        "pair_codes": pair_codes.ravel(),
+        "pair_donor": pair_index // max(len(conv_index), 1),
+        "pair_conv": pair_index % max(len(conv_index), 1),
+        "sent": df["sender_id"].to_numpy() == row_donors,
+        "words": np.nan_to_num(df["word_count"].to_numpy(dtype=float)),
+        "valid": valid,
+        "days": days.astype(np.int64),
+        "hours": hours,
+    }
+
+def _aggregate_conversation_role(codes):
+    n = len(codes["pair_index"])
+    idx = codes["pair_codes"] * 2 + codes["sent"]
+    #column 0 = received from contacts, column 1 = sent by donor
+    return {
+        "messages": np.bincount(idx, minlength=2 * n).reshape(n, 2),
+        "words": np.bincount(idx, weights=codes["words"], minlength=2 * n).reshape(n, 2),
+    }
+
+def _aggregate_conversation_day(codes):
+    mask = codes["sent"] & codes["valid"]
+    pairs = codes["pair_codes"][mask]
+    days = codes["days"][mask]
+    if len(days) == 0:
+        return {"pairs": pairs, "days": days}
+    first_day = days.min()
+    span = days.max() - first_day + 1
+    keys = np.unique(pairs.astype(np.int64) * span + (days - first_day))
+    #unique keys are sorted by pair then day, which is what compute_burstiness_grouped expects
+    return {"pairs": keys // span, "days": keys % span + first_day}
+
+def _aggregate_day_hour(codes):
+    mask = codes["sent"] & codes["valid"]
+    donors = codes["pair_donor"][codes["pair_codes"][mask]]
+    days = codes["days"][mask]
+    if len(days) == 0:
+        return {"donors": donors, "days": days, "hours": days, "words": days.astype(float)}
+    first_day = days.min()
+    span = days.max() - first_day + 1
+    keys = (donors * span + (days - first_day)) * 24 + codes["hours"][mask]
+    cells, inverse = np.unique(keys, return_inverse=True)
+    words = np.bincount(inverse.ravel(), weights=codes["words"][mask], minlength=len(cells))
+    return {
+        "donors": cells // (24 * span),
+        "days": (cells // 24) % span + first_day,
+        "hours": cells % 24,
+        "words": words,
+    }
+
+AGGREGATIONS = {
+    "conversation_role": _aggregate_conversation_role,
+    "conversation_day": _aggregate_conversation_day,
+    "day_hour": _aggregate_day_hour,
+}
+
+def _gini(codes, shared, column):
+    sent_messages = shared["conversation_role"]["messages"][:, 1]
+    #only conversations where the donor sent something count as contacts (same as the gini dashboard)
+    has_sent = sent_messages > 0
+    values = shared["conversation_role"][column][has_sent, 1]
+    gini = calculate_gini_grouped(codes["pair_donor"][has_sent], values, len(codes["donor_index"]))
+    return pd.Series(gini, index=pd.Index(codes["donor_index"], name="donor_id"))
+
+def _interaction_balance(codes, shared):
+    words = shared["conversation_role"]["words"]
+    w_donor = words[:, 1]
+    w_contacts = words[:, 0]
+    return pd.DataFrame({
+        "donor_id": codes["donor_index"][codes["pair_donor"]],
+        "conversation_id": codes["conv_index"][codes["pair_conv"]],
+        "words_sent_by_donor": w_donor.astype(np.int64),
+        "words_sent_by_contacts": w_contacts.astype(np.int64),
+        "bias": interaction_bias(w_donor, w_contacts),
+    })
+
+def _burstiness(codes, shared):
+    pairs = shared["conversation_day"]["pairs"]
+    days = shared["conversation_day"]["days"]
+    B1, B2 = compute_burstiness_grouped(pairs, days, len(codes["pair_index"]))
+    has_days = np.bincount(pairs, minlength=len(codes["pair_index"])) > 0
+    index = pd.MultiIndex.from_arrays(
+        [codes["donor_index"][codes["pair_donor"][has_days]], codes["conv_index"][codes["pair_conv"][has_days]]],
+        names=["donor_id", "conversation_id"],
+    )
+    return pd.DataFrame({"B1": B1[has_days], "B2": B2[has_days]}, index=index).dropna(how="all")
+
+def _burstiness_null(codes, shared):
+    pairs = shared["conversation_day"]["pairs"]
+    result = burstiness_null_test_grouped(pairs, shared["conversation_day"]["days"], len(codes["pair_index"]))
+    has_days = np.bincount(pairs, minlength=len(codes["pair_index"])) > 0
+    result.index = pd.MultiIndex.from_arrays(
+        [codes["donor_index"][codes["pair_donor"]], codes["conv_index"][codes["pair_conv"]]],
+        names=["donor_id", "conversation_id"],
+    )
+    return result[has_days].dropna(how="all")
+
+def _donor_days(codes, shared):
+    #distinct days over all chats of a donor, derived from the per-chat distinct days (sorted by donor then day)
+    donors = codes["pair_donor"][shared["conversation_day"]["pairs"]]
+    days = shared["conversation_day"]["days"]
+    if len(days):
+        first_day = days.min()
+        span = days.max() - first_day + 1
+        keys = np.unique(donors * span + (days - first_day))
+        donors, days = keys // span, keys % span + first_day
+    return donors, days
+
+def _burstiness_aggregate(codes, shared):
+    donors, days = _donor_days(codes, shared)
+    B1, B2 = compute_burstiness_grouped(donors, days, len(codes["donor_index"]))
+    return pd.DataFrame({"B1": B1, "B2": B2}, index=pd.Index(codes["donor_index"], name="donor_id"))
+
+def _split_by_donor(donors, values, n_donors):
+    #values of each donor as slices, donors must be sorted
+    bounds = np.searchsorted(donors, np.arange(n_donors + 1))
+    return [values[bounds[i]:bounds[i + 1]] for i in range(n_donors)]
+
+def _gini_ci(codes, shared, column):
+    sent_messages = shared["conversation_role"]["messages"][:, 1]
+    has_sent = sent_messages > 0
+    per_donor = _split_by_donor(codes["pair_donor"][has_sent], shared["conversation_role"][column][has_sent, 1], len(codes["donor_index"]))
+    intervals = map_parallel(lambda values: percentile_interval(gini_replicates(values, BOOTSTRAP_RESAMPLES)), per_donor)
+    return pd.DataFrame(intervals, columns=["low", "high"], index=pd.Index(codes["donor_index"], name="donor_id"))
+
+def _burstiness_aggregate_ci(codes, shared):
+    donors, days = _donor_days(codes, shared)
+    per_donor = _split_by_donor(donors, days, len(codes["donor_index"]))
+
+    def interval(donor_days):
+        B1, B2 = burstiness_replicates(np.diff(donor_days), len(donor_days), BOOTSTRAP_RESAMPLES)
+        return percentile_interval(B1) + percentile_interval(B2)
+
+    intervals = map_parallel(interval, per_donor)
+    return pd.DataFrame(intervals, columns=["B1_low", "B1_high", "B2_low", "B2_high"], index=pd.Index(codes["donor_index"], name="donor_id"))
+
+def _heatmap(codes, shared):
+    cells = shared["day_hour"]
+    return pd.DataFrame({
+        "donor_id": codes["donor_index"][cells["donors"]],
+        "date": cells["days"].astype("datetime64[D]").astype("datetime64[ns]"),
+        "hour": cells["hours"],
+        "word_count": cells["words"],
+    })
+
+METRIC_BUILDERS = {
+    "gini_messages": lambda codes, shared: _gini(codes, shared, "messages"),
+    "gini_words": lambda codes, shared: _gini(codes, shared, "words"),
+    "interaction_balance": _interaction_balance,
+    "burstiness": _burstiness,
+    "burstiness_aggregate": _burstiness_aggregate,
+    "heatmap": _heatmap,
+    "gini_messages_ci": lambda codes, shared: _gini_ci(codes, shared, "messages"),
+    "gini_words_ci": lambda codes, shared: _gini_ci(codes, shared, "words"),
+    "burstiness_aggregate_ci": _burstiness_aggregate_ci,
+    "burstiness_null": _burstiness_null,
+}
+
+def run_metric_plan(messages, donations, metrics):
+    """
+    Computes the requested metrics for every donor in one pass over the cohort messages.
+    messages: DataFrame with donation_id, conversation_id, sender_id, dt, word_count
+    donations: DataFrame with donation_id and donor_id
+    Returns {metric: result} where results are keyed by donor_id:
+        gini_messages / gini_words  -> Series indexed by donor_id
+        interaction_balance         -> DataFrame, one row per (donor_id, conversation_id)
+        burstiness                  -> DataFrame with B1, B2 indexed by (donor_id, conversation_id)
+        burstiness_aggregate        -> DataFrame with B1, B2 indexed by donor_id
+        heatmap                     -> long DataFrame of (donor_id, date, hour, word_count) cells with activity
+        gini_*_ci                   -> DataFrame with bootstrap low, high indexed by donor_id
+        burstiness_aggregate_ci     -> DataFrame with B1_low, B1_high, B2_low, B2_high indexed by donor_id
+        burstiness_null             -> DataFrame with B1, p_poisson, M, p_shuffled indexed by (donor_id, conversation_id)
+    """
+    donation_to_donor = donations.drop_duplicates("donation_id").set_index("donation_id")["donor_id"]
+    row_donors = messages["donation_id"].map(donation_to_donor)
+    known = row_donors.notna().to_numpy()
+    if not known.all():
+        messages = messages[known]
+        row_donors = row_donors[known]
+    return _run(messages, row_donors.to_numpy(dtype=object), metrics)
+
+def _run(df, row_donors, metrics):
+    codes = _encode_rows(df, row_donors)
+    shared = {agg: AGGREGATIONS[agg](codes) for agg in plan_metrics(metrics)}
+    return {m: METRIC_BUILDERS[m](codes, shared) for m in metrics}
+
+def run_donor_metric_plan(donor_msgs, donor_id, metrics):
+    """
+    Same as run_metric_plan for the messages of a single donor, with results shaped like the single-donor functions:
+        gini_messages / gini_words  -> float (calculate_gini)
+        interaction_balance         -> DataFrame like compute_interaction_balance
+        burstiness                  -> DataFrame with B1, B2 indexed by conversation_id
+        burstiness_aggregate        -> (B1, B2) like compute_burstiness over all donor message days
+        heatmap                     -> grid of words per day (rows) and hour (columns 0-23)
+        gini_*_ci                   -> (low, high)
+        burstiness_aggregate_ci     -> ((B1 low, B1 high), (B2 low, B2 high))
+        burstiness_null             -> DataFrame with B1, p_poisson, M, p_shuffled indexed by conversation_id
+    """
+    results = _run(donor_msgs, np.full(len(donor_msgs), donor_id, dtype=object), metrics)
+    donor_results = {}
+    for metric, result in results.items():
+        if metric in ("gini_messages", "gini_words"):
+            donor_results[metric] = float(result.iloc[0]) if len(result) else 0.0
+        elif metric == "interaction_balance":
+            donor_results[metric] = result.drop(columns="donor_id")
+        elif metric in ("burstiness", "burstiness_null"):
+            donor_results[metric] = result.droplevel("donor_id")
+        elif metric == "burstiness_aggregate":
+            donor_results[metric] = (result["B1"].iloc[0], result["B2"].iloc[0]) if len(result) else (np.nan, np.nan)
+        elif metric in ("gini_messages_ci", "gini_words_ci"):
+            donor_results[metric] = tuple(result.iloc[0]) if len(result) else (np.nan, np.nan)
+        elif metric == "burstiness_aggregate_ci":
+            row = result.iloc[0] if len(result) else pd.Series(np.nan, index=result.columns)
+            donor_results[metric] = ((row["B1_low"], row["B1_high"]), (row["B2_low"], row["B2_high"]))
+        elif metric == "heatmap":
+            if result.empty:
+                donor_results[metric] = pd.DataFrame(columns=np.arange(0, 24))
+                continue
+            grid = result.pivot_table(index="date", columns="hour", values="word_count", aggfunc="sum")
+            all_dates = pd.date_range(result["date"].min(), result["date"].max(), freq="D")
+            donor_results[metric] = grid.reindex(index=all_dates, columns=np.arange(0, 24), fill_value=0).fillna(0)
+    return donor_results
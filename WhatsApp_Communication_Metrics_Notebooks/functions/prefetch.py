@@ -0,0 +1,87 @@
+"""Background prefetch of the donors that follow the current one in a dashboard's donor dropdown.
+Researchers usually step through donors in dropdown order, so after a donor is loaded the next few donors of the current
+dropdown options (all donors or the search results) are loaded and precomputed on a background thread.
+Jumping to another donor cancels the prefetches that have not started yet.
+Only the data loading and metric computation run in the background, widgets and figures stay on the notebook thread.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+#number of following donors prefetched by the dashboards, WHATSAPP_PREFETCH_DEPTH=0 turns prefetching off
+PREFETCH_DEPTH = int(os.environ.get("WHATSAPP_PREFETCH_DEPTH", 2))
+
+def create_prefetcher(load, depth=PREFETCH_DEPTH, keep=None):
+    """
+    Per-donor results of load(donor) with background prefetch. load must not touch widgets or figures.
+    depth: number of following donors to prefetch (0 = load only on request)
+    keep: number of results kept in memory (default depth + 8), least recently used are dropped first
+    Returns a dict with the functions
+        get(donor): load(donor), taken from a finished or running prefetch when there is one,
+        prefetch_after(donor, options): prefetches the depth donors after donor in options (the dropdown order)
+            and cancels pending prefetches of other donors,
+        cancel(): cancels all pending prefetches,
+        ready(donor): whether the result of donor is loaded, so get(donor) returns without waiting.
+    """
+    keep = depth + 8 if keep is None else keep
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="donor-prefetch") if depth > 0 else None
+    #donor -> Future (finished, running or pending), most recently used last
+    futures = OrderedDict()
+    lock = threading.Lock()
+
+    def trim():
+        #drops the least recently used finished results beyond keep
+        finished = [donor for donor, future in futures.items() if future.done()]
+        for donor in finished[:max(0, len(futures) - keep)]:
+            del futures[donor]
+
+    def get(donor):
+        with lock:
+            future = futures.pop(donor, None)
+            #a prefetch still waiting in the queue is cancelled and loaded right away instead
+            if future is not None and future.cancel():
+                future = None
+        if future is not None:
+            try:
+                result = future.result()
+            except Exception:
+                #failed prefetch, loaded again here so the error (if any) reaches the dashboard
+                result = load(donor)
+        else:
+            result = load(donor)
+        #kept as a finished future, so the next get() treats it like a prefetched result
+        done = Future()
+        done.set_result(result)
+        with lock:
+            futures[donor] = done
+            trim()
+        return result
+
+    def prefetch_after(donor, options):
+        if executor is None:
+            return
+        options = list(options)
+        start = options.index(donor) + 1 if donor in options else len(options)
+        upcoming = options[start:start + depth]
+        with lock:
+            for other, future in list(futures.items()):
+                if other not in upcoming and future.cancel():
+                    del futures[other]
+            for other in upcoming:
+                if other not in futures:
+                    futures[other] = executor.submit(load, other)
+            trim()
+
+    def cancel():
+        with lock:
+            for other, future in list(futures.items()):
+                if future.cancel():
+                    del futures[other]
+
+    def ready(donor):
+        with lock:
+            future = futures.get(donor)
+            return future is not None and future.done() and not future.cancelled() and future.exception() is None
+
+    return {"get": get, "prefetch_after": prefetch_after, "cancel": cancel, "ready": ready}
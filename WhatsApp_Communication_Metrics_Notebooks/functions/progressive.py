@@ -0,0 +1,96 @@
+"""Progressive rendering of donors with very many messages.
+When loading a donor is expected to take longer than the latency budget (its message count times the measured loading
+time per message), the dashboard first draws a preview from a stratified sample of the donor's messages
+(donor_message_sample in dataloader.py), then loads the exact result on a background thread and replaces the preview
+with the exact figure. A status line tells which of the two is shown. If the background load fails, the preview is replaced
+by the error instead. The preview is drawn before the background load
+starts, so the two do not compete for the interpreter. The exact figure is drawn on the notebook thread: the background
+thread only schedules it on the kernel's event loop, widgets and figures are never touched from another thread.
+Outside a running kernel (scripts) the dashboards always load the exact result and never show a preview.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from dataloader import *
+
+#seconds a donor may take to load before a preview is drawn first, WHATSAPP_PREVIEW_BUDGET=-1 turns previews off
+PREVIEW_BUDGET = float(os.environ.get("WHATSAPP_PREVIEW_BUDGET", 0.5))
+#messages in the stratified sample of a preview
+PREVIEW_MESSAGES = int(os.environ.get("WHATSAPP_PREVIEW_MESSAGES", 20000))
+#loading time per message assumed until a dashboard has measured its own
+SECONDS_PER_MESSAGE = 1e-6
+
+EXACT_STATUS = "<b style='color:green;'>Exact</b> — all messages."
+
+def notebook_loop():
+    #event loop of the notebook thread while a kernel is running (widget callbacks and cells run in it), else None
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def scale_sample(sample, columns=("word_count",)):
+    """Sampled messages with the summed columns multiplied by their sample_weight, so sums over them estimate the sums over all messages"""
+    return sample.assign(**{column: sample[column] * sample["sample_weight"] for column in columns})
+
+def preview_status(sample):
+    #status line of a preview drawn from sample (a donor_message_sample frame)
+    total = round(sample["sample_weight"].sum()) if len(sample) else 0
+    return (f"<b style='color:darkorange;'>Preview</b> — stratified sample of {len(sample):,} of {total:,} messages, "
+            f"word counts scaled up. The exact figure is being computed…")
+
+def create_progressive_loader(prefetcher, budget=PREVIEW_BUDGET):
+    """
+    Progressive donor loading on top of a prefetcher (see create_prefetcher).
+    Returns a dict with the function
+        load(donor, show_exact, show_preview, show_error): calls show_exact(prefetcher["get"](donor), refined) on the
+            notebook thread. If the donor is not loaded yet and is expected to take longer than budget seconds,
+            show_preview() is called first and show_exact follows with refined=True when the background load is done,
+            or show_error(exception) if it failed, unless another donor was loaded in the meantime.
+    """
+    #one background load at a time, loads of donors that were skipped before they started are cancelled
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="donor-refine")
+    state = {"donor": None, "future": None, "seconds_per_message": SECONDS_PER_MESSAGE}
+
+    def timed_get(donor, messages):
+        #loads the donor and keeps the measured loading time per message for the next estimates
+        start = perf_counter()
+        result = prefetcher["get"](donor)
+        if messages:
+            state["seconds_per_message"] = (perf_counter() - start) / messages
+        return result
+
+    def load(donor, show_exact, show_preview, show_error):
+        if state["future"] is not None:
+            state["future"].cancel()
+            state["future"] = None
+        state["donor"] = donor
+        loop = notebook_loop()
+        if loop is None or budget < 0 or prefetcher["ready"](donor):
+            show_exact(prefetcher["get"](donor), False)
+            return
+        messages = donor_message_count(donor)
+        if messages * state["seconds_per_message"] <= budget:
+            show_exact(timed_get(donor, messages), False)
+            return
+        show_preview()
+        future = state["future"] = executor.submit(timed_get, donor, messages)
+
+        def refine(done):
+            #on the notebook thread, only if the donor is still the one shown
+            if done.cancelled() or state["donor"] != donor or state["future"] is not done:
+                return
+            state["future"] = None
+            try:
+                result = done.result()
+            except Exception as error:
+                #raised here it would only reach the event loop's log and the preview would stay on screen
+                show_error(error)
+                return
+            show_exact(result, True)
+
+        future.add_done_callback(lambda done: loop.call_soon_threadsafe(refine, done))
+
+    return {"load": load}
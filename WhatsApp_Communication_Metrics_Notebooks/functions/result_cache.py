@@ -0,0 +1,118 @@
+"""Persistent result cache — metric results and figures survive kernel restarts.
+Results are pickled into the outputs folder under a content-addressed key: a fingerprint of the input files, a fingerprint
+of the code, a result name and its parameters (donor, chat, date range, threshold, metric, ...). Reading an entry marks it
+as recently used, and the least recently used entries are evicted once the cache grows beyond CACHE_MAX_BYTES.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+from pathlib import Path
+
+from dataloader import *
+
+CACHE_DIR = Path(os.environ.get("WHATSAPP_CACHE_DIR", OUTPUT_DIR / "cache"))
+CACHE_MAX_BYTES = int(os.environ.get("WHATSAPP_CACHE_MAX_BYTES", 1 << 30))
+#WHATSAPP_CACHE=0 turns the cache off (every call computes)
+CACHE_ENABLED = os.environ.get("WHATSAPP_CACHE", "1") != "0"
+
+def _file_fingerprints(paths):
+    #(path, size, modification time) of every existing file, changes whenever a file is replaced or edited
+    stats = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stats.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return stats
+
+def data_version():
+    """Fingerprint of the input data (donations, messages CSV and Parquet files)"""
+    parquet = sorted(glob.glob(MESSAGES_PARQUET)) if MESSAGES_PARQUET else []
+    return hashlib.sha256(json.dumps(_file_fingerprints([DONATION_CSV, MESSAGES_CSV] + parquet)).encode()).hexdigest()
+
+def code_version():
+    """Fingerprint of the analysis code and the numpy/pandas versions, so results of changed code are never reused"""
+    root = Path(__file__).resolve().parent.parent
+    digest = hashlib.sha256(f"{np.__version__} {pd.__version__}".encode())
+    for path in sorted(root.glob("*.py")) + sorted(root.glob("functions/*.py")):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+DATA_VERSION = data_version()
+CODE_VERSION = code_version()
+
+def cache_key(name, **params):
+    """Content-addressed key of a result: data version, code version, result name and parameters"""
+    payload = json.dumps([DATA_VERSION, CODE_VERSION, name, sorted(params.items())], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _path(key):
+    return CACHE_DIR / key[:2] / f"{key}.pkl"
+
+def cache_load(key):
+    """(True, value) for a cached key, (False, None) otherwise. A hit marks the entry as recently used"""
+    path = _path(key)
+    try:
+        with path.open("rb") as f:
+            value = pickle.load(f)
+        os.utime(path)
+        return True, value
+    except FileNotFoundError:
+        return False, None
+    except Exception:
+        #unreadable entry (e.g. interrupted write by an older version), computed again
+        path.unlink(missing_ok=True)
+        return False, None
+
+def cache_store(key, value):
+    """Writes value under key (atomic, so other kernels and threads never read a partial entry) and evicts old entries over the budget"""
+    path = _path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    evict()
+
+def evict(max_bytes=None):
+    """Deletes least recently used entries until the cache is at most max_bytes (default CACHE_MAX_BYTES)"""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for path in CACHE_DIR.glob("*/*.pkl"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+def clear_cache():
+    """Deletes all cached results"""
+    evict(0)
+
+def cached(name, compute, **params):
+    """compute() memoized on disk under name and params (which must identify everything compute depends on besides the data)"""
+    if not CACHE_ENABLED:
+        return compute()
+    key = cache_key(name, **params)
+    hit, value = cache_load(key)
+    if not hit:
+        value = compute()
+        cache_store(key, value)
+    return value
+
+def cached_figure(name, draw, **params):
+    """
+    cached() for a function returning a matplotlib figure (or None). A cached figure is restored into pyplot,
+    so it is shown and saved like a newly drawn one.
+    """
+    matplotlib = sys.modules.get("matplotlib")
+    return cached(name, draw, matplotlib=getattr(matplotlib, "__version__", None), **params)
@@ -0,0 +1,144 @@
+"""Multi-resolution tile pyramid for long-range day heatmaps.
+A donor's day grid (rows = days, columns = hours or chats) is aggregated once into day, week and month levels. Each
+level is split into tiles of TILE_PERIODS rows. A heatmap picks the finest level whose periods in the shown date range
+fit the pixel width of the axes, and reads only the tiles that overlap that range, so multi-year views draw a few
+hundred weeks or months and zooming into a month reads one or two day tiles instead of regrouping messages.
+Coarser cells are the maximum of their days: for the words grid the largest daily word count of the hour, for the chat
+activity grid the union of the sent (1) and received (2) bits of the period.
+"""
+import numpy as np
+import pandas as pd
+
+from functions.metrics import datetime_values
+
+LEVELS = ["day", "week", "month"]
+#rows (periods) per tile
+TILE_PERIODS = 256
+#tick label format of the period starts of each level
+LEVEL_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-%m-%d", "month": "%Y-%m"}
+
+def _period_starts(days, level):
+    #first day of the day / week (Monday) / month period of every day number
+    if level == "day":
+        return days
+    if level == "week":
+        #day 0 (1970-01-01) is a Thursday
+        return days - (days + 3) % 7
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+def build_pyramid(first_day, grid, active, columns=None, combine=np.maximum):
+    """
+    Pyramid of a day grid.
+    first_day: day number (days since 1970-01-01) of the first row, grid: array of shape (n_days, n_columns),
+    active: messages per day (rows without messages are trimmed from the edges of a shown range), columns: column labels,
+    combine: numpy ufunc that combines the cells of the days of a period (np.bitwise_or for bit grids)
+    """
+    days = first_day + np.arange(len(grid), dtype=np.int64)
+    pyramid = {"columns": columns, "active_days": days[active > 0], "combine": combine, "levels": {}}
+    for level in LEVELS:
+        period_starts = _period_starts(days, level)
+        bounds = np.flatnonzero(np.diff(period_starts, prepend=period_starts[0] - 1))
+        level_grid = combine.reduceat(grid, bounds, axis=0) if len(grid) else grid
+        level_active = np.add.reduceat(active, bounds) if len(active) else active
+        pyramid["levels"][level] = {
+            "starts": period_starts[bounds],
+            "tiles": [level_grid[i:i + TILE_PERIODS] for i in range(0, len(bounds), TILE_PERIODS)],
+            "active_tiles": [level_active[i:i + TILE_PERIODS] for i in range(0, len(bounds), TILE_PERIODS)],
+        }
+    return pyramid
+
+def _day_keys(df):
+    #day numbers and hours of the rows with a datetime, and the mask of those rows
+    dt = datetime_values(df["dt"])
+    valid = ~np.isnat(dt)
+    days = dt[valid].astype("datetime64[D]")
+    hours = (dt[valid].astype("datetime64[h]") - days).astype(np.int64)
+    return days.astype(np.int64), hours, valid
+
+def words_pyramid(df):
+    """Pyramid of the words per day and hour (24 columns) of the messages in df, None without dated messages"""
+    days, hours, valid = _day_keys(df)
+    if len(days) == 0:
+        return None
+    words = np.nan_to_num(df["word_count"].to_numpy(dtype=float)[valid])
+    first_day = days.min()
+    n_days = days.max() - first_day + 1
+    grid = np.bincount((days - first_day) * 24 + hours, weights=words, minlength=n_days * 24).reshape(n_days, 24)
+    return build_pyramid(first_day, grid, np.bincount(days - first_day, minlength=n_days), columns=np.arange(24))
+
+def chats_pyramid(df, donor_id):
+    """
+    Pyramid of the chat activity per day (one column per chat, sorted by conversation_id) of the messages in df,
+    with bit 1 = the donor sent a message, bit 2 = a contact sent a message. None without dated messages.
+    """
+    days, _, valid = _day_keys(df)
+    chats = df["conversation_id"].to_numpy(dtype=object)[valid]
+    sent = (df["sender_id"] == donor_id).to_numpy()[valid]
+    codes, chat_index = pd.factorize(chats, sort=True)
+    keep = codes >= 0
+    days, codes, sent = days[keep], codes[keep], sent[keep]
+    if len(days) == 0:
+        return None
+    first_day = days.min()
+    n_days, n_chats = days.max() - first_day + 1, len(chat_index)
+    cells = (days - first_day) * n_chats + codes
+    grid = ((np.bincount(cells[sent], minlength=n_days * n_chats) > 0)
+            + 2 * (np.bincount(cells[~sent], minlength=n_days * n_chats) > 0)).astype(np.uint8).reshape(n_days, n_chats)
+    return build_pyramid(first_day, grid, np.bincount(days - first_day, minlength=n_days),
+                         columns=np.asarray(chat_index, dtype=object), combine=np.bitwise_or)
+
+def _day_number(date, default):
+    return default if date is None else np.datetime64(pd.Timestamp(date).date(), "D").astype(np.int64)
+
+def data_range(pyramid, start=None, end=None):
+    """(first, last) day number with messages between start and end (inclusive, default unbounded), None if there are none"""
+    active_days = pyramid["active_days"]
+    lo = np.searchsorted(active_days, _day_number(start, active_days[0]), side="left")
+    hi = np.searchsorted(active_days, _day_number(end, active_days[-1]), side="right")
+    if hi <= lo:
+        return None
+    return active_days[lo], active_days[hi - 1]
+
+def _period_range(level, first, last):
+    starts = level["starts"]
+    return max(np.searchsorted(starts, first, side="right") - 1, 0), np.searchsorted(starts, last, side="right")
+
+def pick_level(pyramid, first, last, pixels):
+    """Finest level with at most one period per pixel between the day numbers first and last"""
+    for name in LEVELS:
+        lo, hi = _period_range(pyramid["levels"][name], first, last)
+        if hi - lo <= pixels:
+            return name
+    return LEVELS[-1]
+
+def _read_rows(level, lo, hi):
+    #rows lo..hi (exclusive) of a level, from the overlapping tiles only
+    tiles = range(lo // TILE_PERIODS, (hi - 1) // TILE_PERIODS + 1)
+    offset = tiles[0] * TILE_PERIODS
+    grid = np.concatenate([level["tiles"][t] for t in tiles])[lo - offset:hi - offset]
+    active = np.concatenate([level["active_tiles"][t] for t in tiles])[lo - offset:hi - offset]
+    return grid, active
+
+def read_window(pyramid, level, first, last):
+    """
+    Periods of a level that overlap the day numbers first..last, read from the overlapping tiles only.
+    A first or last week or month that is only partly inside first..last is aggregated from its days in the window.
+    Returns (period starts as a DatetimeIndex, grid of shape (n_periods, n_columns), messages per period).
+    """
+    name, level = level, pyramid["levels"][level]
+    lo, hi = _period_range(level, first, last)
+    grid, active = _read_rows(level, lo, hi)
+    starts = level["starts"]
+    if name != "day":
+        days = pyramid["levels"]["day"]
+        first_day, last_day = days["starts"][0], days["starts"][-1]
+        grid, active = grid.copy(), active.copy()
+        for row in {0, hi - lo - 1}:
+            period_first = starts[lo + row]
+            period_last = starts[lo + row + 1] - 1 if lo + row + 1 < len(starts) else last_day
+            a, b = max(period_first, first, first_day), min(period_last, last, last_day)
+            if (a, b) != (period_first, period_last):
+                day_grid, day_active = _read_rows(days, a - first_day, b - first_day + 1)
+                grid[row] = pyramid["combine"].reduce(day_grid, axis=0)
+                active[row] = day_active.sum()
+    return pd.DatetimeIndex(starts[lo:hi].astype("datetime64[D]")), grid, active
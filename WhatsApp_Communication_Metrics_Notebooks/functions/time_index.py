@@ -0,0 +1,75 @@
+"""Sorted time index for a donor's messages.
+The rows are sorted once by (conversation_id, dt) when a donor is loaded and per-conversation offsets are recorded.
+Date windows are then resolved with searchsorted into contiguous row ranges instead of boolean masks over the full history.
+Windows over all chats use a second copy of the rows sorted by dt only, built on the first such window.
+"""
+import numpy as np
+import pandas as pd
+
+from functions.metrics import datetime_values
+
+def build_time_index(df):
+    """
+    Sorts df by (conversation_id, dt) and records where every conversation starts.
+    Returns a dict used by time_window(). Rows without a conversation_id form their own group.
+    """
+    conv_codes, conv_index = pd.factorize(df["conversation_id"], sort=True)
+    #NaT becomes the smallest int64 so it sorts first and never falls inside a date window
+    times = datetime_values(df["dt"]).view(np.int64)
+    #group 0 = missing conversation_id, group c+1 = conversation code c
+    groups = conv_codes + 1
+    order = np.lexsort((times, groups))
+    groups = groups[order]
+    return {
+        "df": df.iloc[order],
+        "times": times[order],
+        "conv_index": conv_index,
+        "offsets": np.searchsorted(groups, np.arange(len(conv_index) + 2)),
+    }
+
+def _group_window(index, group, start_ns, end_ns):
+    lo, hi = index["offsets"][group], index["offsets"][group + 1]
+    times = index["times"][lo:hi]
+    return lo + np.searchsorted(times, start_ns, side="left"), lo + np.searchsorted(times, end_ns, side="left")
+
+def _by_time(index):
+    #rows of all chats sorted by dt (NaT first), kept in the index after the first window over all chats
+    if "by_time" not in index:
+        order = np.argsort(index["times"], kind="stable")
+        index["by_time"] = {"df": index["df"].iloc[order], "times": index["times"][order]}
+    return index["by_time"]
+
+def time_window(index, start, end, chat="ALL"):
+    """
+    Messages between the start and end dates (both inclusive) for one chat or all chats.
+    Both are a contiguous slice (no copy) located with one searchsorted pair: a single chat in the
+    (conversation_id, dt) order, "ALL" in the dt order of all rows.
+    """
+    df = index["df"]
+    if start is None or end is None:
+        return df.iloc[0:0]
+    start_ns = pd.Timestamp(start).value
+    end_ns = (pd.Timestamp(end) + pd.Timedelta(days=1)).value
+
+    if chat != "ALL":
+        if chat not in index["conv_index"]:
+            return df.iloc[0:0]
+        a, b = _group_window(index, index["conv_index"].get_loc(chat) + 1, start_ns, end_ns)
+        return df.iloc[a:b]
+
+    by_time = _by_time(index)
+    a, b = np.searchsorted(by_time["times"], [start_ns, end_ns], side="left")
+    return by_time["df"].iloc[a:b]
+
+def event_times_by_chat(index):
+    """
+    Sorted message timestamps of every chat as datetime64 views into the index (no copies).
+    Missing timestamps sort first inside a chat and are skipped.
+    """
+    times = index["times"]
+    events = {}
+    for code, chat in enumerate(index["conv_index"]):
+        lo, hi = index["offsets"][code + 1], index["offsets"][code + 2]
+        lo += np.searchsorted(times[lo:hi], np.iinfo(np.int64).min, side="right")
+        events[chat] = times[lo:hi].view("datetime64[ns]")
+    return events
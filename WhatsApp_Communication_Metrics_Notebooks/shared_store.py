@@ -0,0 +1,113 @@
+"""Shared-memory data host for dataloader.py.
+One host process loads the columnar store (see columnar_store.py) once into named multiprocessing.shared_memory blocks,
+and every notebook kernel attaches to those blocks read-only by name instead of loading its own copy of the messages.
+Start the host from this folder with
+
+    python shared_store.py
+
+and select it in the notebooks with the WHATSAPP_DATA_BACKEND=shared environment variable. The blocks are removed when
+the host stops (Ctrl+C or SIGTERM).
+"""
+import json
+import os
+import signal
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from columnar_store import COLUMNS, TABLES
+
+#prefix of the block names, the manifest block lists the arrays and their dtypes and shapes
+SHARED_NAME = os.environ.get("WHATSAPP_SHARED_NAME", "whatsapp_metrics")
+ARRAYS = list(COLUMNS) + TABLES + ["donor_offsets"]
+
+def _block_name(name, array):
+    return f"{name}_{array}"
+
+def _attach(block):
+    #attached blocks are not registered with this process's resource tracker, which would otherwise
+    #remove them from the host when the kernel exits (track=False needs Python 3.13)
+    try:
+        return shared_memory.SharedMemory(name=block, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=block)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def publish_store(store, name=SHARED_NAME):
+    """
+    Copies the arrays of an opened columnar store into shared memory blocks named after name and returns the blocks.
+    The manifest block is written last, so kernels never attach to a partly copied store.
+    """
+    blocks, manifest = [], {}
+    try:
+        for array in ARRAYS:
+            values = np.asarray(store[array])
+            shm = shared_memory.SharedMemory(name=_block_name(name, array), create=True, size=max(values.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(values.shape, values.dtype, buffer=shm.buf)[...] = values
+            manifest[array] = {"dtype": values.dtype.str, "shape": values.shape}
+        payload = json.dumps(manifest).encode()
+        shm = shared_memory.SharedMemory(name=_block_name(name, "manifest"), create=True, size=len(payload))
+        blocks.append(shm)
+        shm.buf[:len(payload)] = payload
+    except BaseException:
+        unpublish(blocks)
+        raise
+    return blocks
+
+def unpublish(blocks):
+    """Closes and removes the blocks of publish_store"""
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+def attach_store(name=SHARED_NAME):
+    """
+    Store published by the host under name, with read-only arrays backed by the shared blocks (no copy).
+    It has the same keys as columnar_store.open_store, so the columnar_store functions work on it unchanged.
+    """
+    try:
+        shm = _attach(_block_name(name, "manifest"))
+    except FileNotFoundError:
+        raise RuntimeError(f"No shared dataset '{name}', start the data host with 'python shared_store.py'") from None
+    #the manifest block can be larger than its JSON (page-rounded on some platforms)
+    manifest = json.loads(bytes(shm.buf).rstrip(b"\0"))
+    shm.close()
+
+    blocks, store = [], {}
+    for array, spec in manifest.items():
+        shm = _attach(_block_name(name, array))
+        blocks.append(shm)
+        values = np.ndarray(tuple(spec["shape"]), np.dtype(spec["dtype"]), buffer=shm.buf)
+        values.flags.writeable = False
+        store[array] = values
+    #the blocks stay open as long as the store (and the arrays viewing them) is referenced
+    store["shared_blocks"] = blocks
+    store["donor_code"] = {donor: code for code, donor in enumerate(store["donors"])}
+    return store
+
+def serve(name=SHARED_NAME):
+    """Loads the columnar store once, publishes it under name and keeps it available until the process is stopped"""
+    #the host always reads the columnar store, whatever backend the notebooks are configured with
+    os.environ["WHATSAPP_DATA_BACKEND"] = "columnar"
+    import dataloader
+
+    blocks = publish_store(dataloader.store, name)
+    size = sum(shm.size for shm in blocks)
+    print(f"Serving {len(dataloader.store['ts'])} messages as '{name}' ({size / 2**20:.1f} MiB), Ctrl+C to stop")
+    sys.stdout.flush()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        unpublish(blocks)
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else SHARED_NAME)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+#the notebooks import functions.* from the notebook folder, the tests do the same
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
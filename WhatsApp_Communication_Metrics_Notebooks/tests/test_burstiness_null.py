@@ -0,0 +1,33 @@
+"""The Poisson null model of burstiness_null_test_grouped must not call Poisson-like sequences significant."""
+import numpy as np
+import pytest
+
+from functions.metrics import burstiness_null_test_grouped
+
+def null_test(*gap_sequences, seed=0):
+    #events from gaps, one group per sequence
+    events = [np.concatenate(([0], np.cumsum(gaps))) for gaps in gap_sequences]
+    groups = np.repeat(np.arange(len(events)), [len(e) for e in events])
+    return burstiness_null_test_grouped(groups, np.concatenate(events), len(events), seed=seed)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_poisson_sequences_are_not_significant(seed):
+    rng = np.random.default_rng(seed)
+    gaps = rng.geometric(1 / 20, 300)
+    #the same kind of sequence at a coarser resolution, with many 0 gaps (events in the same second or day)
+    zero_gaps = rng.geometric(1 / 3, 300) - 1
+    assert (zero_gaps == 0).sum() > 50
+    result = null_test(gaps, zero_gaps, seed=seed)
+    assert (result["p_poisson"] > 0.01).all(), result
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_clustered_sequence_is_significant(seed):
+    rng = np.random.default_rng(seed)
+    #mostly 0 and 1 gaps inside bursts, separated by long pauses
+    gaps = np.where(rng.random(300) < 0.1, rng.geometric(1 / 400, 300), rng.geometric(1 / 2, 300) - 1)
+    assert null_test(gaps, seed=seed)["p_poisson"].iloc[0] < 0.01
+
+def test_equal_gaps_have_no_poisson_p_value():
+    #mean gap 1 without 0 gaps leaves no surrogate variance
+    result = null_test(np.ones(50, dtype=np.int64))
+    assert result["B1"].iloc[0] == -1 and np.isnan(result["p_poisson"].iloc[0])
@@ -0,0 +1,147 @@
+"""The planner, grouped and incremental metric paths must give the same results as the scalar reference functions."""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions import incremental
+from functions.incremental import DonorMetricState, RankSumTree, rolling_gini
+from functions.metrics import (calculate_gini, calculate_gini_grouped, classify_b1, classify_b1_grouped,
+                               compute_burstiness, compute_burstiness_grouped, compute_burstiness_streaming,
+                               compute_interaction_balance)
+from functions.planner import run_donor_metric_plan, run_metric_plan
+
+DONORS = ["d0", "d1", "d2"]
+
+def random_messages(seed, n=3000):
+    #messages of a few donors, each with chats of very different sizes and some repeated days
+    rng = np.random.default_rng(seed)
+    donations = pd.DataFrame({"donation_id": [f"don{i}" for i in range(len(DONORS))], "donor_id": DONORS,
+                              "source": "WhatsApp"})
+    donor = rng.integers(0, len(DONORS), n)
+    chat = rng.zipf(1.6, n) % 12
+    dt = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 200 * 86400, n), unit="s")
+    own = rng.random(n) < 0.4
+    messages = pd.DataFrame({
+        "donation_id": donations["donation_id"].to_numpy()[donor],
+        "conversation_id": [f"c{d}_{c}" for d, c in zip(donor, chat)],
+        "sender_id": np.where(own, np.array(DONORS)[donor], [f"p{c}" for c in chat]),
+        "dt": dt,
+        "word_count": rng.integers(0, 40, n),
+    })
+    return messages.assign(date_only=messages["dt"].dt.date, hour=messages["dt"].dt.hour), donations
+
+def donor_messages(messages, donations, donor):
+    return messages[messages["donation_id"].isin(donations.loc[donations["donor_id"] == donor, "donation_id"])]
+
+def reference_burstiness(sent):
+    days = sent.groupby("conversation_id")["date_only"].apply(lambda s: sorted(set(s)))
+    table = pd.DataFrame(days.apply(compute_burstiness).tolist(), index=days.index, columns=["B1", "B2"])
+    return table.dropna(how="all")
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_planner_matches_reference(seed):
+    messages, donations = random_messages(seed)
+    metrics = ["gini_messages", "gini_words", "interaction_balance", "burstiness", "burstiness_aggregate", "heatmap"]
+    cohort = run_metric_plan(messages, donations, metrics)
+    for donor in DONORS:
+        dm = donor_messages(messages, donations, donor)
+        sent = dm[dm["sender_id"] == donor]
+        result = run_donor_metric_plan(dm, donor, metrics)
+        gini_messages = calculate_gini(sent.groupby("conversation_id").size().to_dict())
+        gini_words = calculate_gini(sent.groupby("conversation_id")["word_count"].sum().to_dict())
+        assert np.isclose(result["gini_messages"], gini_messages)
+        assert np.isclose(result["gini_words"], gini_words)
+        assert np.isclose(cohort["gini_messages"][donor], gini_messages)
+        pd.testing.assert_frame_equal(result["interaction_balance"].reset_index(drop=True),
+                                      compute_interaction_balance(dm, donor), check_dtype=False)
+        pd.testing.assert_frame_equal(result["burstiness"], reference_burstiness(sent), check_names=False)
+        assert np.allclose(result["burstiness_aggregate"], compute_burstiness(sorted(set(sent["date_only"]))),
+                           equal_nan=True)
+        grid = sent.groupby(["date_only", "hour"])["word_count"].sum().unstack(fill_value=0)
+        grid = grid.reindex(index=pd.date_range(sent["date_only"].min(), sent["date_only"].max()),
+                            columns=np.arange(24), fill_value=0)
+        assert np.allclose(grid.to_numpy(), result["heatmap"].to_numpy())
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_grouped_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    n_groups = 40
+    #group sizes 0..59, so empty, single-event and all-zero groups are included
+    sizes = rng.integers(0, 60, n_groups)
+    groups = np.repeat(np.arange(n_groups), sizes)
+    values = rng.integers(0, 5, len(groups)) * rng.integers(0, 2, n_groups)[groups]
+    gini = calculate_gini_grouped(groups, values, n_groups)
+    for g in range(n_groups):
+        assert np.isclose(gini[g], calculate_gini(dict(enumerate(values[groups == g]))))
+    days = np.concatenate([np.sort(rng.choice(400, size, replace=False)) for size in sizes])
+    b1, b2 = compute_burstiness_grouped(groups, days, n_groups)
+    epoch = np.datetime64("2023-01-01")
+    for g in range(n_groups):
+        expected = compute_burstiness(list(epoch + days[groups == g]))
+        assert np.allclose((b1[g], b2[g]), expected, equal_nan=True)
+        assert classify_b1_grouped(b1)[g] == classify_b1(b1[g])
+
+@pytest.mark.parametrize("bits", [None, 12])
+def test_rank_sum_tree_matches_reference(bits):
+    rng = np.random.default_rng(0)
+    tree = RankSumTree(bits)
+    stored = []
+    for step in range(2000):
+        if stored and rng.random() < 0.4:
+            tree.remove(stored.pop(rng.integers(len(stored))))
+        else:
+            stored.append(int(rng.integers(0, 300)))
+            tree.insert(stored[-1])
+        if step % 50 == 0:
+            assert np.isclose(tree.gini(), calculate_gini(dict(enumerate(stored))))
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_incremental_state_matches_reference(seed):
+    messages, donations = random_messages(seed)
+    rng = np.random.default_rng(seed)
+    for donor in DONORS:
+        dm = donor_messages(messages, donations, donor).sort_values("dt")
+        state = DonorMetricState(donor)
+        #batches in time order, shuffled inside, with a JSON round trip of the state halfway
+        cuts = np.concatenate(([0], np.sort(rng.integers(0, len(dm), 6)), [len(dm)]))
+        batches = [dm.iloc[a:b] for a, b in zip(cuts[:-1], cuts[1:])]
+        for i, batch in enumerate(batches):
+            state.update(batch.sample(frac=1, random_state=i))
+            if i == 3:
+                state = DonorMetricState.from_state(json.loads(json.dumps(state.to_state())))
+        sent = dm[dm["sender_id"] == donor]
+        assert np.isclose(state.gini(), calculate_gini(sent.groupby("conversation_id").size().to_dict()))
+        assert np.isclose(state.gini("Words"),
+                          calculate_gini(sent.groupby("conversation_id")["word_count"].sum().to_dict()))
+        pd.testing.assert_frame_equal(state.interaction_balance(), compute_interaction_balance(dm, donor),
+                                      check_dtype=False)
+        pd.testing.assert_frame_equal(state.burstiness_table(), reference_burstiness(sent), check_names=False)
+        assert np.allclose(state.burstiness(), compute_burstiness(sorted(set(sent["date_only"]))), equal_nan=True)
+        assert np.allclose(state.burstiness(resolution="second"),
+                           compute_burstiness_streaming(np.sort(sent["dt"].to_numpy())), equal_nan=True)
+
+@pytest.mark.parametrize("dense_cells", [incremental.ROLLING_GINI_DENSE_CELLS, 0])
+@pytest.mark.parametrize("window", [None, 1, 7, 30])
+def test_rolling_gini_matches_reference(monkeypatch, dense_cells, window):
+    #dense day x contact path and RankSumTree path, compared with calculate_gini on every window
+    monkeypatch.setattr(incremental, "ROLLING_GINI_DENSE_CELLS", dense_cells)
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        n = int(rng.integers(1, 300))
+        groups = rng.integers(0, rng.integers(1, 12), n)
+        days = rng.integers(0, rng.integers(1, 90), n) + 19000
+        words = rng.integers(0, 30, n).astype(float)
+        words[rng.random(n) < 0.1] = np.nan
+        result = rolling_gini(groups, days, words, window)
+        assert len(result) == days.max() - days.min() + 1
+        for i, day in enumerate(range(days.min(), days.max() + 1)):
+            inside = (days <= day) & ((days > day - window) if window is not None else True)
+            contacts = pd.Series(np.nan_to_num(words[inside])).groupby(groups[inside])
+            assert result["contacts"].iloc[i] == contacts.ngroups
+            if contacts.ngroups == 0:
+                assert np.isnan(result["Messages"].iloc[i]) and np.isnan(result["Words"].iloc[i])
+                continue
+            assert np.isclose(result["Messages"].iloc[i], calculate_gini(contacts.size().to_dict()))
+            assert np.isclose(result["Words"].iloc[i], calculate_gini(contacts.sum().to_dict()))
@@ -0,0 +1,79 @@
+"""Periods read from the tile pyramid must match a direct groupby of the messages in the same window."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.tile_pyramid import TILE_PERIODS, chats_pyramid, pick_level, read_window, words_pyramid
+
+PERIODS = {"day": "D", "week": "W-SUN", "month": "M"}
+
+@pytest.fixture(scope="module")
+def messages():
+    rng = np.random.default_rng(0)
+    n = 5000
+    #a bit more than 3 years, so the day level has several tiles
+    dt = pd.Timestamp("2019-03-13") + pd.to_timedelta(rng.integers(0, 1130 * 24 * 3600, n), unit="s")
+    return pd.DataFrame({
+        "dt": dt,
+        "word_count": rng.integers(1, 30, n),
+        "conversation_id": rng.choice(["a", "b", "c", "d"], n),
+        "sender_id": rng.choice(["donor", "contact"], n),
+    })
+
+def day_number(date):
+    return np.datetime64(pd.Timestamp(date).date(), "D").astype(np.int64)
+
+def expected(df, level, start, end):
+    #max over the days of the words per day and hour, and messages per period, of the messages in start..end
+    df = df[(df["dt"] >= start) & (df["dt"] < pd.Timestamp(end) + pd.Timedelta(days=1))]
+    period = df["dt"].dt.to_period(PERIODS[level]).dt.start_time
+    daily = df.groupby([period.rename("period"), df["dt"].dt.floor("D"), df["dt"].dt.hour.rename("hour")])["word_count"].sum()
+    words = daily.groupby(level=["period", "hour"]).max().unstack(fill_value=0).reindex(columns=range(24), fill_value=0)
+    return words, df.groupby(period).size()
+
+WINDOWS = [
+    ("2019-03-13", "2022-04-15"),
+    #start and end mid-week and mid-month
+    ("2019-05-15", "2020-11-18"),
+    ("2020-02-27", "2020-03-04"),
+    #one week, starting on a Monday and ending on a Sunday
+    ("2021-06-07", "2021-06-13"),
+    #inside a single month
+    ("2021-08-10", "2021-08-20"),
+    #whole months
+    ("2020-01-01", "2020-12-31"),
+]
+
+@pytest.mark.parametrize("level", ["day", "week", "month"])
+@pytest.mark.parametrize("start, end", WINDOWS)
+def test_words_periods_match_groupby(messages, level, start, end):
+    starts, grid, active = read_window(words_pyramid(messages), level, day_number(start), day_number(end))
+    words, counts = expected(messages, level, start, end)
+    assert len(starts) == len(pd.period_range(start, end, freq=PERIODS[level]))
+    assert (starts == pd.period_range(start, end, freq=PERIODS[level]).start_time).all()
+    np.testing.assert_array_equal(grid, words.reindex(starts, fill_value=0).to_numpy())
+    np.testing.assert_array_equal(active, counts.reindex(starts, fill_value=0).to_numpy())
+
+@pytest.mark.parametrize("level", ["week", "month"])
+@pytest.mark.parametrize("start, end", WINDOWS)
+def test_chat_bits_match_groupby(messages, level, start, end):
+    starts, bits, _ = read_window(chats_pyramid(messages, "donor"), level, day_number(start), day_number(end))
+    df = messages[(messages["dt"] >= start) & (messages["dt"] < pd.Timestamp(end) + pd.Timedelta(days=1))]
+    period = df["dt"].dt.to_period(PERIODS[level]).dt.start_time
+    sent = df["sender_id"] == "donor"
+    expected_bits = (sent.groupby([period, df["conversation_id"]]).any().astype(int)
+                     + 2 * (~sent).groupby([period, df["conversation_id"]]).any().astype(int))
+    expected_bits = expected_bits.unstack(fill_value=0).reindex(index=starts, columns=["a", "b", "c", "d"], fill_value=0)
+    np.testing.assert_array_equal(bits, expected_bits.to_numpy())
+
+def test_pick_level_takes_the_finest_level_that_fits(messages):
+    pyramid = words_pyramid(messages)
+    first, last = day_number("2019-05-15"), day_number("2020-11-18")
+    n_days = last - first + 1
+    n_weeks = len(pd.period_range("2019-05-15", "2020-11-18", freq="W-SUN"))
+    assert n_days > TILE_PERIODS
+    assert pick_level(pyramid, first, last, n_days) == "day"
+    assert pick_level(pyramid, first, last, n_days - 1) == "week"
+    assert pick_level(pyramid, first, last, n_weeks) == "week"
+    assert pick_level(pyramid, first, last, n_weeks - 1) == "month"
+    assert pick_level(pyramid, first, last, 3) == "month"
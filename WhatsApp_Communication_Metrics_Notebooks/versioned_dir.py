@@ -0,0 +1,68 @@
+"""Output directories that are rebuilt while other kernels still read them (columnar store, Parquet export).
+Every build is written to its own new subdirectory of the output directory and published by atomically replacing the
+small pointer file CURRENT, which names the complete subdirectory. Readers follow the pointer, so they never see a
+partial build, and the subdirectory a kernel has open (e.g. memory-mapped) is never deleted in place: older versions
+are removed after publishing when possible, a version that is still in use on Windows is removed by a later build.
+Concurrent builds write to different subdirectories, the last one published wins and no newer version is removed.
+"""
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+POINTER = "CURRENT"
+#unfinished builds older than this (seconds) are from interrupted kernels and are removed
+STALE_BUILD_SECONDS = 24 * 3600
+
+def new_version(path):
+    """Creates and returns a new, unique build subdirectory of path"""
+    version = Path(path) / f"v{time.time_ns()}-{os.getpid()}-{threading.get_ident()}.tmp"
+    version.mkdir(parents=True)
+    return version
+
+def current_version(path):
+    """Subdirectory of path named by the pointer file, None if nothing was published yet"""
+    try:
+        version = Path(path) / (Path(path) / POINTER).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return version if version.is_dir() else None
+
+def publish_version(path, build):
+    """Makes the complete build (from new_version) the current version of path and removes older versions"""
+    path = Path(path)
+    version = build.with_name(build.name[:-len(".tmp")])
+    build.rename(version)
+    pointer = path / f"{POINTER}.{version.name}.tmp"
+    pointer.write_text(version.name)
+    os.replace(pointer, path / POINTER)
+    remove_old_versions(path)
+    return version
+
+def discard_version(build):
+    """Removes a build that failed"""
+    shutil.rmtree(build, ignore_errors=True)
+
+def _stamp(name):
+    #build time of a version from its name, None for other files and directories
+    try:
+        return int(name[1:].split("-")[0]) if name.startswith("v") else None
+    except ValueError:
+        return None
+
+def remove_old_versions(path):
+    #published versions older than the current one (a concurrent build may have published a newer one meanwhile)
+    #and builds that were never finished
+    current = current_version(path)
+    if current is None:
+        return
+    for child in Path(path).iterdir():
+        stamp = _stamp(child.name)
+        if not child.is_dir() or stamp is None or child == current:
+            continue
+        if child.name.endswith(".tmp"):
+            if time.time() - child.stat().st_mtime > STALE_BUILD_SECONDS:
+                shutil.rmtree(child, ignore_errors=True)
+        elif stamp < _stamp(current.name):
+            shutil.rmtree(child, ignore_errors=True)